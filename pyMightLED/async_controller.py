@@ -0,0 +1,339 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import sys
+import Queue
+import logging
+import threading
+import led_controller
+import pwm_controller
+
+LOGGER = logging.getLogger(__name__)
+
+# LedController methods available on the AsyncLedController. Setters can be
+# sent to the device in a pipelined batch.
+LED_CONTROLLER_GETTERS = [
+        'getMode',
+        'getNormalModeParams',
+        'getStrobeModeParams',
+        'getStrobeModeProfile',
+        'getTriggerModeParams',
+        'getTriggerModeProfile',
+        'getStrobeModeProfileArray',
+        'getTriggerModeProfileArray',
+        'getDeviceInfo',
+        'getSnapshot',
+        'printSettings',
+        ]
+
+LED_CONTROLLER_SETTERS = [
+        'setMode',
+        'setNormalModeParams',
+        'setNormalModeCurrent',
+        'setStrobeModeParams',
+        'setStrobeModeProfile',
+        'setTriggerModeParams',
+        'setTriggerModeProfile',
+        ]
+
+LED_CONTROLLER_OTHER = [
+        'reset',
+        'restoreDefaults',
+        'store',
+        'applySettings',
+        'setStrobeModeProfileArray',
+        'setTriggerModeProfileArray',
+        'invalidate',
+        'recordTrace',
+        ]
+
+PWM_CONTROLLER_METHODS = [
+        'enable',
+        'disable',
+        'enableAll',
+        'disableAll',
+        'setValue',
+        'setValueAll',
+        'setTimes',
+        'setTimesAll',
+        'setImax',
+        'setImaxAll',
+        ]
+
+
+class FutureTimeout(led_controller.LedControllerError):
+    """
+    The result of a CommandFuture was not available before the timeout
+    expired.
+    """
+    pass
+
+
+class CommandFuture(object):
+    """
+    The result of a command submitted to an asynchronous controller.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._excInfo = None
+        self._callbacks = []
+
+    def done(self):
+        """
+        Returns True if the command has completed.
+        """
+        return self._event.is_set()
+
+    def result(self,timeout=None):
+        """
+        Waits for the command to complete and returns its result. Raises the
+        command's exception if it failed, or FutureTimeout if it did not
+        complete within timeout seconds.
+        """
+        if not self._event.wait(timeout):
+            raise FutureTimeout, 'command not complete'
+        if self._excInfo is not None:
+            raise self._excInfo[0], self._excInfo[1], self._excInfo[2]
+        return self._result
+
+    def exception(self,timeout=None):
+        """
+        Waits for the command to complete and returns the exception it raised
+        or None if it succeeded.
+        """
+        if not self._event.wait(timeout):
+            raise FutureTimeout, 'command not complete'
+        if self._excInfo is None:
+            return None
+        return self._excInfo[1]
+
+    def addDoneCallback(self,callback):
+        """
+        Calls callback(future) when the command completes, or immediately if
+        it has already completed. Callbacks are called from the worker thread.
+        Exceptions raised by a callback are logged and ignored.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        self._invokeCallback(callback)
+
+    def _setResult(self,result):
+        self._result = result
+        self._setDone()
+
+    def _setException(self,excInfo):
+        self._excInfo = excInfo
+        self._setDone()
+
+    def _setDone(self):
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._invokeCallback(callback)
+
+    def _invokeCallback(self,callback):
+        # A failing callback must not kill the worker thread
+        try:
+            callback(self)
+        except Exception:
+            LOGGER.exception('exception calling callback for %r',self)
+
+
+class CommandWorker(object):
+    """
+    Runs commands submitted from any thread, in order, on a dedicated thread.
+    If a batch function is given, consecutive batchable commands which are
+    waiting in the queue are run inside a single batch so they are sent to
+    the device in one pipelined write.
+    """
+
+    def __init__(self,batch=None,name=None):
+        self.batch = batch
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run,name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self,func,args=(),kwargs={},batchable=False):
+        """
+        Queues func(*args,**kwargs) and returns a CommandFuture for its result.
+        """
+        future = CommandFuture()
+        self._queue.put((future,func,args,kwargs,batchable))
+        return future
+
+    def close(self):
+        """
+        Stops the worker once all queued commands have completed.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            itemList = [self._queue.get()]
+            while itemList[-1] is not None:
+                try:
+                    itemList.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            stop = itemList[-1] is None
+            if stop:
+                itemList.pop()
+            while itemList:
+                n = 1
+                if self.batch is not None and itemList[0][4]:
+                    while n < len(itemList) and itemList[n][4]:
+                        n += 1
+                if n > 1:
+                    self._runBatch(itemList[:n])
+                else:
+                    self._runItem(itemList[0])
+                itemList = itemList[n:]
+            if stop:
+                break
+
+    def _runItem(self,item):
+        future, func, args, kwargs, batchable = item
+        try:
+            result = func(*args,**kwargs)
+        except Exception:
+            future._setException(sys.exc_info())
+        else:
+            future._setResult(result)
+
+    def _runBatch(self,itemList):
+        """
+        Runs the items in a single batch. Errors for individual commands in
+        the batch are passed to the future of the call which issued them. The
+        futures are completed once the batch has been sent, in the order the
+        calls were submitted, including those of calls which failed before
+        their commands were queued.
+        """
+        outcomeList = []
+        batchExcInfo = None
+        try:
+            with self.batch() as batch:
+                for future, func, args, kwargs, batchable in itemList:
+                    n = len(batch.pending)
+                    try:
+                        result = func(*args,**kwargs)
+                    except Exception:
+                        outcomeList.append((future,None,sys.exc_info(),[]))
+                    else:
+                        outcomeList.append((future,result,None,batch.pending[n:]))
+        except led_controller.BatchError:
+            pass
+        except Exception:
+            batchExcInfo = sys.exc_info()
+        for future, result, excInfo, pendingList in outcomeList:
+            if excInfo is None:
+                excInfo = batchExcInfo
+            if excInfo is None:
+                errors = [p.error for p in pendingList if p.error is not None]
+                if errors:
+                    excInfo = (type(errors[0]),errors[0],None)
+            if excInfo is not None:
+                future._setException(excInfo)
+            else:
+                future._setResult(result)
+
+
+class AsyncLedController(object):
+    """
+    Asynchronous interface to a LedController. Each getter and setter of the
+    LedController is available with the same arguments but returns a
+    CommandFuture immediately rather than blocking. Commands are run in the
+    order submitted by a per-device worker thread and setters waiting in the
+    queue are sent to the device together in a pipelined batch. The
+    validation and parsing are those of the wrapped LedController.
+
+    Usage:
+
+    dev = AsyncLedController('/dev/ttyUSB0')
+    dev.setMode(1,'normal')
+    mode = dev.getMode(1).result()
+    dev.close()
+    """
+
+    def __init__(self,port,**kwargs):
+        self.ledController = led_controller.LedController(port,**kwargs)
+        self.num_channels = self.ledController.num_channels
+        self._worker = CommandWorker(batch=self.ledController.batch,name=str(port))
+
+    def submit(self,func,*args,**kwargs):
+        """
+        Submits func(ledController,*args,**kwargs) to the worker and returns a
+        CommandFuture for its result. Useful for running a sequence of
+        commands, e.g., a batch, as a single unit.
+        """
+        return self._worker.submit(func,(self.ledController,)+args,kwargs)
+
+    def close(self):
+        """
+        Waits for all queued commands to complete and closes the device.
+        """
+        self._worker.close()
+        self.ledController.close()
+
+
+class AsyncPwmController(object):
+    """
+    Asynchronous interface to a PwmController. The PwmController methods
+    return CommandFutures and are run in order by a per-device worker thread.
+    """
+
+    def __init__(self,port,**kwargs):
+        self.pwmController = pwm_controller.PwmController(port,**kwargs)
+        self._worker = CommandWorker(name=str(port))
+
+    def close(self):
+        """
+        Waits for all queued commands to complete and closes the device.
+        """
+        self._worker.close()
+        self.pwmController.ledController.close()
+
+
+def makeAsyncMethod(attrName,name,batchable=False):
+    """
+    Returns a method which submits the named method of the wrapped object,
+    given by attrName, to the worker and returns the CommandFuture.
+    """
+    def asyncMethod(self,*args,**kwargs):
+        func = getattr(getattr(self,attrName),name)
+        return self._worker.submit(func,args,kwargs,batchable=batchable)
+    asyncMethod.__name__ = name
+    return asyncMethod
+
+def addAsyncMethods(cls,wrappedCls,attrName,nameList,batchable=False):
+    """
+    Adds asynchronous versions of the named methods of wrappedCls to cls.
+    """
+    for name in nameList:
+        method = makeAsyncMethod(attrName,name,batchable=batchable)
+        method.__doc__ = getattr(wrappedCls,name).__doc__
+        setattr(cls,name,method)
+
+addAsyncMethods(AsyncLedController,led_controller.LedController,'ledController',LED_CONTROLLER_GETTERS)
+addAsyncMethods(AsyncLedController,led_controller.LedController,'ledController',LED_CONTROLLER_SETTERS,batchable=True)
+addAsyncMethods(AsyncLedController,led_controller.LedController,'ledController',LED_CONTROLLER_OTHER)
+addAsyncMethods(AsyncPwmController,pwm_controller.PwmController,'pwmController',PWM_CONTROLLER_METHODS)
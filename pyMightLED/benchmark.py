@@ -0,0 +1,182 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import led_controller
+import pwm_controller
+from timing import getStats, PERCENTILES
+
+DEFAULT_REPEAT = 20
+DEFAULT_SLOW_REPEAT = 3
+DEFAULT_LATENCY = 0.002
+
+
+def runBenchmarks(port,repeat=DEFAULT_REPEAT,slowRepeat=DEFAULT_SLOW_REPEAT):
+    """
+    Runs the benchmarks against the device on the given port. Fast operations
+    are repeated repeat times and slow operations, such as whole profile
+    uploads, slowRepeat times. Returns a dictionary mapping benchmark name to
+    timing statistics, see getStats.
+
+    Note, the benchmarks change the device's settings and restore the factory
+    defaults (without storing them) when done.
+    """
+    results = {}
+    dev = led_controller.LedController(port)
+    try:
+        chanList = range(1,dev.num_channels+1)
+
+        # Round trip latency of single commands
+        cmdFuncs = [
+                ('?MODE',      lambda: dev.getMode(1)),
+                ('?CURRENT',   lambda: dev.getNormalModeParams(1)),
+                ('?STROBE',    lambda: dev.getStrobeModeParams(1)),
+                ('?STRP',      lambda: dev.getStrobeModeProfile(1)),
+                ('?TRIGGER',   lambda: dev.getTriggerModeParams(1)),
+                ('DEVICEINFO', lambda: dev.getDeviceInfo()),
+                ('MODE',       lambda: dev.setMode(1,'disable')),
+                ('CURRENT',    lambda: dev.setNormalModeCurrent(1,0)),
+                ('STRP',       lambda: dev.setStrobeModeProfile(1,0,0,1000)),
+                ]
+        for name, func in cmdFuncs:
+            results['cmd:{0}'.format(name)] = getStats(timeCall(func,repeat))
+
+        # Command throughput - sequential and pipelined
+        numCmds = 4*len(chanList)
+        def sequential():
+            for i in range(numCmds):
+                dev.setMode(chanList[i%len(chanList)],'disable')
+        def pipelined():
+            with dev.batch() as b:
+                for i in range(numCmds):
+                    b.setMode(chanList[i%len(chanList)],'disable')
+        for name, func in (('sequential',sequential),('pipelined',pipelined)):
+            stats = getStats(timeCall(func,repeat))
+            stats['commandsPerSecond'] = numCmds/stats['mean']
+            results['throughput:{0}'.format(name)] = stats
+
+        # End-to-end operations
+        devnull = open(os.devnull,'w')
+        def printSettings():
+            stdout = sys.stdout
+            sys.stdout = devnull
+            try:
+                dev.printSettings()
+            finally:
+                sys.stdout = stdout
+        results['op:printSettings'] = getStats(timeCall(printSettings,slowRepeat))
+        results['op:getSnapshot'] = getStats(timeCall(dev.getSnapshot,slowRepeat))
+        results['op:restoreDefaults'] = getStats(timeCall(dev.restoreDefaults,slowRepeat))
+        devnull.close()
+
+        def uploadProfile():
+            for step in range(led_controller.NUM_PROFILE_STEPS):
+                dev.setStrobeModeProfile(1,step,step%(led_controller.MAX_CURRENT+1),1000)
+        def uploadProfileBatch():
+            with dev.batch() as b:
+                for step in range(led_controller.NUM_PROFILE_STEPS):
+                    b.setStrobeModeProfile(1,step,step%(led_controller.MAX_CURRENT+1),1000)
+        results['op:uploadProfile'] = getStats(timeCall(uploadProfile,slowRepeat))
+        results['op:uploadProfileBatch'] = getStats(timeCall(uploadProfileBatch,slowRepeat))
+        dev.restoreDefaults()
+    finally:
+        dev.close()
+
+    pwmDev = pwm_controller.PwmController(port)
+    try:
+        pwmDev.enableAll()
+        valueLists = [[0.1,0.2,0.3,0.4], [0.4,0.3,0.2,0.1]]
+        count = [0]
+        def setValueAll():
+            pwmDev.setValueAll(valueLists[count[0]%2])
+            count[0] += 1
+        results['op:setValueAll'] = getStats(timeCall(setValueAll,repeat))
+        pwmDev.disableAll()
+    finally:
+        pwmDev.ledController.close()
+    return results
+
+def timeCall(func,repeat):
+    """
+    Calls func repeat times and returns the list of durations in seconds.
+    """
+    durations = []
+    for i in range(repeat):
+        t0 = time.time()
+        func()
+        durations.append(time.time() - t0)
+    return durations
+
+def printResults(results):
+    """
+    Prints the benchmark results as a table of times in ms.
+    """
+    header = ['benchmark', 'mean'] + ['p{0}'.format(p) for p in PERCENTILES] + ['max', 'cmd/s']
+    print('{0:<28}'.format(header[0]) + ''.join(['{0:>10}'.format(h) for h in header[1:]]))
+    for name in sorted(results):
+        stats = results[name]
+        valueList = [stats[h] for h in header[1:-1]]
+        line = '{0:<28}'.format(name) + ''.join(['{0:>10.2f}'.format(1.0e3*v) for v in valueList])
+        if 'commandsPerSecond' in stats:
+            line += '{0:>10.1f}'.format(stats['commandsPerSecond'])
+        print(line)
+
+def getRunInfo(port,emulated):
+    """
+    Returns a dictionary describing the benchmark run.
+    """
+    return {
+            'port'      : port,
+            'emulated'  : emulated,
+            'timestamp' : time.time(),
+            'python'    : platform.python_version(),
+            'platform'  : platform.platform(),
+            }
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='benchmark the LED controller serial command path')
+    parser.add_argument('port', nargs='?', default=None, help='serial port, default is to use the emulator')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='repeat count for fast operations')
+    parser.add_argument('--slow-repeat', type=int, default=DEFAULT_SLOW_REPEAT, help='repeat count for slow operations')
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help='emulator response latency in s')
+    parser.add_argument('--json', default=None, help='write results to this file as JSON')
+    args = parser.parse_args()
+
+    ptyEmulator = None
+    port = args.port
+    if port is None:
+        from emulator import PtyEmulator
+        ptyEmulator = PtyEmulator(latency=args.latency)
+        port = ptyEmulator.port
+
+    try:
+        results = runBenchmarks(port,repeat=args.repeat,slowRepeat=args.slow_repeat)
+    finally:
+        if ptyEmulator is not None:
+            ptyEmulator.close()
+
+    printResults(results)
+    if args.json is not None:
+        with open(args.json,'w') as f:
+            output = {'run': getRunInfo(port,ptyEmulator is not None), 'results': results}
+            json.dump(output,f,indent=2,sort_keys=True)
@@ -0,0 +1,223 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import gzip
+import json
+import time
+from instrumentation import Instrumentation, CommandRecord
+
+TRACE_VERSION = 1
+
+
+class TraceRecorder(object):
+    """
+    Records the commands sent by a LedController, and the responses, to a
+    trace file. The file is gzip compressed if its name ends with '.gz'.
+
+    The first line of the file is a JSON header and each following line a
+    compact JSON list describing one command:
+
+    [startTime, cmd, latency, bytesWritten, bytesRead, timedOut, resp]
+
+    where startTime is in seconds from the start of the recording. Usually
+    created with LedController.recordTrace, e.g.,
+
+    recorder = dev.recordTrace('session.trace.gz')
+    ...
+    recorder.close()
+    """
+
+    def __init__(self,filename,echo=False):
+        self.filename = filename
+        self.startTime = time.time()
+        self.count = 0
+        self._instrumentation = None
+        self._file = openTrace(filename,'w')
+        header = {'version': TRACE_VERSION, 'startTime': self.startTime, 'echo': echo}
+        self._file.write(json.dumps(header) + '\n')
+
+    def __call__(self,record):
+        entry = [
+                round(record.startTime - self.startTime,6),
+                record.cmd,
+                round(record.latency,6),
+                record.bytesWritten,
+                record.bytesRead,
+                int(record.timedOut),
+                record.resp,
+                ]
+        self._file.write(json.dumps(entry,separators=(',',':')) + '\n')
+        self.count += 1
+
+    def attach(self,instrumentation):
+        """
+        Starts recording the commands seen by the given Instrumentation.
+        """
+        instrumentation.addPostHook(self)
+        self._instrumentation = instrumentation
+
+    def close(self):
+        """
+        Stops recording and closes the trace file.
+        """
+        if self._instrumentation is not None:
+            self._instrumentation.removePostHook(self)
+            self._instrumentation = None
+        if not self._file.closed:
+            self._file.close()
+
+
+class ReplayResult(object):
+    """
+    Results of replaying a trace. mismatches is a list of (cmd, recorded,
+    replayed) responses which differ and instrumentation holds the metrics
+    of the replayed commands.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+        self.mismatches = []
+        self.instrumentation = Instrumentation()
+
+    def getMetrics(self):
+        return self.instrumentation.getMetrics()
+
+
+def readTrace(filename):
+    """
+    Reads a trace file. Returns the header dictionary and the list of
+    CommandRecords, with start times in seconds from the start of the
+    recording.
+    """
+    records = []
+    with openTrace(filename,'r') as f:
+        header = json.loads(f.readline())
+        if header.get('version') != TRACE_VERSION:
+            raise ValueError, 'unsupported trace version {0}'.format(header.get('version'))
+        for line in f:
+            if not line.strip():
+                continue
+            startTime, cmd, latency, bytesWritten, bytesRead, timedOut, resp = json.loads(line)
+            records.append(CommandRecord(
+                name=str(cmd.split()[0]),
+                cmd=str(cmd),
+                startTime=startTime,
+                latency=latency,
+                bytesWritten=bytesWritten,
+                bytesRead=bytesRead,
+                timedOut=bool(timedOut),
+                resp=[str(r) for r in resp],
+                ))
+    return header, records
+
+def profileTrace(filename):
+    """
+    Returns the instrumentation metrics, see Instrumentation.getMetrics, of
+    the commands recorded in a trace file.
+    """
+    instrumentation = Instrumentation()
+    header, records = readTrace(filename)
+    for record in records:
+        instrumentation.onCommandDone(record)
+    return instrumentation.getMetrics()
+
+def replayTrace(filename,target=None,speed=None):
+    """
+    Replays the commands of a trace file through the target and compares the
+    responses to those recorded. The target is either a SiriusEmulator,
+    default, whose process method is called directly, or a LedController,
+    e.g., connected to a PtyEmulator, in which case the commands are sent
+    over the serial link. Note, a new SiriusEmulator starts from the
+    default settings so responses to queries may differ from those recorded
+    if the recording did not start from the same state.
+
+    If speed is None the commands are replayed as fast as possible,
+    otherwise at the given multiple of the original speed, e.g. 1.0 for the
+    original timing. Returns a ReplayResult.
+    """
+    header, records = readTrace(filename)
+    if target is None:
+        from emulator import SiriusEmulator
+        target = SiriusEmulator()
+    sendCmd = getattr(target,'_sendCmd',None)
+    if sendCmd is None:
+        target.echo = header.get('echo',False)
+
+    result = ReplayResult()
+    t0 = time.time()
+    for record in records:
+        if speed is not None:
+            dt = t0 + record.startTime/speed - time.time()
+            if dt > 0:
+                time.sleep(dt)
+        t1 = time.time()
+        if sendCmd is None:
+            resp = [r.strip() for r in target.process(record.cmd).split('\n') if r.strip()]
+            complete = True
+        else:
+            resp, complete = sendCmd(record.cmd)
+            if target.echo:
+                resp = [record.cmd] + resp
+        latency = time.time() - t1
+        result.instrumentation.onCommandDone(CommandRecord(
+            name=record.name,
+            cmd=record.cmd,
+            startTime=t1 - t0,
+            latency=latency,
+            bytesWritten=record.bytesWritten,
+            bytesRead=sum([len(r) + 2 for r in resp]),
+            timedOut=not complete,
+            resp=resp,
+            ))
+        if resp != record.resp:
+            result.mismatches.append((record.cmd,record.resp,resp))
+        result.count += 1
+    result.elapsed = time.time() - t0
+    return result
+
+def openTrace(filename,mode):
+    """
+    Opens a trace file, using gzip if the file name ends with '.gz'.
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename,mode + 'b')
+    return open(filename,mode)
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Profiles and replays LED controller traces')
+    parser.add_argument('filename',help='trace file')
+    parser.add_argument('--replay',action='store_true',help='replay through the emulator')
+    parser.add_argument('--speed',type=float,default=None,help='replay speed, default as fast as possible')
+    args = parser.parse_args()
+
+    if args.replay:
+        result = replayTrace(args.filename,speed=args.speed)
+        metrics = result.getMetrics()
+        print('replayed {0} commands in {1:1.3f}s, {2} mismatches'.format(
+            result.count, result.elapsed, len(result.mismatches)))
+    else:
+        metrics = profileTrace(args.filename)
+    print('{0:<12}{1:>8}{2:>12}{3:>12}{4:>12}'.format('cmd','count','total(s)','mean(ms)','max(ms)'))
+    for name in sorted(metrics):
+        m = metrics[name]
+        if not m['count']:
+            continue
+        print('{0:<12}{1:>8}{2:>12.3f}{3:>12.2f}{4:>12.2f}'.format(
+            name, m['count'], m['totalLatency'], 1.0e3*m['meanLatency'], 1.0e3*m['maxLatency']))
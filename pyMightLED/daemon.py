@@ -0,0 +1,498 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import json
+import stat
+import socket
+import threading
+import led_controller
+from led_controller import LedController, LedControllerError, BatchError, ErrorReply, printSnapshot
+from snapshot import ChannelSettings, DeviceSnapshot, PROFILE_FIELDS
+from async_controller import AsyncLedController
+from async_controller import LED_CONTROLLER_GETTERS, LED_CONTROLLER_SETTERS, LED_CONTROLLER_OTHER
+
+DEFAULT_SOCKET_DIR = '/tmp'
+ACCEPT_TIMEOUT = 0.2
+
+# LedController methods which can be called through the daemon. printSettings
+# is provided by the client from getSnapshot. recordTrace writes files on the
+# server and returns an object which cannot be sent to the client.
+LOCAL_METHODS = ['printSettings', 'recordTrace']
+REMOTE_METHODS = LED_CONTROLLER_GETTERS + LED_CONTROLLER_SETTERS + LED_CONTROLLER_OTHER
+REMOTE_METHODS = [m for m in REMOTE_METHODS if m not in LOCAL_METHODS]
+
+# Exceptions which are raised again by the client with the same type
+ERROR_TYPES = dict([(cls.__name__,cls) for cls in (ValueError, TypeError, KeyError)])
+for _name in dir(led_controller):
+    _obj = getattr(led_controller,_name)
+    if isinstance(_obj,type) and issubclass(_obj,LedControllerError):
+        ERROR_TYPES[_name] = _obj
+
+
+class DeviceServer(object):
+    """
+    Owns the LED controller on the given serial port and serves the
+    LedController API to any number of LedClients over a Unix domain socket,
+    by default that given by getSocketPath.
+
+    Requests from all clients are run in the order received by a single
+    AsyncLedController, so setters waiting in its queue are pipelined
+    together. The shadow cache is enabled by default so that getters are
+    answered from the cache and setters which duplicate the device's
+    current state are not sent. Keyword arguments are passed to the
+    LedController.
+
+    A socket left behind at the path by a server which is no longer running
+    is replaced, see removeStaleSocket, but any other file or a running
+    server's socket is not.
+
+    Usage:
+
+    server = DeviceServer('/dev/ttyUSB0')
+    server.serveForever()
+    """
+
+    def __init__(self,port,socketPath=None,**kwargs):
+        kwargs.setdefault('cache',True)
+        self.port = port
+        if socketPath is None:
+            socketPath = getSocketPath(port)
+        self.socketPath = socketPath
+        removeStaleSocket(socketPath)
+        self.device = AsyncLedController(port,**kwargs)
+        self._sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        self._sock.bind(socketPath)
+        self._sockIno = os.stat(socketPath).st_ino
+        self._sock.listen(5)
+        self._sock.settimeout(ACCEPT_TIMEOUT)
+        self._running = True
+        self._connections = []
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        self.close()
+        return False
+
+    def start(self):
+        """
+        Serves clients from a background thread and returns immediately.
+        """
+        self._thread = threading.Thread(target=self.serveForever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def serveForever(self):
+        """
+        Accepts and serves clients until close is called.
+        """
+        while self._running:
+            try:
+                conn, addr = self._sock.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            conn.settimeout(None)
+            self._connections.append(conn)
+            thread = threading.Thread(target=self._serveClient,args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        """
+        Disconnects all clients, waits for queued commands to complete and
+        closes the device.
+        """
+        if not self._running:
+            return
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        self._sock.close()
+        for conn in self._connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            conn.close()
+        self.device.close()
+        try:
+            if os.stat(self.socketPath).st_ino == self._sockIno:
+                os.remove(self.socketPath)
+        except OSError:
+            pass
+
+    def _serveClient(self,conn):
+        """
+        Reads requests, one JSON object per line, from the client until it
+        disconnects. Malformed requests are answered with an error, with the
+        request's id if it can be read, and the client is served on.
+        """
+        sendLock = threading.Lock()
+        f = conn.makefile('rb')
+        try:
+            for line in iter(f.readline,''):
+                if not line.strip():
+                    continue
+                requestId = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request,dict):
+                        raise ValueError, 'request must be a JSON object'
+                    requestId = request.get('id')
+                    self._handleRequest(conn,sendLock,request)
+                except Exception, e:
+                    error = LedControllerError('malformed request: {0}'.format(e))
+                    self._send(conn,sendLock,{'id': requestId, 'error': encodeError(error)})
+        except socket.error:
+            pass
+        finally:
+            f.close()
+
+    def _handleRequest(self,conn,sendLock,request):
+        """
+        Submits the request to the device and sends the response to the
+        client when it completes. Raises an exception if the request is
+        malformed.
+        """
+        requestId = request.get('id')
+        method = request.get('method')
+        if method not in REMOTE_METHODS:
+            error = LedControllerError('unknown method {0}'.format(method))
+            self._send(conn,sendLock,{'id': requestId, 'error': encodeError(error)})
+            return
+        args = decodeValue(request.get('args',[]))
+        kwargs = decodeValue(request.get('kwargs',{}))
+        if not isinstance(args,list) or not isinstance(kwargs,dict):
+            raise TypeError, 'args must be a list and kwargs an object'
+        kwargs = dict([(str(k),v) for k,v in kwargs.iteritems()])
+        def onDone(future):
+            exc = future.exception()
+            if exc is None:
+                resp = {'id': requestId, 'result': encodeValue(future.result())}
+            else:
+                resp = {'id': requestId, 'error': encodeError(exc)}
+            self._send(conn,sendLock,resp)
+        getattr(self.device,method)(*args,**kwargs).addDoneCallback(onDone)
+
+    def _send(self,conn,sendLock,resp):
+        """
+        Sends a response to the client. If the result cannot be encoded an
+        error is sent instead.
+        """
+        try:
+            data = json.dumps(resp)
+        except (TypeError, ValueError), e:
+            error = LedControllerError('unable to encode result: {0}'.format(e))
+            data = json.dumps({'id': resp.get('id'), 'error': encodeError(error)})
+        with sendLock:
+            try:
+                conn.sendall(data + '\n')
+            except socket.error:
+                pass
+
+
+class LedClient(object):
+    """
+    Client for a LED controller served by a DeviceServer. Has the same
+    methods, with the same arguments and return values, as LedController,
+    e.g.,
+
+    dev = LedClient('/dev/ttyUSB0')
+    dev.setMode(1,'normal')
+    print(dev.getMode(1))
+    dev.close()
+
+    Setters issued within a batch are sent without waiting for their
+    replies, see batch. A client should only be used from one thread.
+    """
+
+    def __init__(self,port=None,socketPath=None,timeout=None):
+        if socketPath is None:
+            socketPath = getSocketPath(port)
+        self.socketPath = socketPath
+        self.num_channels = led_controller.NUM_CHANNELS
+        self._sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        self._sock.connect(socketPath)
+        self._sock.settimeout(timeout)
+        self._file = self._sock.makefile('rb')
+        self._nextId = 0
+        self._batch = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        self.close()
+        return False
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def call(self,method,*args,**kwargs):
+        """
+        Calls the named LedController method on the server and returns its
+        result. Within a batch the request is queued and None is returned.
+        """
+        if self._batch is not None and method not in LED_CONTROLLER_SETTERS:
+            raise LedControllerError, 'only setters can be used in a batch'
+        requestId = self._nextId
+        self._nextId += 1
+        request = {
+                'id'     : requestId,
+                'method' : method,
+                'args'   : encodeValue(args),
+                'kwargs' : encodeValue(kwargs),
+                }
+        self._sock.sendall(json.dumps(request) + '\n')
+        if self._batch is not None:
+            self._batch.pending.append((requestId,method))
+            return None
+        return self._receive(requestId,method)
+
+    def batch(self):
+        """
+        Returns a context manager for pipelining setters. Requests issued
+        within the context are sent immediately and the replies are read
+        when the context exits. Raises a BatchError if any of them failed.
+        """
+        if self._batch is None:
+            return ClientBatch(self)
+        return self._batch
+
+    def printSettings(self):
+        """
+        Prints current parameters
+        """
+        printSnapshot(self.getSnapshot())
+
+    def _receive(self,requestId,method):
+        """
+        Reads the response to the given request and returns its result or
+        raises its error.
+        """
+        line = self._file.readline()
+        if not line:
+            raise LedControllerError, 'connection to server closed'
+        resp = json.loads(line)
+        if resp.get('id') != requestId:
+            raise LedControllerError, 'response out of sequence'
+        if resp.get('error') is not None:
+            raise decodeError(resp['error'])
+        return decodeResult(method,decodeValue(resp.get('result')))
+
+
+class ClientBatch(object):
+    """
+    Pipelines the setters issued to a LedClient and reads their replies on
+    exit. See LedClient.batch.
+    """
+
+    def __init__(self,client):
+        self.client = client
+        self.pending = []
+        self._depth = 0
+
+    def __getattr__(self,name):
+        return getattr(self.client,name)
+
+    def __enter__(self):
+        self._depth += 1
+        self.client._batch = self
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        self._depth -= 1
+        if self._depth > 0:
+            return False
+        self.client._batch = None
+        errors = []
+        for requestId, method in self.pending:
+            try:
+                self.client._receive(requestId,method)
+            except LedControllerError, e:
+                errors.append((method,e))
+            except (ValueError, TypeError, KeyError), e:
+                errors.append((method,e))
+        if errors and excType is None:
+            raise BatchError(errors)
+        return False
+
+
+def getSocketPath(port,socketDir=DEFAULT_SOCKET_DIR):
+    """
+    Returns the default socket path for the daemon of the given serial port.
+    """
+    return os.path.join(socketDir,'pyMightLED-{0}.sock'.format(os.path.basename(port)))
+
+def removeStaleSocket(socketPath):
+    """
+    Removes the socket at the given path, left behind by a server which is
+    no longer running, if any. Raises LedControllerError if the path is not
+    a socket or a server is still listening on it.
+    """
+    try:
+        mode = os.stat(socketPath).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise LedControllerError, '{0} exists and is not a socket'.format(socketPath)
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        sock.connect(socketPath)
+    except socket.error:
+        os.remove(socketPath)
+        return
+    finally:
+        sock.close()
+    raise LedControllerError, 'a server is already listening on {0}'.format(socketPath)
+
+def makeRemoteMethod(name):
+    """
+    Returns a LedClient method which calls the named method on the server.
+    """
+    def remoteMethod(self,*args,**kwargs):
+        return self.call(name,*args,**kwargs)
+    remoteMethod.__name__ = name
+    remoteMethod.__doc__ = getattr(LedController,name).__doc__
+    return remoteMethod
+
+def encodeValue(value):
+    """
+    Converts a value to a form which can be sent as JSON. Snapshots and
+    channel settings are tagged with their type, tuples and arrays are
+    converted to lists.
+    """
+    if isinstance(value,DeviceSnapshot):
+        return {'__type__': 'DeviceSnapshot', 'value': {
+            'deviceInfo' : value.deviceInfo,
+            'timestamp'  : value.timestamp,
+            'channels'   : [encodeValue(c) for c in value.channels],
+            }}
+    if isinstance(value,ChannelSettings):
+        settingsDict = dict([(k,encodeValue(v)) for k,v in value._asdict().iteritems()])
+        return {'__type__': 'ChannelSettings', 'value': settingsDict}
+    if hasattr(value,'tolist'):
+        return value.tolist()
+    if isinstance(value,(list,tuple)):
+        return [encodeValue(v) for v in value]
+    if isinstance(value,dict):
+        return dict([(k,encodeValue(v)) for k,v in value.iteritems()])
+    return value
+
+def decodeValue(value):
+    """
+    Converts a value encoded by encodeValue back to its original type.
+    Lists of values which were originally tuples remain lists, see
+    decodeResult.
+    """
+    if isinstance(value,list):
+        return [decodeValue(v) for v in value]
+    if not isinstance(value,dict):
+        return value
+    typeName = value.get('__type__')
+    if typeName == 'DeviceSnapshot':
+        snapshotDict = value['value']
+        return DeviceSnapshot(
+                deviceInfo=snapshotDict['deviceInfo'],
+                timestamp=snapshotDict['timestamp'],
+                channels=tuple([decodeValue(c) for c in snapshotDict['channels']]),
+                )
+    if typeName == 'ChannelSettings':
+        settingsDict = dict([(str(k),v) for k,v in value['value'].iteritems()])
+        for name in PROFILE_FIELDS:
+            if settingsDict.get(name) is not None:
+                settingsDict[name] = tuple([tuple(v) for v in settingsDict[name]])
+        return ChannelSettings(**settingsDict)
+    return dict([(k,decodeValue(v)) for k,v in value.iteritems()])
+
+def decodeResult(method,result):
+    """
+    Restores the tuples and arrays in the result of the given method.
+    """
+    if result is None:
+        return None
+    if method in ('getNormalModeParams','getStrobeModeParams','getTriggerModeParams'):
+        return tuple(result)
+    if method in ('getStrobeModeProfile','getTriggerModeProfile'):
+        return [tuple(v) for v in result]
+    if method in ('getStrobeModeProfileArray','getTriggerModeProfileArray'):
+        iset, tset = result
+        if led_controller.numpy is not None:
+            iset = led_controller.numpy.array(iset,dtype=int)
+            tset = led_controller.numpy.array(tset,dtype=int)
+        return iset, tset
+    if method == 'applySettings':
+        return [(name,tuple(args)) for name, args in result]
+    return result
+
+def encodeError(exc):
+    """
+    Converts an exception to a form which can be sent as JSON.
+    """
+    errorDict = {'type': exc.__class__.__name__, 'message': str(exc)}
+    if isinstance(exc,BatchError):
+        errorDict['errors'] = [[cmd,encodeError(err)] for cmd, err in exc.errors]
+    if isinstance(exc,ErrorReply):
+        errorDict['cmd'] = exc.cmd
+        errorDict['reply'] = exc.reply
+    return errorDict
+
+def decodeError(errorDict):
+    """
+    Returns the exception encoded by encodeError. Unknown exception types are
+    returned as LedControllerError.
+    """
+    cls = ERROR_TYPES.get(errorDict.get('type'),LedControllerError)
+    exc = cls.__new__(cls)
+    Exception.__init__(exc,errorDict.get('message'))
+    if cls is BatchError:
+        exc.errors = [(cmd,decodeError(err)) for cmd, err in errorDict.get('errors',[])]
+    if issubclass(cls,ErrorReply):
+        exc.cmd = errorDict.get('cmd')
+        exc.reply = errorDict.get('reply')
+    return exc
+
+for _name in REMOTE_METHODS:
+    setattr(LedClient,_name,makeRemoteMethod(_name))
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serves LED controllers to local clients')
+    parser.add_argument('ports',nargs='+',help='serial ports of the controllers')
+    parser.add_argument('--socket-dir',default=DEFAULT_SOCKET_DIR,help='directory for the sockets')
+    args = parser.parse_args()
+
+    serverList = []
+    for port in args.ports:
+        socketPath = getSocketPath(port,args.socket_dir)
+        serverList.append(DeviceServer(port,socketPath=socketPath).start())
+        print('serving {0} on {1}'.format(port,socketPath))
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        for server in serverList:
+            server.close()
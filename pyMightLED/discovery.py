@@ -0,0 +1,207 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import json
+import time
+import threading
+import collections
+import serial
+import serial.tools.list_ports
+from led_controller import parseDeviceInfo
+
+PROBE_TIMEOUT = 0.25
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser('~'),'.pyMightLED_ports.json')
+CACHE_VERSION = 1
+
+_DEVICE_FIELDS = ('port', 'serial', 'firmware', 'module', 'deviceInfo', 'usbId')
+
+
+class DiscoveredDevice(collections.namedtuple('DiscoveredDevice',_DEVICE_FIELDS)):
+    """
+    A controller found by discover. usbId is the port's USB hardware id, as
+    reported by serial.tools.list_ports, or None if the port is not a USB
+    port.
+    """
+    __slots__ = ()
+
+    def toDict(self):
+        return dict(self._asdict())
+
+    @classmethod
+    def fromDict(cls,deviceDict):
+        return cls(**dict([(k,deviceDict.get(k)) for k in _DEVICE_FIELDS]))
+
+
+def discover(ports=None,cacheFile=DEFAULT_CACHE_FILE,useCache=True,timeout=PROBE_TIMEOUT):
+    """
+    Finds the LED controllers attached to the system. Returns a dictionary
+    mapping port to DiscoveredDevice for each port with a controller.
+
+    The candidate ports, all serial ports if ports is None, are probed
+    concurrently with a DEVICEINFO query. The controllers found are kept in
+    cacheFile keyed by port and USB hardware id and, if useCache is True,
+    ports whose hardware id is unchanged are not probed again. Ports where
+    no controller answered, e.g. as it was powered off or the port was busy,
+    are not cached, and non USB ports are always probed. Set cacheFile to
+    None to disable the cache.
+    """
+    usbIds = getUsbIds()
+    if ports is None:
+        ports = sorted(usbIds.keys())
+    cache = {}
+    if cacheFile is not None and useCache:
+        cache = loadCache(cacheFile)
+
+    results = {}
+    probeList = []
+    for port in ports:
+        usbId = usbIds.get(port)
+        entry = cache.get(port)
+        if usbId is not None and entry is not None and entry.get('usbId') == usbId and entry.get('device'):
+            results[port] = entry['device']
+        else:
+            probeList.append(port)
+
+    def probe(port):
+        infoStr = probePort(port,timeout=timeout)
+        if infoStr is None:
+            results[port] = None
+        else:
+            results[port] = getDevice(port,infoStr,usbIds.get(port)).toDict()
+    threadList = [threading.Thread(target=probe,args=(p,)) for p in probeList]
+    for thread in threadList:
+        thread.start()
+    for thread in threadList:
+        thread.join()
+
+    if cacheFile is not None:
+        for port in ports:
+            if usbIds.get(port) is None:
+                continue
+            if results[port] is not None:
+                cache[port] = {'usbId': usbIds[port], 'device': results[port]}
+            else:
+                cache.pop(port,None)
+        saveCache(cacheFile,cache)
+
+    devices = {}
+    for port, deviceDict in results.iteritems():
+        if deviceDict is not None:
+            devices[port] = DiscoveredDevice.fromDict(deviceDict)
+    return devices
+
+def findPort(serialNumber,**kwargs):
+    """
+    Returns the port of the controller with the given serial number, or None
+    if it is not found. Keyword arguments are passed to discover.
+    """
+    for port, device in discover(**kwargs).iteritems():
+        if device.serial == serialNumber:
+            return port
+    return None
+
+def probePort(port,timeout=PROBE_TIMEOUT):
+    """
+    Sends a DEVICEINFO query to the given port and returns the device
+    information string, or None if the port cannot be opened or no
+    controller answers within timeout seconds. The port is not configured
+    beyond the serial settings, i.e., echo mode is left unchanged.
+    """
+    try:
+        dev = serial.Serial(port=port,baudrate=9600,timeout=timeout)
+    except (serial.SerialException, OSError):
+        return None
+    try:
+        dev.flushInput()
+        dev.write('DEVICEINFO\r\n')
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            line = dev.readline()
+            if not line:
+                break
+            line = line.strip()
+            if parseDeviceInfo(line)['serial'] is not None:
+                return line
+    except (serial.SerialException, OSError):
+        pass
+    finally:
+        dev.close()
+    return None
+
+def getDevice(port,infoStr,usbId=None):
+    """
+    Returns the DiscoveredDevice for the given device information string.
+    """
+    infoDict = parseDeviceInfo(infoStr)
+    return DiscoveredDevice(
+            port=port,
+            serial=infoDict['serial'],
+            firmware=infoDict['firmware'],
+            module=infoDict['module'],
+            deviceInfo=infoStr,
+            usbId=usbId,
+            )
+
+def getUsbIds():
+    """
+    Returns a dictionary mapping the name of each serial port on the system to
+    its USB hardware id string (vendor and product ids, serial number and
+    location) or None if it is not a USB port.
+    """
+    usbIds = {}
+    for portInfo in serial.tools.list_ports.comports():
+        port, hwid = portInfo[0], portInfo[2]
+        if 'USB' in hwid:
+            usbIds[port] = hwid
+        else:
+            usbIds[port] = None
+    return usbIds
+
+def loadCache(cacheFile):
+    """
+    Loads the discovery cache. Returns an empty cache if the file does not
+    exist or cannot be read.
+    """
+    try:
+        with open(cacheFile,'r') as f:
+            cacheDict = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    if cacheDict.get('version') != CACHE_VERSION:
+        return {}
+    return cacheDict.get('ports',{})
+
+def saveCache(cacheFile,cache):
+    """
+    Saves the discovery cache. The file is replaced atomically so that
+    concurrent readers never see a partial file.
+    """
+    tmpFile = '{0}.{1}.tmp'.format(cacheFile,os.getpid())
+    try:
+        with open(tmpFile,'w') as f:
+            json.dump({'version': CACHE_VERSION, 'ports': cache},f,indent=2,sort_keys=True)
+        os.rename(tmpFile,cacheFile)
+    except (IOError, OSError):
+        if os.path.exists(tmpFile):
+            os.remove(tmpFile)
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    for port, device in sorted(discover().iteritems()):
+        print('{0}: serial {1}, firmware {2}, module {3}'.format(
+            port, device.serial, device.firmware, device.module))
@@ -0,0 +1,185 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import math
+import bisect
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAX_TABLE_LEVELS = 4096
+
+
+class GammaCurve(object):
+    """
+    Intensity curve duty = intensity**gamma.
+    """
+
+    def __init__(self,gamma):
+        self.gamma = float(gamma)
+
+    def __call__(self,value):
+        return value**self.gamma
+
+
+class CalibrationCurve(object):
+    """
+    Intensity curve given by calibration points. Maps normalized intensity to
+    normalized duty cycle by linear interpolation between the points. The
+    intensity values must be increasing.
+    """
+
+    def __init__(self,intensity,duty):
+        if len(intensity) != len(duty) or len(intensity) < 2:
+            raise ValueError, 'intensity and duty must be the same length >= 2'
+        self.intensity = [float(x) for x in intensity]
+        self.duty = [float(y) for y in duty]
+        for x0, x1 in zip(self.intensity[:-1],self.intensity[1:]):
+            if x1 <= x0:
+                raise ValueError, 'intensity values must be increasing'
+
+    def __call__(self,value):
+        i = bisect.bisect_right(self.intensity,value)
+        i = min(max(i,1),len(self.intensity)-1)
+        x0, x1 = self.intensity[i-1], self.intensity[i]
+        y0, y1 = self.duty[i-1], self.duty[i]
+        return y0 + (y1 - y0)*(value - x0)/(x1 - x0)
+
+    @classmethod
+    def fromFile(cls,filename):
+        """
+        Loads calibration points from a text file with two whitespace
+        separated columns, intensity and duty cycle, one point per line. Blank
+        lines and lines starting with '#' are ignored.
+        """
+        intensity, duty = [], []
+        with open(filename,'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line[0] == '#':
+                    continue
+                valueList = line.split()
+                intensity.append(float(valueList[0]))
+                duty.append(float(valueList[1]))
+        return cls(intensity,duty)
+
+
+class DutyCycleTable(object):
+    """
+    Precomputed lookup table mapping normalized intensity, in [0,1], to the
+    nearest achievable (timeHigh,timeLow) pair in us for the given pwm
+    frequency. An optional curve, any callable mapping intensity to
+    normalized duty cycle such as GammaCurve or CalibrationCurve, is applied
+    when the table is built.
+
+    The table has one entry per us of the period, so intensities which map
+    to the same time values give identical entries. If the period is longer
+    than MAX_TABLE_LEVELS us, i.e., below about 244 Hz, no table is built,
+    levels is None, and the time values are computed for each lookup so
+    that they are still the nearest achievable. If levels is given the
+    table has that many entries and values are rounded to the nearest
+    entry.
+    """
+
+    def __init__(self,freq,curve=None,levels=None):
+        self.freq = float(freq)
+        self.curve = curve
+        self.period = int(1.0e6/self.freq)
+        if levels is None and self.period > MAX_TABLE_LEVELS:
+            self.levels = None
+            self.timeHigh = None
+            self.timeLow = None
+            return
+        if levels is None:
+            levels = self.period + 1
+        self.levels = int(levels)
+        timeHighList = []
+        for i in range(self.levels):
+            duty = self._getDuty(float(i)/(self.levels - 1))
+            timeHighList.append(roundHalfUp(duty*self.period))
+        if numpy is not None:
+            self.timeHigh = numpy.array(timeHighList,dtype=int)
+            self.timeLow = self.period - self.timeHigh
+        else:
+            self.timeHigh = timeHighList
+            self.timeLow = [self.period - t for t in timeHighList]
+
+    def getIndex(self,value):
+        """
+        Returns the table index for the given normalized intensity. Values
+        outside of [0,1] are clipped. Only used when a table is built.
+        """
+        value = min(max(float(value),0.0),1.0)
+        return roundHalfUp(value*(self.levels - 1))
+
+    def lookup(self,value):
+        """
+        Returns the (timeHigh,timeLow) pair for the given normalized
+        intensity.
+        """
+        if self.levels is None:
+            timeHigh = roundHalfUp(self._getDuty(min(max(float(value),0.0),1.0))*self.period)
+            return timeHigh, self.period - timeHigh
+        i = self.getIndex(value)
+        return int(self.timeHigh[i]), int(self.timeLow[i])
+
+    def quantize(self,values):
+        """
+        Converts a sequence of normalized intensities to arrays of timeHigh and
+        timeLow values in a single vectorized pass (lists if numpy is not
+        available).
+        """
+        if self.levels is None:
+            return self._quantizeDirect(values)
+        if numpy is not None:
+            values = numpy.clip(numpy.asarray(values,dtype=float),0.0,1.0)
+            # Same rounding as getIndex, numpy.rint rounds halves to even
+            index = numpy.floor(values*(self.levels - 1) + 0.5).astype(int)
+            return self.timeHigh[index], self.timeLow[index]
+        indexList = [self.getIndex(v) for v in values]
+        return [self.timeHigh[i] for i in indexList], [self.timeLow[i] for i in indexList]
+
+    def _getDuty(self,value):
+        """
+        Returns the normalized duty cycle for the given normalized intensity.
+        """
+        if self.curve is None:
+            return value
+        return min(max(self.curve(value),0.0),1.0)
+
+    def _quantizeDirect(self,values):
+        """
+        Computes the timeHigh and timeLow values for each of the given
+        intensities when no table is built. The curve is applied to one value
+        at a time.
+        """
+        if numpy is not None:
+            values = numpy.clip(numpy.asarray(values,dtype=float),0.0,1.0)
+            if self.curve is not None:
+                values = numpy.array([self._getDuty(v) for v in values.tolist()],dtype=float)
+            # Same rounding as lookup
+            timeHigh = numpy.floor(values*self.period + 0.5).astype(int)
+            return timeHigh, self.period - timeHigh
+        timeHighList = [self.lookup(v)[0] for v in values]
+        return timeHighList, [self.period - t for t in timeHighList]
+
+
+def roundHalfUp(value):
+    """
+    Rounds the given non-negative value to the nearest integer, halves are
+    rounded up.
+    """
+    return int(math.floor(value + 0.5))
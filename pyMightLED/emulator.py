@@ -0,0 +1,481 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import socket
+import copy
+import time
+import select
+import threading
+import tty
+from led_controller import NUM_CHANNELS, NUM_PROFILE_STEPS, MAX_CURRENT, MAX_REPEAT
+
+BAUDRATE = 9600
+BITS_PER_BYTE = 10 # 8N1 - start bit, 8 data bits and stop bit
+TX_CHUNK_SIZE = 4  # bytes written at a time when pacing responses
+EOL = '\n\r'
+ACK = '##'
+ERR_COMMAND = '#!'
+ERR_ARGUMENT = '#?'
+DEVICE_INFO = 'Mightex LED Driver:3.30 Device Module No.:SLC-SA04-U Device Serial No.:04-000000-001'
+
+
+class EmulatorError(Exception):
+    """
+    Raised by command handlers when a command's arguments are invalid.
+    """
+    pass
+
+
+class ChannelRegisters(object):
+    """
+    The settings of a single emulated channel.
+    """
+
+    def __init__(self):
+        self.mode = 0
+        self.normal = [MAX_CURRENT, 0]
+        self.strobe = [MAX_CURRENT, 1]
+        self.trigger = [MAX_CURRENT, 0]
+        self.strobeProfile = [(0,0)]*NUM_PROFILE_STEPS
+        self.triggerProfile = [(0,0)]*NUM_PROFILE_STEPS
+
+
+class SiriusEmulator(object):
+    """
+    Emulates the command set of the Mightex Sirius SLC-XXXX-S/U LED
+    controllers. Commands are passed, one line at a time without the line
+    terminator, to process which returns the device's reply.
+
+    The time the device spends busy with each command, in seconds, is given
+    by processTime plus storeTime for STORE and resetTime for Reset. These
+    are used by PtyEmulator to simulate the device's response latency.
+    """
+
+    def __init__(self,deviceInfo=DEVICE_INFO,processTime=0.0,storeTime=0.0,resetTime=0.0):
+        self.deviceInfo = deviceInfo
+        self.processTime = processTime
+        self.storeTime = storeTime
+        self.resetTime = resetTime
+        self.echo = True
+        self.cmdCount = {}
+        self.channels = [ChannelRegisters() for i in range(NUM_CHANNELS)]
+        self.stored = copy.deepcopy(self.channels)
+        self._handlers = {
+                'MODE'       : self._mode,
+                'NORMAL'     : self._normal,
+                'CURRENT'    : self._current,
+                'STROBE'     : self._strobe,
+                'STRP'       : self._strobeProfile,
+                'TRIGGER'    : self._trigger,
+                'TRIGP'      : self._triggerProfile,
+                '?MODE'      : self._getMode,
+                '?CURRENT'   : self._getCurrent,
+                '?STROBE'    : self._getStrobe,
+                '?STRP'      : self._getStrobeProfile,
+                '?TRIGGER'   : self._getTrigger,
+                '?TRIGP'     : self._getTriggerProfile,
+                'ECHOON'     : self._echoOn,
+                'ECHOOFF'    : self._echoOff,
+                'STORE'      : self._store,
+                'RESTOREDEF' : self._restoreDefaults,
+                'DEVICEINFO' : self._deviceInfo,
+                'Reset'      : self._reset,
+                }
+
+    def process(self,line):
+        """
+        Processes a single command line and returns the device's reply
+        including line terminators.
+        """
+        line = line.strip()
+        if not line:
+            return ''
+        valueList = line.split()
+        name, args = valueList[0], valueList[1:]
+        self.cmdCount[name] = self.cmdCount.get(name,0) + 1
+        echo = self.echo
+        handler = self._handlers.get(name)
+        if handler is None:
+            respList = [ERR_COMMAND]
+        else:
+            try:
+                respList = handler(*args)
+            except (EmulatorError, TypeError, ValueError, IndexError):
+                respList = [ERR_ARGUMENT]
+        if echo:
+            respList = [line] + respList
+        return ''.join(['{0}{1}'.format(r,EOL) for r in respList])
+
+    def getBusyTime(self,line):
+        """
+        Returns the time, in seconds, the device is busy processing the given
+        command.
+        """
+        name = (line.split() or [''])[0]
+        busyTime = self.processTime
+        if name == 'STORE':
+            busyTime += self.storeTime
+        elif name == 'Reset':
+            busyTime += self.resetTime
+        return busyTime
+
+    def _getChannel(self,chan):
+        chan = int(chan)
+        if chan < 1 or chan > NUM_CHANNELS:
+            raise EmulatorError, 'invalid channel'
+        return self.channels[chan-1]
+
+    def _getCurrentValue(self,value):
+        value = int(value)
+        if value < 0 or value > MAX_CURRENT:
+            raise EmulatorError, 'invalid current'
+        return value
+
+    def _getStep(self,step):
+        step = int(step)
+        if step < 0 or step >= NUM_PROFILE_STEPS:
+            raise EmulatorError, 'invalid step'
+        return step
+
+    def _getTime(self,t):
+        t = int(t)
+        if t < 0:
+            raise EmulatorError, 'invalid time'
+        return t
+
+    def _mode(self,chan,mode):
+        channel = self._getChannel(chan)
+        mode = int(mode)
+        if mode < 0 or mode > 3:
+            raise EmulatorError, 'invalid mode'
+        channel.mode = mode
+        return [ACK]
+
+    def _normal(self,chan,imax,iset):
+        channel = self._getChannel(chan)
+        imax = self._getCurrentValue(imax)
+        iset = self._getCurrentValue(iset)
+        if iset > imax:
+            raise EmulatorError, 'iset > imax'
+        channel.normal = [imax, iset]
+        return [ACK]
+
+    def _current(self,chan,iset):
+        channel = self._getChannel(chan)
+        iset = self._getCurrentValue(iset)
+        if iset > channel.normal[0]:
+            raise EmulatorError, 'iset > imax'
+        channel.normal[1] = iset
+        return [ACK]
+
+    def _strobe(self,chan,imax,repeat):
+        channel = self._getChannel(chan)
+        imax = self._getCurrentValue(imax)
+        repeat = int(repeat)
+        if repeat < 1 or repeat > MAX_REPEAT:
+            raise EmulatorError, 'invalid repeat'
+        channel.strobe = [imax, repeat]
+        return [ACK]
+
+    def _trigger(self,chan,imax,polarity):
+        channel = self._getChannel(chan)
+        imax = self._getCurrentValue(imax)
+        polarity = int(polarity)
+        if polarity not in (0,1):
+            raise EmulatorError, 'invalid polarity'
+        channel.trigger = [imax, polarity]
+        return [ACK]
+
+    def _strobeProfile(self,chan,step,iset,tset):
+        channel = self._getChannel(chan)
+        step = self._getStep(step)
+        channel.strobeProfile[step] = (self._getCurrentValue(iset), self._getTime(tset))
+        return [ACK]
+
+    def _triggerProfile(self,chan,step,iset,tset):
+        channel = self._getChannel(chan)
+        step = self._getStep(step)
+        channel.triggerProfile[step] = (self._getCurrentValue(iset), self._getTime(tset))
+        return [ACK]
+
+    def _getMode(self,chan):
+        return ['#{0}'.format(self._getChannel(chan).mode)]
+
+    def _getCurrent(self,chan):
+        # The leading value is the channel's calibrated maximum current
+        imax, iset = self._getChannel(chan).normal
+        return ['#{0} {1} {2}'.format(MAX_CURRENT,imax,iset)]
+
+    def _getStrobe(self,chan):
+        return ['#{0} {1}'.format(*self._getChannel(chan).strobe)]
+
+    def _getTrigger(self,chan):
+        return ['#{0} {1}'.format(*self._getChannel(chan).trigger)]
+
+    def _getStrobeProfile(self,chan):
+        return self._profileLines(self._getChannel(chan).strobeProfile)
+
+    def _getTriggerProfile(self,chan):
+        return self._profileLines(self._getChannel(chan).triggerProfile)
+
+    def _profileLines(self,profile):
+        """
+        Returns the lines of a profile dump - the steps up to and including
+        the first step with a zero time. The first line is prefixed with '#'.
+        """
+        respList = []
+        for iset, tset in profile:
+            respList.append('{0} {1}'.format(iset,tset))
+            if tset == 0:
+                break
+        else:
+            respList.append('0 0')
+        respList[0] = '#' + respList[0]
+        return respList
+
+    def _echoOn(self):
+        self.echo = True
+        return [ACK]
+
+    def _echoOff(self):
+        self.echo = False
+        return [ACK]
+
+    def _store(self):
+        self.stored = copy.deepcopy(self.channels)
+        return [ACK]
+
+    def _restoreDefaults(self):
+        self.channels = [ChannelRegisters() for i in range(NUM_CHANNELS)]
+        return [ACK]
+
+    def _deviceInfo(self):
+        return [self.deviceInfo]
+
+    def _reset(self):
+        self.channels = copy.deepcopy(self.stored)
+        self.echo = True
+        return []
+
+
+class PtyEmulator(object):
+    """
+    Serves a SiriusEmulator over a pseudo terminal. The port attribute is the
+    name of the slave device which can be passed to LedController in place of
+    a real serial port, e.g.,
+
+    emulator = PtyEmulator(latency=0.002)
+    dev = LedController(emulator.port)
+
+    latency is the additional time, in seconds, the device takes to respond
+    to each command. If pacing is True bytes are delayed as if they were sent
+    over a link with the given baudrate.
+    """
+
+    def __init__(self,emulator=None,latency=0.0,baudrate=BAUDRATE,pacing=True):
+        if emulator is None:
+            emulator = SiriusEmulator()
+        self.emulator = emulator
+        self.latency = latency
+        self.baudrate = baudrate
+        self.pacing = pacing
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """
+        Stops the emulator and closes the pseudo terminal.
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def getByteTime(self):
+        """
+        Returns the time, in seconds, to transfer one byte over the link.
+        """
+        if not self.pacing:
+            return 0.0
+        return float(BITS_PER_BYTE)/self.baudrate
+
+    def _run(self):
+        rxBuffer = ''
+        rxTime = 0.0
+        txDone = 0.0
+        byteTime = self.getByteTime()
+        while self._running:
+            ready, _, _ = select.select([self._master],[],[],0.05)
+            if not ready:
+                continue
+            try:
+                data = os.read(self._master,1024)
+            except OSError:
+                break
+            rxTime = max(rxTime,time.time())
+            rxBuffer += data
+            while '\r' in rxBuffer or '\n' in rxBuffer:
+                n = len(rxBuffer)
+                line, rxBuffer = splitLine(rxBuffer)
+                # Time at which the line would have finished arriving 
+                rxTime += (n - len(rxBuffer))*byteTime
+                if not line.strip():
+                    continue
+                readyTime = max(rxTime,txDone) + self.latency
+                readyTime += self.emulator.getBusyTime(line)
+                resp = self.emulator.process(line)
+                sleepUntil(readyTime)
+                txDone = self._write(resp,byteTime)
+
+
+    def _write(self,data,byteTime):
+        """
+        Writes the data to the pseudo terminal. If pacing is enabled the data
+        is written a few bytes at a time at the link's byte rate. Returns the
+        time at which the transfer is complete.
+        """
+        t0 = time.time()
+        chunkSize = TX_CHUNK_SIZE if byteTime > 0 else max(len(data),1)
+        for i in range(0,len(data),chunkSize):
+            sleepUntil(t0 + i*byteTime)
+            os.write(self._master,data[i:i+chunkSize])
+        txDone = t0 + len(data)*byteTime
+        sleepUntil(txDone)
+        return txDone
+
+
+class TcpEmulator(object):
+    """
+    Serves a SiriusEmulator over TCP, standing in for a controller behind a
+    serial-over-TCP server such as ser2net. The url attribute, e.g.
+    'socket://127.0.0.1:40000', can be passed to LedController in place of a
+    serial port. latency is the additional time, in seconds, the device takes
+    to respond to each command. One client is served at a time.
+    """
+
+    def __init__(self,emulator=None,latency=0.0,host='127.0.0.1',port=0):
+        if emulator is None:
+            emulator = SiriusEmulator()
+        self.emulator = emulator
+        self.latency = latency
+        self._sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        self._sock.bind((host,port))
+        self._sock.listen(1)
+        self.host, self.port = self._sock.getsockname()
+        self.url = 'socket://{0}:{1}'.format(self.host,self.port)
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """
+        Stops the emulator and closes the listening socket.
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._thread.join()
+        self._sock.close()
+
+    def _run(self):
+        while self._running:
+            ready, _, _ = select.select([self._sock],[],[],0.05)
+            if not ready:
+                continue
+            conn, addr = self._sock.accept()
+            try:
+                self._serve(conn)
+            finally:
+                conn.close()
+
+    def _serve(self,conn):
+        rxBuffer = ''
+        while self._running:
+            ready, _, _ = select.select([conn],[],[],0.05)
+            if not ready:
+                continue
+            try:
+                data = conn.recv(1024)
+            except socket.error:
+                break
+            if not data:
+                break
+            rxBuffer += data
+            while '\r' in rxBuffer or '\n' in rxBuffer:
+                line, rxBuffer = splitLine(rxBuffer)
+                if not line.strip():
+                    continue
+                resp = self.emulator.process(line)
+                time.sleep(self.latency + self.emulator.getBusyTime(line))
+                if resp:
+                    conn.sendall(resp)
+
+
+def splitLine(data):
+    """
+    Splits the first line from the data. Lines may be terminated by any of
+    '\\r\\n', '\\r' or '\\n'.
+    """
+    for i, c in enumerate(data):
+        if c in '\r\n':
+            j = i+1
+            if c == '\r' and data[j:j+1] == '\n':
+                j += 1
+            return data[:i], data[j:]
+    return data, ''
+
+def sleepUntil(t):
+    """
+    Sleeps until the given time.
+    """
+    dt = t - time.time()
+    if dt > 0:
+        time.sleep(dt)
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    emulator = PtyEmulator(latency=0.002)
+    print('emulated device on {0}'.format(emulator.port))
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        emulator.close()
@@ -0,0 +1,237 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import threading
+import led_controller
+from async_controller import AsyncLedController
+
+
+class FleetError(led_controller.LedControllerError):
+    """
+    An operation failed on one or more of the controllers in a fleet. The
+    errors attribute is a dictionary mapping device key to exception and
+    results holds the results of the devices which succeeded.
+    """
+
+    def __init__(self,errors,results):
+        self.errors = errors
+        self.results = results
+        msgList = ['{0}: {1}'.format(k,v) for k,v in sorted(errors.iteritems())]
+        super(FleetError,self).__init__('; '.join(msgList))
+
+
+class FleetResult(object):
+    """
+    Results of an operation fanned out across a fleet. results maps device key
+    to the value returned and errors maps device key to the exception raised.
+    """
+
+    def __init__(self,results,errors):
+        self.results = results
+        self.errors = errors
+
+    def __getitem__(self,key):
+        if key in self.errors:
+            raise self.errors[key]
+        return self.results[key]
+
+    def ok(self):
+        """
+        Returns True if the operation succeeded on all devices.
+        """
+        return not self.errors
+
+    def raiseErrors(self):
+        """
+        Raises a FleetError if the operation failed on any device.
+        """
+        if self.errors:
+            raise FleetError(self.errors,self.results)
+
+
+class ControllerFleet(object):
+    """
+    Opens and owns a group of LED controllers and fans operations out across
+    them in parallel. Each device has its own worker thread, see
+    AsyncLedController, so the time taken by an operation is that of the
+    slowest device rather than the sum over all devices. Commands for the
+    same device are pipelined.
+
+    Devices are keyed by port, or by serial number if keyBy is 'serial', in
+    which case the serial numbers of all devices are read in parallel and a
+    FleetError is raised if two devices report the same serial number. If
+    opening fails all of the devices are closed. Keyword arguments are passed to the LedController, e.g., timeout.
+
+    Usage:
+
+    fleet = ControllerFleet(['/dev/ttyUSB0','/dev/ttyUSB1'])
+    fleet.setModeAll('disable').raiseErrors()
+    snapshots = fleet.getSnapshot().results
+    fleet.close()
+    """
+
+    def __init__(self,portList,keyBy='port',**kwargs):
+        if keyBy not in ('port','serial'):
+            raise ValueError, "keyBy must be either 'port' or 'serial'"
+        self.devices = {}
+        self.ports = {}
+        opened = {}
+        errors = {}
+        def openDevice(port):
+            try:
+                opened[port] = AsyncLedController(port,**kwargs)
+            except Exception, e:
+                errors[port] = e
+        threadList = [threading.Thread(target=openDevice,args=(p,)) for p in portList]
+        for thread in threadList:
+            thread.start()
+        for thread in threadList:
+            thread.join()
+        if errors:
+            for dev in opened.itervalues():
+                dev.close()
+            raise FleetError(errors,{})
+
+        if keyBy == 'serial':
+            keyDict = getSerialKeys(opened)
+        else:
+            keyDict = dict([(port,port) for port in portList])
+        for port in portList:
+            self.devices[keyDict[port]] = opened[port]
+            self.ports[keyDict[port]] = port
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        self.close()
+        return False
+
+    def keys(self):
+        return sorted(self.devices.keys())
+
+    def close(self):
+        """
+        Closes all devices once their queued commands have completed.
+        """
+        for dev in self.devices.itervalues():
+            dev.close()
+        self.devices = {}
+
+    def submit(self,name,*args,**kwargs):
+        """
+        Submits the named AsyncLedController method to all devices. Returns a
+        dictionary mapping device key to CommandFuture.
+        """
+        futures = {}
+        for key, dev in self.devices.iteritems():
+            futures[key] = getattr(dev,name)(*args,**kwargs)
+        return futures
+
+    def call(self,name,*args,**kwargs):
+        """
+        Calls the named LedController method on all devices in parallel and
+        waits for them to complete. Returns a FleetResult.
+        """
+        return self.wait(self.submit(name,*args,**kwargs))
+
+    def callEach(self,name,argsDict):
+        """
+        Calls the named LedController method on each device in argsDict with
+        the device's own arguments, argsDict maps device key to a tuple of
+        arguments. Returns a FleetResult.
+        """
+        futures = {}
+        for key, args in argsDict.iteritems():
+            futures[key] = getattr(self.devices[key],name)(*args)
+        return self.wait(futures)
+
+    def wait(self,futures):
+        """
+        Waits for a dictionary of futures, as returned by submit, to complete
+        and returns a FleetResult.
+        """
+        results = {}
+        errors = {}
+        for key, future in futures.iteritems():
+            exc = future.exception()
+            if exc is None:
+                results[key] = future.result()
+            else:
+                errors[key] = exc
+        return FleetResult(results,errors)
+
+    def setMode(self,chan,mode):
+        return self.call('setMode',chan,mode)
+
+    def setModeAll(self,mode):
+        """
+        Sets the mode of all channels of all devices. The commands for each
+        device are sent as a single pipelined batch.
+        """
+        futures = {}
+        for key, dev in self.devices.iteritems():
+            futures[key] = dev.submit(setModeAll,mode)
+        return self.wait(futures)
+
+    def setNormalModeCurrent(self,chan,iset):
+        return self.call('setNormalModeCurrent',chan,iset)
+
+    def getSnapshot(self):
+        return self.call('getSnapshot')
+
+    def store(self):
+        return self.call('store')
+
+
+def getSerialKeys(devices):
+    """
+    Reads the serial numbers of the given devices, a dictionary mapping port
+    to AsyncLedController, in parallel. Returns a dictionary mapping port to
+    serial number, or to port if the serial number cannot be found. Closes
+    all of the devices and raises a FleetError if any of them fail or two
+    devices report the same serial number.
+    """
+    futures = dict([(port,dev.getDeviceInfo()) for port, dev in devices.iteritems()])
+    keyDict = {}
+    errors = {}
+    for port, future in futures.iteritems():
+        exc = future.exception()
+        if exc is None:
+            infoStr = future.result()
+            keyDict[port] = led_controller.parseDeviceInfo(infoStr)['serial'] or port
+        else:
+            errors[port] = exc
+    portDict = {}
+    for port in sorted(keyDict.keys()):
+        key = keyDict[port]
+        if key in portDict:
+            msg = 'serial number {0} also reported by {1}'.format(key,portDict[key])
+            errors[port] = led_controller.LedControllerError(msg)
+        else:
+            portDict[key] = port
+    if errors:
+        for dev in devices.itervalues():
+            dev.close()
+        raise FleetError(errors,{})
+    return keyDict
+
+def setModeAll(dev,mode):
+    """
+    Sets the mode of all channels of the given LedController in one batch.
+    """
+    with dev.batch() as b:
+        for chan in range(1,dev.num_channels+1):
+            b.setMode(chan,mode)
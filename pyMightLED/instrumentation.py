@@ -0,0 +1,188 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import bisect
+
+# Upper edges, in seconds, of the latency histogram bins. Latencies above the
+# last edge are counted in an overflow bin.
+LATENCY_BIN_EDGES = [
+        0.001, 0.002, 0.005,
+        0.01,  0.02,  0.05,
+        0.1,   0.2,   0.5,
+        1.0,   2.0,   5.0,
+        ]
+
+
+class CommandRecord(object):
+    """
+    Describes a single command sent to the device.
+
+    name = command name, e.g. 'MODE'
+    cmd = full command string, e.g. 'MODE 1 2'
+    startTime = time at which the command was written
+    latency = time, in seconds, from writing the command to receiving the
+    complete response
+    bytesWritten = number of bytes written
+    bytesRead = number of bytes of the response read
+    timedOut = True if the timeout expired before the response was complete
+    resp = list of response lines
+    """
+
+    def __init__(self,name,cmd,startTime,latency,bytesWritten,bytesRead,timedOut,resp):
+        self.name = name
+        self.cmd = cmd
+        self.startTime = startTime
+        self.latency = latency
+        self.bytesWritten = bytesWritten
+        self.bytesRead = bytesRead
+        self.timedOut = timedOut
+        self.resp = resp
+
+
+class CommandStats(object):
+    """
+    Counters and latency histogram for a single command type.
+    """
+
+    def __init__(self,binEdges):
+        self.binEdges = binEdges
+        self.count = 0
+        self.timeouts = 0
+        self.bytesWritten = 0
+        self.bytesRead = 0
+        self.totalLatency = 0.0
+        self.minLatency = None
+        self.maxLatency = None
+        self.histogram = [0]*(len(binEdges) + 1)
+
+    def add(self,record):
+        self.count += 1
+        self.timeouts += int(record.timedOut)
+        self.bytesWritten += record.bytesWritten
+        self.bytesRead += record.bytesRead
+        self.totalLatency += record.latency
+        if self.minLatency is None or record.latency < self.minLatency:
+            self.minLatency = record.latency
+        if self.maxLatency is None or record.latency > self.maxLatency:
+            self.maxLatency = record.latency
+        self.histogram[bisect.bisect_left(self.binEdges,record.latency)] += 1
+
+    def toDict(self):
+        if self.count:
+            meanLatency = self.totalLatency/self.count
+        else:
+            meanLatency = None
+        return {
+                'count'        : self.count,
+                'timeouts'     : self.timeouts,
+                'bytesWritten' : self.bytesWritten,
+                'bytesRead'    : self.bytesRead,
+                'totalLatency' : self.totalLatency,
+                'meanLatency'  : meanLatency,
+                'minLatency'   : self.minLatency,
+                'maxLatency'   : self.maxLatency,
+                'histogram'    : {
+                    'binEdges' : list(self.binEdges),
+                    'counts'   : list(self.histogram),
+                    },
+                }
+
+
+class Instrumentation(object):
+    """
+    Collects per command type counters and latency histograms for the
+    commands sent by a LedController and calls any registered hooks.
+
+    Pre-command hooks are called as hook(cmd) just before the command is
+    written.  Post-command hooks are called as hook(record), where record is
+    a CommandRecord, once the response has been received or the timeout has
+    expired.
+
+    Usage:
+
+    instrumentation = dev.instrument()
+    ...
+    metrics = instrumentation.getMetrics()
+    """
+
+    def __init__(self,binEdges=LATENCY_BIN_EDGES):
+        self.binEdges = list(binEdges)
+        self.preHooks = []
+        self.postHooks = []
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the counters and histograms. Hooks are kept.
+        """
+        self.stats = {}
+
+    def addPreHook(self,hook):
+        self.preHooks.append(hook)
+
+    def addPostHook(self,hook):
+        self.postHooks.append(hook)
+
+    def removePreHook(self,hook):
+        self.preHooks.remove(hook)
+
+    def removePostHook(self,hook):
+        self.postHooks.remove(hook)
+
+    def onCommandStart(self,cmd):
+        """
+        Called by the LedController before a command is written.
+        """
+        for hook in self.preHooks:
+            hook(cmd)
+
+    def onCommandDone(self,record):
+        """
+        Called by the LedController when a command has completed.
+        """
+        try:
+            stats = self.stats[record.name]
+        except KeyError:
+            stats = CommandStats(self.binEdges)
+            self.stats[record.name] = stats
+        stats.add(record)
+        for hook in self.postHooks:
+            hook(record)
+
+    def getMetrics(self):
+        """
+        Returns the counters and histograms as a dictionary mapping command
+        name to a dictionary of metrics. The entry 'total' summarizes all
+        commands.
+        """
+        metrics = {}
+        total = CommandStats(self.binEdges)
+        for name, stats in self.stats.iteritems():
+            metrics[name] = stats.toDict()
+            total.count += stats.count
+            total.timeouts += stats.timeouts
+            total.bytesWritten += stats.bytesWritten
+            total.bytesRead += stats.bytesRead
+            total.totalLatency += stats.totalLatency
+            total.histogram = [a+b for a,b in zip(total.histogram,stats.histogram)]
+            for value in (stats.minLatency, stats.maxLatency):
+                if value is None:
+                    continue
+                if total.minLatency is None or value < total.minLatency:
+                    total.minLatency = value
+                if total.maxLatency is None or value > total.maxLatency:
+                    total.maxLatency = value
+        metrics['total'] = total.toDict()
+        return metrics
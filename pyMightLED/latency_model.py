@@ -0,0 +1,224 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import math
+import json
+import collections
+
+DEFAULT_ALPHA = 0.1
+DEFAULT_PERCENTILE = 99
+DEFAULT_WINDOW = 100
+DEFAULT_MARGIN = 2.0
+DEFAULT_MIN_SAMPLES = 5
+DEFAULT_DEADLINE_MARGIN = 0.05
+MIN_TIMEOUT = 0.02
+TIMEOUT_QUANTUM = 0.01
+
+
+class CommandLatency(object):
+    """
+    Running latency estimate for a single command type. Keeps an
+    exponentially weighted moving average, and variance, of the latency and
+    a window of the most recent samples.
+    """
+
+    def __init__(self,alpha=DEFAULT_ALPHA,window=DEFAULT_WINDOW):
+        self.alpha = alpha
+        self.count = 0
+        self.mean = None
+        self.var = 0.0
+        self.samples = collections.deque(maxlen=window)
+
+    def add(self,latency):
+        self.count += 1
+        self.samples.append(latency)
+        if self.mean is None:
+            self.mean = latency
+            return
+        diff = latency - self.mean
+        self.mean += self.alpha*diff
+        self.var = (1.0 - self.alpha)*(self.var + self.alpha*diff*diff)
+
+    def getPercentile(self,percentile):
+        """
+        Returns the given percentile of the recent samples.
+        """
+        sortedList = sorted(self.samples)
+        i = int(math.ceil(percentile/100.0*len(sortedList))) - 1
+        return sortedList[min(max(i,0),len(sortedList)-1)]
+
+    def toDict(self):
+        return {
+                'count'   : self.count,
+                'mean'    : self.mean,
+                'var'     : self.var,
+                'samples' : list(self.samples),
+                }
+
+    def fromDict(self,latencyDict):
+        self.count = latencyDict['count']
+        self.mean = latencyDict['mean']
+        self.var = latencyDict['var']
+        self.samples.clear()
+        self.samples.extend(latencyDict['samples'])
+
+
+class LatencyModel(object):
+    """
+    Learns the response latency of each command type and derives per
+    command read timeouts from it. The timeout for a command is
+
+    margin*max(percentile of recent latencies, mean + 3*std)
+
+    rounded up to TIMEOUT_QUANTUM and limited to [MIN_TIMEOUT,maxTimeout].
+    Until minSamples have been seen maxTimeout is used. Commands given in
+    minTimeouts, i.e., slow commands such as STORE, always use the timeout
+    given there as a safety margin.
+
+    The timeout is a soft deadline, the time by which a response normally
+    starts. The hard deadline, after which a response is given up on, is the
+    timeout plus deadlineMargin, no more than maxTimeout.
+
+    The model can be saved and loaded so that it carries over between
+    sessions.
+    """
+
+    def __init__(self,maxTimeout,minTimeouts=None,alpha=DEFAULT_ALPHA,percentile=DEFAULT_PERCENTILE,
+            window=DEFAULT_WINDOW,margin=DEFAULT_MARGIN,minSamples=DEFAULT_MIN_SAMPLES,
+            deadlineMargin=DEFAULT_DEADLINE_MARGIN):
+        self.maxTimeout = maxTimeout
+        self.minTimeouts = dict(minTimeouts or {})
+        self.alpha = alpha
+        self.percentile = percentile
+        self.window = window
+        self.margin = margin
+        self.minSamples = minSamples
+        self.deadlineMargin = deadlineMargin
+        self.latency = {}
+        self._timeouts = {}
+
+    @property
+    def maxTimeout(self):
+        return self._maxTimeout
+
+    @maxTimeout.setter
+    def maxTimeout(self,value):
+        # The timeouts derived from the old limit no longer apply
+        self._maxTimeout = value
+        self._timeouts = {}
+
+    def update(self,name,latency):
+        """
+        Adds a latency sample, in seconds, for the given command name.
+        """
+        try:
+            cmdLatency = self.latency[name]
+        except KeyError:
+            cmdLatency = CommandLatency(self.alpha,self.window)
+            self.latency[name] = cmdLatency
+        cmdLatency.add(latency)
+        self._timeouts.pop(name,None)
+
+    def getTimeout(self,name):
+        """
+        Returns the read timeout, in seconds, for the given command name.
+        """
+        try:
+            return self._timeouts[name]
+        except KeyError:
+            pass
+        minTimeout = self.minTimeouts.get(name)
+        cmdLatency = self.latency.get(name)
+        if minTimeout is not None:
+            timeout = minTimeout
+        elif cmdLatency is None or cmdLatency.count < self.minSamples:
+            timeout = self.maxTimeout
+        else:
+            estimate = max(
+                    cmdLatency.getPercentile(self.percentile),
+                    cmdLatency.mean + 3.0*math.sqrt(cmdLatency.var),
+                    )
+            timeout = math.ceil(self.margin*estimate/TIMEOUT_QUANTUM)*TIMEOUT_QUANTUM
+            timeout = min(max(timeout,MIN_TIMEOUT),self.maxTimeout)
+        self._timeouts[name] = timeout
+        return timeout
+
+    def getDeadline(self,name):
+        """
+        Returns the hard deadline, in seconds, for the given command name.
+        """
+        timeout = self.getTimeout(name)
+        if name in self.minTimeouts:
+            return timeout
+        return min(timeout + self.deadlineMargin,self.maxTimeout)
+
+    def getTimeouts(self):
+        """
+        Returns a dictionary mapping command name to the current timeout for
+        all commands seen so far.
+        """
+        return dict([(name,self.getTimeout(name)) for name in self.latency])
+
+    def toDict(self):
+        """
+        Returns the model, including its settings, as a dictionary.
+        """
+        return {
+                'maxTimeout'     : self.maxTimeout,
+                'minTimeouts'    : self.minTimeouts,
+                'alpha'          : self.alpha,
+                'percentile'     : self.percentile,
+                'window'         : self.window,
+                'margin'         : self.margin,
+                'minSamples'     : self.minSamples,
+                'deadlineMargin' : self.deadlineMargin,
+                'latency'        : dict([(k,v.toDict()) for k,v in self.latency.iteritems()]),
+                }
+
+    @classmethod
+    def fromDict(cls,modelDict):
+        """
+        Creates a model from a dictionary as returned by toDict.
+        """
+        model = cls(
+                modelDict['maxTimeout'],
+                minTimeouts=modelDict['minTimeouts'],
+                alpha=modelDict['alpha'],
+                percentile=modelDict['percentile'],
+                window=modelDict['window'],
+                margin=modelDict['margin'],
+                minSamples=modelDict['minSamples'],
+                deadlineMargin=modelDict.get('deadlineMargin',DEFAULT_DEADLINE_MARGIN),
+                )
+        for name, latencyDict in modelDict['latency'].iteritems():
+            cmdLatency = CommandLatency(model.alpha,model.window)
+            cmdLatency.fromDict(latencyDict)
+            model.latency[str(name)] = cmdLatency
+        return model
+
+    def save(self,filename):
+        """
+        Saves the model to a JSON file.
+        """
+        with open(filename,'w') as f:
+            json.dump(self.toDict(),f,indent=2,sort_keys=True)
+
+    @classmethod
+    def load(cls,filename):
+        """
+        Loads a model saved with save.
+        """
+        with open(filename,'r') as f:
+            return cls.fromDict(json.load(f))
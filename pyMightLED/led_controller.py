@@ -13,8 +13,24 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import os
+import re
+import json
 import serial
 import time
+import functools
+import threading
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from shadow_cache import ShadowCache
+from snapshot import ChannelSettings, DeviceSnapshot, diffSettings, diffProfile
+from instrumentation import Instrumentation, CommandRecord
+from command_trace import TraceRecorder
+from latency_model import LatencyModel
+from transport import openTransport, ReaderThread, TransportError
+from write_scheduler import WriteScheduler, getChannel, getPriority, PRIORITY_SAFETY
 
 MODE_STR2INT = {
         'disable' : 0,
@@ -28,58 +44,472 @@ POLARITY_STR2INT = {
         'falling' : 1,
         }
 
-RESET_SLEEP_DT = 4.0
-STORE_TIMEOUT = 2.0
+RESET_SLEEP_DT = 4.0     # upper bound on the time taken to reset
+STORE_TIMEOUT = 2.0      # upper bound on the time taken to store settings
+# Minimum read timeouts of slow commands, see LatencyModel
+SLOW_CMD_TIMEOUTS = {
+        'STORE'      : STORE_TIMEOUT,
+        'RESTOREDEF' : STORE_TIMEOUT,
+        }
+READY_POLL_DT = 0.05     # initial interval between readiness probes
+READY_POLL_MAX_DT = 0.5  # maximum interval between readiness probes
+READY_BACKOFF = 2.0      # growth factor of the probe interval
 MAX_REPEAT = 99999999
 MAX_CURRENT = 1000
 NUM_PROFILE_STEPS = 128
 NUM_CHANNELS = 4
 DEBUG = False 
 
-class LedController(serial.Serial):
+# Response framing - how the reply to each command is terminated.
+FRAME_LINE = 'line'        # single line reply
+FRAME_ACK = 'ack'          # lines up to and including the first '#' line
+FRAME_PROFILE = 'profile'  # profile dump ending with a zero time step 
+FRAME_UNKNOWN = None       # unknown - read until the timeout expires
+
+# Version of the state files written by saveState
+STATE_FILE_VERSION = 1
+
+# Queries sent for each channel by getSnapshot
+SNAPSHOT_QUERIES = ['?MODE', '?CURRENT', '?STROBE', '?STRP', '?TRIGGER', '?TRIGP']
+
+# Patterns for extracting values from the DEVICEINFO string
+DEVICE_INFO_PATTERNS = {
+        'firmware' : r'Driver:\s*(\S+)',
+        'module'   : r'Module No\.:\s*(\S+)',
+        'serial'   : r'Serial No\.:\s*(\S+)',
+        }
+
+PROFILE_SETTERS = {
+        'strobe'  : 'setStrobeModeProfile',
+        'trigger' : 'setTriggerModeProfile',
+        }
+
+CMD_FRAMING = {
+        'ECHOON'  : FRAME_ACK,
+        'ECHOOFF' : FRAME_ACK,
+        '?STRP'   : FRAME_PROFILE,
+        '?TRIGP'  : FRAME_PROFILE,
+        'Reset'   : FRAME_UNKNOWN,
+        }
+
+# Minimum number of values in each line of the reply to a query
+QUERY_NUM_VALUES = {
+        '?MODE'    : 1,
+        '?CURRENT' : 2,
+        '?STROBE'  : 2,
+        '?TRIGGER' : 2,
+        '?STRP'    : 2,
+        '?TRIGP'   : 2,
+        }
+
+# Commands which change the device's settings, i.e., which make the settings
+# differ from those in non-volatile memory
+STATE_CMDS = ['MODE', 'NORMAL', 'CURRENT', 'STROBE', 'STRP', 'TRIGGER', 'TRIGP', 'RESTOREDEF']
+
+# Attributes of the serial interface forwarded to the transport
+SERIAL_ATTRIBUTES = [
+        'name',
+        'baudrate',
+        'bytesize',
+        'parity',
+        'stopbits',
+        'xonxoff',
+        'rtscts',
+        'dsrdtr',
+        'fileno',
+        'flushOutput',
+        'sendBreak',
+        'setDTR',
+        'setRTS',
+        'getCTS',
+        'getDSR',
+        ]
+
+# Commands which are not safe to repeat when their response is lost
+NON_IDEMPOTENT_CMDS = ['Reset', 'STORE']
+
+class LedControllerError(Exception):
+    """
+    Base class for errors reported by the LED controller.
+    """
+    pass
+
+class ResponseTimeout(LedControllerError):
+    """
+    The complete response to a command was not received before the timeout
+    expired.
+    """
+    pass
+
+class BatchError(LedControllerError):
+    """
+    One or more commands in a batch failed. The errors attribute is a list of
+    (cmd, error) pairs in the order the commands were queued.
+    """
+
+    def __init__(self,errors):
+        self.errors = errors
+        msgList = ['{0}: {1}'.format(cmd,err) for cmd, err in errors]
+        super(BatchError,self).__init__('; '.join(msgList))
+
+class CommandSuperseded(LedControllerError):
+    """
+    A command queued in a batch was dropped, without being sent, because
+    another thread disabled its channel while the batch was being sent.
+    """
+    pass
+
+class ErrorReply(LedControllerError):
+    """
+    The device replied to a command with an error. The cmd and reply
+    attributes hold the command string and the device's reply.
+    """
+
+    def __init__(self,cmd,reply):
+        self.cmd = cmd
+        self.reply = reply
+        super(ErrorReply,self).__init__('{0} replied {1}'.format(cmd,reply))
+
+class CommandError(ErrorReply):
+    """
+    The device did not recognize the command, reply '#!'.
+    """
+    pass
+
+class ArgumentError(ErrorReply):
+    """
+    The device rejected the command's arguments, reply '#?'.
+    """
+    pass
+
+class MalformedResponse(LedControllerError):
+    """
+    The response to a command was empty, truncated or otherwise not of the
+    expected form.
+    """
+    pass
+
+# Error replies and the exception raised for each
+ERROR_REPLIES = {
+        '#!' : CommandError,
+        '#?' : ArgumentError,
+        }
+
+
+def synchronized(method):
+    """
+    Decorator which runs a LedController method under the controller's lock.
+    """
+    @functools.wraps(method)
+    def synchronizedMethod(self,*args,**kwargs):
+        with self._lock:
+            return method(self,*args,**kwargs)
+    return synchronizedMethod
+
+
+class LedController(object):
     """
     Provides a serial interface to the Mightex Sirius SLC-XXXX-S/U multi-channel
     LED Controllers.
+
+    port is a serial port name, 'socket://host:port', 'loop://' or a
+    transport object, see transport.openTransport. Data is read from the
+    transport by a dedicated reader thread. timeout is the default read
+    timeout, see the timeout attribute. If cache is True, or a stateFile is
+    given, the device's last known state is kept in a shadow cache, see
+    invalidate and loadState. If retries is > 0 commands which are safe to
+    repeat are resent when their response is lost or invalid. See connect
+    for lazy and startupQueries and batch for the scheduler.
+
+    A controller can be shared between threads. Each command, batch and
+    public method runs under an internal lock, batches and deferStore
+    contexts are per thread.
     """
 
-    def __init__(self,port, timeout=0.1):
-        super(LedController,self).__init__(
-                port=port,
-                baudrate=9600,
-                bytesize=serial.EIGHTBITS,
-                parity=serial.PARITY_NONE,
-                stopbits=serial.STOPBITS_ONE,
-                xonxoff=False,
-                rtscts=False,
-                dsrdtr=False,
-                timeout=timeout,
-                )
+    def __init__(self,port, timeout=0.1, cache=False, retries=0, latencyModel=None,
+            lazy=False, startupQueries=None, stateFile=None, scheduler=None):
+        self.transport = None
+        self._portArg = port
+        self._timeout = timeout
+        if isinstance(port,basestring):
+            self.port = port
+        else:
+            self.port = port.port
+        self.startupQueries = list(startupQueries or [])
+        self.stateFile = stateFile
+        self.echo = False
         self.num_channels = NUM_CHANNELS
-        # Put device in known echo state
-        self._echoOff(checkResponse=False)
+        self.latency = {}
+        self.lastLatency = None
+        self._rxBuffer = ''
+        self._rxCount = 0
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._urgentLock = threading.Lock()
+        self._urgent = []
+        self._sender = None
+        self.reader = None
+        self.retries = retries
+        self.dirty = True
+        if latencyModel is None:
+            latencyModel = LatencyModel(timeout,minTimeouts=SLOW_CMD_TIMEOUTS)
+        self.latencyModel = latencyModel
+        if scheduler is None:
+            scheduler = WriteScheduler()
+        self.scheduler = scheduler
+        self.instrumentation = None
+        if cache or stateFile is not None:
+            self.cache = ShadowCache(NUM_CHANNELS,NUM_PROFILE_STEPS)
+        else:
+            self.cache = None
+        if stateFile is not None and os.path.exists(stateFile):
+            self.loadState(stateFile)
+        if not lazy:
+            self.connect()
+
+    def __getattr__(self,name):
+        # Forward the rest of the serial interface to the transport, if open
+        transport = self.__dict__.get('transport')
+        if name not in SERIAL_ATTRIBUTES or transport is None:
+            raise AttributeError, name
+        return getattr(transport,name)
+
+    @property
+    def timeout(self):
+        """
+        Default read timeout, in seconds, and the upper limit of the
+        per command deadlines learned by the latencyModel, see LatencyModel.
+        Responses are read until the command's hard deadline, or timeout for
+        commands not learned yet. Set the latencyModel attribute to None to
+        always use timeout. Setting timeout also sets the model's upper limit.
+        """
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self,value):
+        self._timeout = value
+        if self.latencyModel is not None:
+            self.latencyModel.maxTimeout = value
+
+    @property
+    def _batch(self):
+        # Batches are per thread
+        return getattr(self._local,'batch',None)
+
+    @_batch.setter
+    def _batch(self,batch):
+        self._local.batch = batch
+
+    @property
+    def _deferredStore(self):
+        # Deferred stores are per thread, like batches
+        return getattr(self._local,'deferredStore',None)
+
+    @_deferredStore.setter
+    def _deferredStore(self,deferredStore):
+        self._local.deferredStore = deferredStore
+
+    @synchronized
+    def connect(self):
+        """
+        Opens the port, if not already open, and puts the device in a known
+        echo state. Called by the constructor unless lazy is True, otherwise
+        by the first command sent. The startupQueries, e.g. ['?MODE','?STROBE'],
+        for each channel whose values are not already cached are sent in the
+        same write as ECHOOFF. Cannot be used in a batch as the responses to
+        the queries are needed.
+        """
+        if self.transport is not None:
+            return
+        if self._batch is not None:
+            raise LedControllerError, 'connect cannot be used in a batch'
+        self.transport = openTransport(self._portArg,timeout=self._timeout)
+        self.reader = ReaderThread(self.transport,name='{0} reader'.format(self.port))
+        queryList = []
+        if self.cache is not None:
+            for chan in range(1,self.num_channels+1):
+                for name in self.startupQueries:
+                    if not self._isCached(chan,name):
+                        queryList.append((chan,name))
+        if not queryList:
+            # Put device in known echo state
+            self._echoOff(checkResponse=False)
+            return
+        with self.batch():
+            self._echoOff(checkResponse=False)
+            pendingList = [self._queueCmd('{0} {1}'.format(name,chan)) for chan, name in queryList]
+        for (chan, name), pending in zip(queryList,pendingList):
+            self._cacheQueryResponse(chan,name,pending.resp)
+
+    @synchronized
+    def open(self):
+        transport = self._getTransport()
+        if not transport.isOpen():
+            transport.open()
+        if self.reader is None:
+            self.reader = ReaderThread(transport,name='{0} reader'.format(self.port))
+
+    @synchronized
+    def close(self):
+        """
+        Closes the port. The device's state is saved first if a state file
+        was given.
+        """
+        if self.transport is None:
+            return
+        if self.stateFile is not None:
+            self.saveState()
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+        self.transport.close()
+
+    def isOpen(self):
+        return self.transport is not None and self.transport.isOpen()
+
+    def write(self,data):
+        return self._getTransport().write(data)
+
+    def read(self,size=1,timeout=None):
+        """
+        Reads up to size bytes received from the device, waiting at most
+        timeout seconds, or the default timeout if None, for the first byte.
+        """
+        if timeout is None:
+            timeout = self._timeout
+        return self._getReader().read(size,timeout)
+
+    def inWaiting(self):
+        return self._getReader().inWaiting()
 
+    def readlines(self,timeout=None):
+        """
+        Reads until no data has been received for timeout seconds, or the
+        default timeout if None, and returns the list of lines.
+        """
+        data = ''
+        while True:
+            chunk = self.read(max(self.inWaiting(),1),timeout)
+            if not chunk:
+                break
+            data += chunk
+        return data.splitlines(True)
+
+    def flushInput(self):
+        self._getReader().flush()
+
+    @synchronized
+    def refreshCache(self,queries=SNAPSHOT_QUERIES,chanList=None):
+        """
+        Reads the given values, e.g. ['?MODE','?STROBE'], for the given
+        channels, all channels if None, from the device in a single pipelined
+        write and stores them in the cache.
+        """
+        if self.cache is None:
+            raise LedControllerError, 'cache is not enabled'
+        if self._batch is not None:
+            raise LedControllerError, 'refreshCache cannot be used in a batch'
+        if chanList is None:
+            chanList = range(1,self.num_channels+1)
+        queryList = [(self._checkChan(chan),name) for chan in chanList for name in queries]
+        with self.batch():
+            pendingList = [self._queueCmd('{0} {1}'.format(name,chan)) for chan, name in queryList]
+        for (chan, name), pending in zip(queryList,pendingList):
+            self._cacheQueryResponse(chan,name,pending.resp)
+
+    @synchronized
+    def saveState(self,filename=None):
+        """
+        Saves the cached state of the device to the given file, or the state
+        file if None, so that it can be trusted by a later session. 
+        """
+        if filename is None:
+            filename = self.stateFile
+        stateDict = {
+                'version' : STATE_FILE_VERSION,
+                'port'    : str(self.port),
+                'dirty'   : self.dirty,
+                'cache'   : self.cache.toDict(),
+                }
+        tmpFile = '{0}.{1}.tmp'.format(filename,os.getpid())
+        with open(tmpFile,'w') as f:
+            json.dump(stateDict,f)
+        os.rename(tmpFile,filename)
+
+    @synchronized
+    def loadState(self,filename=None):
+        """
+        Loads the cached state of the device saved by saveState from the given
+        file, or the state file if None. Files saved for a different port are
+        ignored. Returns True if the state was loaded. The loaded state is
+        trusted, i.e., not read from the device again. A state file given to
+        the constructor is loaded when the controller is created and saved on
+        close.
+        """
+        if filename is None:
+            filename = self.stateFile
+        try:
+            with open(filename,'r') as f:
+                stateDict = json.load(f)
+        except (IOError, ValueError):
+            return False
+        if stateDict.get('version') != STATE_FILE_VERSION or stateDict.get('port') != str(self.port):
+            return False
+        self.cache.fromDict(stateDict['cache'])
+        self.dirty = stateDict['dirty']
+        return True
+
+    @synchronized
     def getMode(self,chan):
         """
         Returns the current working mode for the given channel
         """
         chan = self._checkChan(chan)
+        if self.cache is not None and self.cache[chan].mode is not None:
+            return self.cache[chan].mode
         resp = self._writeCmd('?MODE {0}'.format(chan))
-        modeInt = int(resp[0][1])
-        modeStr = findKey(MODE_STR2INT,modeInt)
+        modeStr = self._parseMode(resp)
+        if self.cache is not None:
+            self.cache[chan].mode = modeStr
         return modeStr
 
     def setMode(self,chan,mode):
         """
         Sets the current working mode for the given channel. Allowed modes
         are 'disable', 'normal', 'strobe' and 'trigger'.
+
+        Disabling a channel is always sent to the device, even if the cache
+        says it is already disabled, as the cached state may be stale. While
+        another thread is sending a batch it does not wait for the batch to
+        complete, the command is sent ahead of the batch's commands not yet
+        written and those for the same channel are dropped.
         """
         chan = self._checkChan(chan)
         modeNum = MODE_STR2INT[mode]
-        resp = self._writeCmd('MODE {0} {1}'.format(chan,modeNum))
+        cmd = 'MODE {0} {1}'.format(chan,modeNum)
+        if self._batch is None and getPriority(cmd) == PRIORITY_SAFETY:
+            if self._sendUrgent(cmd,lambda: self._cacheMode(chan,mode)):
+                return
+        with self._lock:
+            if self.cache is not None:
+                state = self.cache[chan]
+                if mode != 'disable' and state.mode == mode and state.latched:
+                    return
+            self._cacheMode(chan,mode)
+            self._writeCmd(cmd)
+
+    def _cacheMode(self,chan,mode):
+        """
+        Sets the cached mode of the given channel, if the cache is enabled.
+        """
+        if self.cache is not None:
+            self.cache[chan].mode = mode
+            self.cache[chan].latched = True
 
     # Normal mode methods
     # -------------------------------------------------------------------------
 
+    @synchronized
     def setNormalModeParams(self,chan,imax,iset):
         """
         Sets the maximum allowed current, when in normal mode, for the given
@@ -97,8 +527,15 @@ class LedController(serial.Serial):
         iset = self._checkCurrent(iset)
         if iset > imax:
             raise ValueError, 'iset must be <= imax'
+        if self.cache is not None:
+            state = self.cache[chan]
+            if state.normalParams == (imax,iset):
+                return
+            state.normalParams = imax, iset
+            state.latched = False
         resp = self._writeCmd('NORMAL {0} {1} {2}'.format(chan,imax,iset))
 
+    @synchronized
     def setNormalModeCurrent(self,chan,iset):
         """
         Sets the working current, when in normal mode, for the given channel.
@@ -109,23 +546,33 @@ class LedController(serial.Serial):
         """
         chan = self._checkChan(chan)
         iset = self._checkCurrent(iset)
+        if self.cache is not None:
+            state = self.cache[chan]
+            if state.normalParams is not None:
+                if state.normalParams[1] == iset:
+                    return
+                state.normalParams = state.normalParams[0], iset
         self._writeCmd('CURRENT {0} {1}'.format(chan,iset))
 
+    @synchronized
     def getNormalModeParams(self,chan):
         """
         Returns the working and maximum current setting for the current channel
         when in normal mode.
         """
         chan = self._checkChan(chan)
+        if self.cache is not None and self.cache[chan].normalParams is not None:
+            return self.cache[chan].normalParams
         resp = self._writeCmd('?CURRENT {0}'.format(chan))
-        valueList = resp[0].split()
-        imax = int(valueList[-2])
-        iset = int(valueList[-1])
+        imax, iset = self._parseNormalModeParams(resp)
+        if self.cache is not None:
+            self.cache[chan].normalParams = imax, iset
         return imax, iset
 
     # Strobe mode methods
     # ------------------------------------------------------------------------- 
 
+    @synchronized
     def setStrobeModeParams(self,chan,imax,repeat):
         """
         Sets the strobe mode parameters. 
@@ -139,8 +586,15 @@ class LedController(serial.Serial):
         chan = self._checkChan(chan)
         imax = self._checkCurrent(imax)
         repeat = self._checkRepeat(repeat)
+        if self.cache is not None:
+            state = self.cache[chan]
+            if state.strobeParams == (imax,repeat):
+                return
+            state.strobeParams = imax, repeat
+            state.latched = False
         self._writeCmd('STROBE {0} {1} {2}'.format(chan,imax,repeat))
 
+    @synchronized
     def setStrobeModeProfile(self,chan,step,iset,tset):
         """
         Sets the profile for strobe mode.
@@ -158,8 +612,11 @@ class LedController(serial.Serial):
         step = self._checkStep(step)
         iset = self._checkCurrent(iset)
         tset = self._checkTime(tset)
+        if not self._updateProfileStep(chan,'strobe',step,iset,tset):
+            return
         self._writeCmd('STRP {0} {1} {2} {3}'.format(chan,step,iset,tset))
 
+    @synchronized
     def getStrobeModeParams(self,chan):
         """
         Gets the strobe mode parameters for the given channel. Returns 
@@ -167,12 +624,15 @@ class LedController(serial.Serial):
         repeat = repeat count for the running profile
         """
         chan = self._checkChan(chan) 
+        if self.cache is not None and self.cache[chan].strobeParams is not None:
+            return self.cache[chan].strobeParams
         resp = self._writeCmd('?STROBE {0}'.format(chan))
-        valueStr = resp[0].split()
-        imax = int(valueStr[0][1:])
-        repeat = int(valueStr[1])
+        imax, repeat = self._parseStrobeModeParams(resp)
+        if self.cache is not None:
+            self.cache[chan].strobeParams = imax, repeat
         return imax, repeat
 
+    @synchronized
     def getStrobeModeProfile(self,chan):
         """
         Gets the strobe mode profile parameters for the given channel.
@@ -180,13 +640,46 @@ class LedController(serial.Serial):
         returns a list of (iset,tset) pairs.
         """
         chan = self._checkChan(chan)
+        if self.cache is not None:
+            profileValues = self.cache.getProfile(chan,'strobe')
+            if profileValues is not None:
+                return profileValues
         resp = self._writeCmd('?STRP {0}'.format(chan))
         profileValues = self._getProfileValues(resp)
+        if self.cache is not None:
+            self.cache.setProfile(chan,'strobe',profileValues)
         return profileValues
 
+    @synchronized
+    def setStrobeModeProfileArray(self,chan,iset,tset,merge=True):
+        """
+        Sets the whole strobe mode profile from arrays, or any sequences, of
+        set point currents and times.
+
+        chan = channel number 1,2,3 or 4
+        iset = set point currents for the steps
+        tset = times for the steps in us, must be > 0
+
+        If merge is True adjacent steps with the same current are merged into
+        a single step. Only the steps which differ from the device's current
+        profile are sent and they are sent in a single batch. Returns the
+        number of step commands sent.
+        """
+        return self._setProfileArray(chan,'strobe',iset,tset,merge)
+
+    @synchronized
+    def getStrobeModeProfileArray(self,chan):
+        """
+        Gets the strobe mode profile for the given channel as arrays.
+
+        returns iset, tset arrays (lists if numpy is not available).
+        """
+        return profileToArrays(self.getStrobeModeProfile(chan))
+
     # Trigger mode methods
     # -------------------------------------------------------------------------
 
+    @synchronized
     def setTriggerModeParams(self,chan,imax,polarity):
         """
         Sets the trigger mode parameters for the given channel.
@@ -199,8 +692,15 @@ class LedController(serial.Serial):
         imax = self._checkCurrent(imax)
         polarity = self._checkPolarity(polarity)
         polarityInt = POLARITY_STR2INT[polarity]
+        if self.cache is not None:
+            state = self.cache[chan]
+            if state.triggerParams == (imax,polarity):
+                return
+            state.triggerParams = imax, polarity
+            state.latched = False
         self._writeCmd('TRIGGER {0} {1} {2}'.format(chan,imax,polarityInt))
 
+    @synchronized
     def setTriggerModeProfile(self,chan,step,iset,tset):
         """
         Sets the trigger mode profile parameters for the given channel.
@@ -220,20 +720,25 @@ class LedController(serial.Serial):
         step = self._checkStep(step)
         iset = self._checkCurrent(iset)
         tset = self._checkTime(tset)
+        if not self._updateProfileStep(chan,'trigger',step,iset,tset):
+            return
         resp = self._writeCmd('TRIGP {0} {1} {2} {3}'.format(chan,step,iset,tset))
 
+    @synchronized
     def getTriggerModeParams(self,chan):
         """
         Gets the trigger mode parameters for the given channel.
         """
         chan = self._checkChan(chan)
+        if self.cache is not None and self.cache[chan].triggerParams is not None:
+            return self.cache[chan].triggerParams
         resp = self._writeCmd('?TRIGGER {0}'.format(chan))
-        valueList = resp[0].split()
-        imax = int(valueList[0][1:])
-        polarityInt = int(valueList[1])
-        polarity = findKey(POLARITY_STR2INT,polarityInt)
+        imax, polarity = self._parseTriggerModeParams(resp)
+        if self.cache is not None:
+            self.cache[chan].triggerParams = imax, polarity
         return imax, polarity
 
+    @synchronized
     def getTriggerModeProfile(self,chan):
         """
         Gets the trigger mode profile values for the given channel.
@@ -241,24 +746,55 @@ class LedController(serial.Serial):
         returns a list of (iset,tset) pairs.
         """
         chan = self._checkChan(chan)
+        if self.cache is not None:
+            profileValues = self.cache.getProfile(chan,'trigger')
+            if profileValues is not None:
+                return profileValues
         resp = self._writeCmd('?TRIGP {0}'.format(chan))
         profileValues = self._getProfileValues(resp)
+        if self.cache is not None:
+            self.cache.setProfile(chan,'trigger',profileValues)
         return profileValues
 
 
+    @synchronized
+    def setTriggerModeProfileArray(self,chan,iset,tset,merge=True):
+        """
+        Sets the whole trigger mode profile from arrays, or any sequences, of
+        set point currents and times. See setStrobeModeProfileArray.
+        """
+        return self._setProfileArray(chan,'trigger',iset,tset,merge)
+
+    @synchronized
+    def getTriggerModeProfileArray(self,chan):
+        """
+        Gets the trigger mode profile for the given channel as arrays.
+
+        returns iset, tset arrays (lists if numpy is not available).
+        """
+        return profileToArrays(self.getTriggerModeProfile(chan))
+
     # Methods for other commands 
     # -------------------------------------------------------------------------
 
+    @synchronized
     def reset(self,sleep=False):
         """
-        Perform a soft reset of the device. Note, it seems to take about 4sec
-        for the device to reset.  You will need to close the serial connection
-        and reopen it again. 
+        Perform a soft reset of the device. If sleep is True the serial
+        connection is closed and reopened and the device is polled until it
+        answers, see waitReady, which takes at most RESET_SLEEP_DT. Echo is
+        then turned off again. Otherwise you will need to close the serial
+        connection and reopen it again yourself. 
         """
         self._writeCmd('Reset')
+        self.invalidate()
+        # The device reloads the settings from non-volatile memory
+        self.dirty = False
         if sleep:
-            time.sleep(RESET_SLEEP_DT)
+            self.waitReady(RESET_SLEEP_DT,reopen=True)
+            self._echoOff(checkResponse=False)
 
+    @synchronized
     def restoreDefaults(self,store=False):
         """
         Restore the device's mode and all related parameters to its factory default.
@@ -266,8 +802,7 @@ class LedController(serial.Serial):
         the optional keyword argument store can be set to true. 
         """
         self._writeCmd('RESTOREDEF')
-        if store:
-            self.store()
+        self.invalidate()
 
         # Set all channels to the mode given in the defaults seems to be required 
         # in order of the changes to take effect.
@@ -275,70 +810,273 @@ class LedController(serial.Serial):
             mode = self.getMode(i)
             self.setMode(i,mode)
 
-    def store(self):
+        if store:
+            self.store()
+
+    @synchronized
+    def store(self,force=False):
+        """
+        Store the current settings in non-volatile memory. Returns as soon as
+        the device acknowledges the store, waiting at most STORE_TIMEOUT.
+
+        Does nothing if no settings have been changed since they were last
+        stored, i.e., the dirty attribute is False, unless force is True.
+        dirty is True initially as the device's state is not known. Within a
+        deferStore context the store is deferred and coalesced with other
+        store requests.
+        """
+        if self._batch is not None:
+            raise LedControllerError, 'store cannot be used in a batch'
+        if self._deferredStore is not None and not force:
+            self._deferredStore.request()
+            return
+        if self.dirty or force:
+            self._storeNow()
+
+    def deferStore(self,debounce=None):
+        """
+        Returns a context manager which defers calls to store. The settings
+        are stored once, if they have changed, when the context exits, e.g.,
+
+        with dev.deferStore():
+            dev.setMode(1,'normal')
+            dev.store()
+            dev.setMode(2,'normal')
+            dev.store()
+
+        If debounce is given, a deferred store is also written by the first
+        command sent at least debounce seconds after the last store request.
+        Nested contexts are merged into the outermost context. Only the
+        calling thread's calls to store are deferred.
+        """
+        if self._deferredStore is None:
+            return DeferredStore(self,debounce)
+        return self._deferredStore
+
+    @synchronized
+    def _storeNow(self):
         """
-        Store the current settings in non-volatile memory.
+        Sends STORE and waits for the device to acknowledge it, which it does
+        once it has finished writing to non-volatile memory.
         """
-        # Use a longer timeout for the store command as it takes a while to 
-        # Write to non-volatile memory. Save the origianl value. 
-        original_timeout = self.timeout
-        self.timeout = STORE_TIMEOUT
-        self._writeCmd('STORE')
-        self.timeout = original_timeout
+        resp, complete = self._sendCmd('STORE')
+        error = validateResponse('STORE',resp,complete)
+        if not complete:
+            # Discard a late acknowledgement
+            self._resync('STORE')
+        if error is not None:
+            raise error
+        self.dirty = False
+
+    @synchronized
+    def waitReady(self,timeout=RESET_SLEEP_DT,reopen=False):
+        """
+        Polls the device with DEVICEINFO probes until it answers. The interval
+        between probes starts at READY_POLL_DT and backs off to at most
+        READY_POLL_MAX_DT. If reopen is True the serial connection is closed
+        and reopened as soon as the port is available again, e.g., after a
+        reset. Any late replies are discarded before returning. 
+        
+        Returns the time waited in seconds. Raises ResponseTimeout if the
+        device does not answer within timeout seconds.
+        """
+        t0 = time.time()
+        deadline = t0 + timeout
+        pollDt = READY_POLL_DT
+        transport = self._getTransport()
+        reader = self._getReader()
+        if reopen:
+            reader.pause()
+            transport.close()
+        try:
+            while True:
+                ready = False
+                if not transport.isOpen():
+                    try:
+                        transport.open()
+                    except (serial.SerialException, EnvironmentError):
+                        time.sleep(min(pollDt,max(deadline - time.time(),0.0)))
+                    else:
+                        reader.resume()
+                if transport.isOpen():
+                    try:
+                        ready = self._probe(pollDt)
+                    except (serial.SerialException, EnvironmentError):
+                        reader.pause()
+                        transport.close()
+                if ready:
+                    break
+                if time.time() >= deadline:
+                    raise ResponseTimeout, 'device not ready after {0}s'.format(timeout)
+                pollDt = min(pollDt*READY_BACKOFF,READY_POLL_MAX_DT)
+            self._drain(READY_POLL_DT)
+        finally:
+            reader.resume()
+        return time.time() - t0
 
     def printSettings(self):
         """
         Prints current parameters 
         """
-        print
-        print(self.getDeviceInfo())
-        print
-        for i in range(1,self.num_channels+1):
+        printSnapshot(self.getSnapshot())
 
-            mode = self.getMode(i)
-
-            imax, iset = self.getNormalModeParams(i)
-            print('chan: {0}'.format(i))
-            print('  mode: {0}'.format(mode))
-            print('  normal mode parameters')
-            print('    imax: {0}'.format(imax))
-            print('    iset: {0}'.format(iset))
-
-            imax, repeat = self.getStrobeModeParams(i)
-            print('  strobe mode parameters')
-            print('    imax: {0}'.format(imax))
-            print('    repeat: {0}'.format(repeat))
-            profileValues = self.getStrobeModeProfile(i)
-            print('  strobe mode profile')
-            for j,values in enumerate(profileValues):
-                iset,tset = values
-                print('    step {0}'.format(j))
-                print('      iset: {0}'.format(iset)) 
-                print('      tset: {0}'.format(tset))
-
-            imax, polarity =  self.getTriggerModeParams(i)
-            print('  trigger mode parameters')
-            print('    imax: {0}'.format(imax))
-            print('    polarity: {0}'.format(polarity))
-            profileValues = self.getTriggerModeProfile(i)
-            print('  trigger mode profile')
-            for j,values in enumerate(profileValues):
-                iset,tset = values
-                print('    step {0}'.format(j))
-                print('      iset: {0}'.format(iset)) 
-                print('      tset: {0}'.format(tset))
-
-            print('')
+    @synchronized
+    def getSnapshot(self):
+        """
+        Returns a DeviceSnapshot of the device information and the settings of
+        all channels. All of the queries are sent to the device in a single
+        pipelined write. If the cache is enabled it is updated with the values
+        read.
+        """
+        if self._batch is not None:
+            raise LedControllerError, 'getSnapshot cannot be used in a batch'
+
+        timestamp = time.time()
+        with self.batch():
+            infoCmd = self._queueCmd('DEVICEINFO')
+            pendingList = []
+            for i in range(1,self.num_channels+1):
+                pendingDict = {}
+                for name in SNAPSHOT_QUERIES:
+                    pendingDict[name] = self._queueCmd('{0} {1}'.format(name,i))
+                pendingList.append(pendingDict)
+
+        channels = []
+        for i, pendingDict in enumerate(pendingList):
+            chan = i+1
+            mode = self._parseMode(pendingDict['?MODE'].resp)
+            normalParams = self._parseNormalModeParams(pendingDict['?CURRENT'].resp)
+            strobeParams = self._parseStrobeModeParams(pendingDict['?STROBE'].resp)
+            strobeProfile = self._getProfileValues(pendingDict['?STRP'].resp)
+            triggerParams = self._parseTriggerModeParams(pendingDict['?TRIGGER'].resp)
+            triggerProfile = self._getProfileValues(pendingDict['?TRIGP'].resp)
+            if self.cache is not None:
+                self.cache.invalidate(chan)
+                state = self.cache[chan]
+                state.mode = mode
+                state.normalParams = normalParams
+                state.strobeParams = strobeParams
+                state.triggerParams = triggerParams
+                self.cache.setProfile(chan,'strobe',strobeProfile)
+                self.cache.setProfile(chan,'trigger',triggerProfile)
+            settings = ChannelSettings(
+                    chan=chan,
+                    mode=mode,
+                    normalImax=normalParams[0],
+                    normalIset=normalParams[1],
+                    strobeImax=strobeParams[0],
+                    strobeRepeat=strobeParams[1],
+                    strobeProfile=tuple(strobeProfile),
+                    triggerImax=triggerParams[0],
+                    triggerPolarity=triggerParams[1],
+                    triggerProfile=tuple(triggerProfile),
+                    )
+            channels.append(settings)
+
+        deviceInfo = self._parseDeviceInfo(infoCmd.resp)
+        return DeviceSnapshot(deviceInfo,timestamp,tuple(channels))
     
+    @synchronized
+    def applySettings(self,desired,store=False):
+        """
+        Changes the device to the desired settings sending only the commands
+        required. desired is either a DeviceSnapshot or a list of
+        ChannelSettings, one per channel to change. Fields of the channel
+        settings which are None are left unchanged. The current settings are
+        taken from the cache when fully known, otherwise they are read from
+        the device with getSnapshot. The commands are sent in a single batch.
+        If store is True the settings are stored in non-volatile memory once
+        at the end.
+
+        Returns the list of (methodName, args) commands which were sent.
+        """
+        if isinstance(desired,DeviceSnapshot):
+            desired = desired.channels
+        current = self._getCachedSettings()
+        if current is None:
+            current = self.getSnapshot().channels
+
+        cmdList = []
+        for settings in desired:
+            chan = self._checkChan(settings.chan)
+            cmdList.extend(diffSettings(current[chan-1],settings))
+
+        with self.batch():
+            for methodName, args in cmdList:
+                getattr(self,methodName)(*args)
+        if store and cmdList:
+            self.store()
+        return cmdList
+
+    def instrument(self,instrumentation=None):
+        """
+        Enables instrumentation of the commands sent to the device. Uses the
+        given Instrumentation object, or creates one if None, and returns it.
+        Set the instrumentation attribute to None to disable.
+        """
+        if instrumentation is None:
+            instrumentation = self.instrumentation or Instrumentation()
+        self.instrumentation = instrumentation
+        return instrumentation
+
+    def recordTrace(self,filename):
+        """
+        Records every command sent to the device, and its response, with
+        timestamps to the given trace file, see command_trace. Enables
+        instrumentation if needed. Returns the TraceRecorder, call its close
+        method to stop recording.
+        """
+        recorder = TraceRecorder(filename,echo=self.echo)
+        recorder.attach(self.instrument())
+        return recorder
+
+    @synchronized
+    def invalidate(self,chan=None):
+        """
+        Invalidates the cached state of the given channel, or of all channels
+        if chan is None, so that it is read from the device when next needed.
+        Use if the device's state may have been changed by other means. Does
+        nothing if the cache is not enabled. 
+        """
+        if self.cache is not None:
+            self.cache.invalidate(chan)
+
+    @synchronized
     def getDeviceInfo(self):
         """
         Queries the device for information ..  device type, firmware version,
         serial number, etc. Returns as a string.
         """
         resp = self._writeCmd('DEVICEINFO')
-        infoStr = resp[0].strip()
+        infoStr = self._parseDeviceInfo(resp)
         return infoStr
 
+    def batch(self):
+        """
+        Returns a context manager for queuing commands. Commands issued within
+        the context are written back-to-back, as allowed by the scheduler,
+        when the context exits and the responses are then matched to the
+        commands, e.g.,
+
+        with dev.batch() as b:
+            b.setStrobeModeProfile(1,0,500,100)
+            b.setStrobeModeProfile(1,1,0,900)
+            b.setMode(1,'strobe')
+
+        Only setters can be used within a batch. If any of the commands fail
+        a BatchError listing the failed commands is raised at the end. Nested
+        batches are merged into the outermost batch.
+
+        The commands are ordered and written in windows by the scheduler
+        attribute, a WriteScheduler, which sends safety commands first and
+        limits the bytes written ahead of the responses. Set it to None to
+        write each batch in a single write. See setMode for channels disabled
+        by other threads while a batch is being sent.
+        """
+        if self._batch is None:
+            return CommandBatch(self)
+        return self._batch
+
     def _echoOff(self,checkResponse=True):
         """
         Turns off echo mode
@@ -350,8 +1088,226 @@ class LedController(serial.Serial):
         """
         Turns on echo mode - useful for debugging
         """
-        self.echo = True 
         self._writeCmd('ECHOON')
+        self.echo = True 
+
+    def _setProfileArray(self,chan,name,iset,tset,merge):
+        """
+        Sets the 'strobe' or 'trigger' profile from arrays of currents and
+        times. See setStrobeModeProfileArray.
+        """
+        chan = self._checkChan(chan)
+        profileValues = self._checkProfileArrays(iset,tset)
+        if merge:
+            profileValues = mergeProfileSteps(profileValues)
+        methodName = PROFILE_SETTERS[name]
+
+        if self._batch is None:
+            if name == 'strobe':
+                current = self.getStrobeModeProfile(chan)
+            else:
+                current = self.getTriggerModeProfile(chan)
+        elif self.cache is not None:
+            current = self.cache.getProfile(chan,name)
+        else:
+            current = None
+
+        if current is None:
+            # Device's profile is unknown - send all steps and the terminating
+            # zero step.
+            cmdList = [(methodName,(chan,i,v[0],v[1])) for i,v in enumerate(profileValues)]
+            if len(profileValues) < NUM_PROFILE_STEPS:
+                cmdList.append((methodName,(chan,len(profileValues),0,0)))
+        else:
+            cmdList = diffProfile(chan,methodName,current,profileValues)
+
+        with self.batch():
+            for methodName, args in cmdList:
+                getattr(self,methodName)(*args)
+        return len(cmdList)
+
+    def _checkProfileArrays(self,iset,tset):
+        """
+        Checks the arrays of profile currents and times in a single pass.
+        Converts to integers and verifies that the currents are between 0 and
+        MAX_CURRENT, that the times are > 0 and that the number of steps is in
+        the allowed range. Returns a list of (iset,tset) pairs.
+        """
+        if numpy is not None:
+            iset = numpy.asarray(iset).astype(int).ravel()
+            tset = numpy.asarray(tset).astype(int).ravel()
+            badCurrent = ((iset < 0) | (iset > MAX_CURRENT)).any()
+            badTime = (tset <= 0).any()
+            iset, tset = iset.tolist(), tset.tolist()
+        else:
+            iset = [int(x) for x in iset]
+            tset = [int(x) for x in tset]
+            badCurrent = any([x < 0 or x > MAX_CURRENT for x in iset])
+            badTime = any([x <= 0 for x in tset])
+        if len(iset) != len(tset):
+            raise ValueError, 'iset and tset must be the same length'
+        if len(iset) < 1 or len(iset) > NUM_PROFILE_STEPS:
+            raise ValueError, 'number of steps must be in range [1,{0}]'.format(NUM_PROFILE_STEPS)
+        if badCurrent:
+            raise ValueError, 'current must be >= 0 or < 1000'
+        if badTime:
+            raise ValueError, 'time must be > 0'
+        return zip(iset,tset)
+
+    def _getCachedSettings(self):
+        """
+        Returns a tuple of ChannelSettings built from the cache or None if the
+        cache is not enabled or any of the values are unknown.
+        """
+        if self.cache is None:
+            return None
+        channels = []
+        for chan in range(1,self.num_channels+1):
+            state = self.cache[chan]
+            strobeProfile = self.cache.getProfile(chan,'strobe')
+            triggerProfile = self.cache.getProfile(chan,'trigger')
+            valueList = [
+                    state.mode, 
+                    state.normalParams, 
+                    state.strobeParams, 
+                    state.triggerParams,
+                    strobeProfile,
+                    triggerProfile,
+                    ]
+            if None in valueList:
+                return None
+            settings = ChannelSettings(
+                    chan=chan,
+                    mode=state.mode,
+                    normalImax=state.normalParams[0],
+                    normalIset=state.normalParams[1],
+                    strobeImax=state.strobeParams[0],
+                    strobeRepeat=state.strobeParams[1],
+                    strobeProfile=tuple(strobeProfile),
+                    triggerImax=state.triggerParams[0],
+                    triggerPolarity=state.triggerParams[1],
+                    triggerProfile=tuple(triggerProfile),
+                    )
+            channels.append(settings)
+        return tuple(channels)
+
+    def _isCached(self,chan,query):
+        """
+        Returns True if the value read by the given query for the given
+        channel is known.
+        """
+        state = self.cache[chan]
+        if query == '?STRP':
+            return self.cache.getProfile(chan,'strobe') is not None
+        if query == '?TRIGP':
+            return self.cache.getProfile(chan,'trigger') is not None
+        value = {
+                '?MODE'    : state.mode,
+                '?CURRENT' : state.normalParams,
+                '?STROBE'  : state.strobeParams,
+                '?TRIGGER' : state.triggerParams,
+                }[query]
+        return value is not None
+
+    def _cacheQueryResponse(self,chan,query,resp):
+        """
+        Parses the device's response to the given query and stores the value
+        in the cache.
+        """
+        state = self.cache[chan]
+        if query == '?MODE':
+            state.mode = self._parseMode(resp)
+        elif query == '?CURRENT':
+            state.normalParams = self._parseNormalModeParams(resp)
+        elif query == '?STROBE':
+            state.strobeParams = self._parseStrobeModeParams(resp)
+        elif query == '?TRIGGER':
+            state.triggerParams = self._parseTriggerModeParams(resp)
+        elif query == '?STRP':
+            self.cache.setProfile(chan,'strobe',self._getProfileValues(resp))
+        elif query == '?TRIGP':
+            self.cache.setProfile(chan,'trigger',self._getProfileValues(resp))
+        else:
+            raise ValueError, 'unknown query {0}'.format(query)
+
+    def _getTransport(self):
+        """
+        Returns the transport, connecting first if the port has not been
+        opened yet.
+        """
+        if self.transport is None:
+            self.connect()
+        return self.transport
+
+    def _getReader(self):
+        """
+        Returns the reader thread, connecting first if the port has not been
+        opened yet.
+        """
+        self._getTransport()
+        reader = self.reader
+        if reader is None:
+            raise TransportError, 'port {0} is not open'.format(self.port)
+        return reader
+
+    def _updateProfileStep(self,chan,name,step,iset,tset):
+        """
+        Updates the cached value of the given profile step. Returns False if
+        the step is already set to the given values and the command can be
+        skipped.
+        """
+        if self.cache is None:
+            return True
+        if self.cache.getProfileStep(chan,name,step) == (iset,tset):
+            return False
+        self.cache.setProfileStep(chan,name,step,iset,tset)
+        self.cache[chan].latched = False
+        return True
+
+    def _parseMode(self,resp):
+        """
+        Extract the mode string from the device's response to ?MODE.
+        """
+        modeInt = int(resp[0][1])
+        return findKey(MODE_STR2INT,modeInt)
+
+    def _parseNormalModeParams(self,resp):
+        """
+        Extract the maximum and working current from the device's response to
+        ?CURRENT.
+        """
+        valueList = resp[0].split()
+        imax = int(valueList[-2])
+        iset = int(valueList[-1])
+        return imax, iset
+
+    def _parseStrobeModeParams(self,resp):
+        """
+        Extract the maximum current and repeat count from the device's response
+        to ?STROBE.
+        """
+        valueStr = resp[0].split()
+        imax = int(valueStr[0][1:])
+        repeat = int(valueStr[1])
+        return imax, repeat
+
+    def _parseTriggerModeParams(self,resp):
+        """
+        Extract the maximum current and polarity from the device's response to
+        ?TRIGGER.
+        """
+        valueList = resp[0].split()
+        imax = int(valueList[0][1:])
+        polarityInt = int(valueList[1])
+        polarity = findKey(POLARITY_STR2INT,polarityInt)
+        return imax, polarity
+
+    def _parseDeviceInfo(self,resp):
+        """
+        Extract the device information string from the device's response to
+        DEVICEINFO.
+        """
+        return resp[0].strip()
 
     def _getProfileValues(self,resp):
         """
@@ -436,30 +1392,509 @@ class LedController(serial.Serial):
             raise ValueError, "polarity must be either 'rising' or  'falling'"
         return polarity
 
+    @synchronized
     def _writeCmd(self,cmd,checkResponse=True):
         """
-        Writes a command to the LED controller and receives a response.
+        Writes a command to the LED controller and receives a response. If a
+        batch is active the command is queued instead and the pending command
+        is returned.
+
+        If checkResponse is True the response is validated and the command is
+        retried, if allowed, when it is not valid. After an incomplete or
+        malformed response input is drained until the link has been quiet for
+        the command's soft deadline, so that a late response is not read as
+        the response to the next command.
+        """
+        if self._batch is not None:
+            if isQuery(cmd):
+                raise LedControllerError, 'queries cannot be used in a batch'
+            return self._queueCmd(cmd,checkResponse=checkResponse)
+        if self._deferredStore is not None:
+            self._deferredStore.poll()
+
+        attempt = 0
+        while True:
+            # The model learns from a timeout, the quiet period is the soft
+            # deadline the command was read with
+            quiet = self._getCmdTimeout(cmd)
+            resp, complete = self._sendCmd(cmd)
+            error = None
+            if checkResponse:
+                error = validateResponse(cmd,resp,complete)
+            if not complete or isinstance(error,MalformedResponse):
+                # Discard the late or unexpected data so that it is not read
+                # as the response to the next command
+                self._drain(quiet)
+            if error is None:
+                return resp
+            if attempt >= self.retries or not isRetryable(cmd):
+                break
+            attempt += 1
+
+        # The command may or may not have taken effect and the cache holds
+        # the value it was to set, even if rejected by the device
+        self.invalidate(getChannel(cmd))
+        raise error
+
+    @synchronized
+    def _sendCmd(self,cmd):
+        """
+        Writes a single command and reads the response. Returns the response
+        lines, with any echo removed, and a flag indicating whether or not the
+        response was complete.
         """
         if DEBUG:
             print('cmd: {0}'.format(cmd)) 
+        if self.instrumentation is not None:
+            self.instrumentation.onCommandStart(cmd)
 
+        timeout = self._getMaxCmdTimeout(cmd)
+        t0 = time.time()
         self.write('{0}\r\n'.format(cmd))
-        resp = self.readlines()
+        self._updateDirty(cmd)
+        rxCount = self._rxCount
+        resp, complete = self._readResponse(cmd,timeout)
+        self._updateLatencyModel(cmd,time.time() - t0,complete,timeout)
+        self._recordCmd(cmd,t0,resp,complete,self._rxCount - rxCount)
 
         if DEBUG:
             print('rsp: {0}'.format(resp))
             
-        if self.echo:
-            # If we are in echo mode separate out the echo from the 
-            # response
-            echo = resp[0]
-            resp = resp[1:]
+        resp = self._stripEcho(resp)
+        return resp, complete
 
-        if checkResponse:
-            # Check the response for errors - not done
+    def _getCmdTimeout(self,cmd,extra=0.0):
+        """
+        Returns the soft deadline for the given command from the latency
+        model. extra is added for commands queued on the link ahead of the
+        command.
+        """
+        if self.latencyModel is None:
+            return self._timeout
+        if getFraming(cmd) == FRAME_UNKNOWN:
+            return self.latencyModel.maxTimeout
+        return self.latencyModel.getTimeout(getCmdName(cmd)) + extra
+
+    def _getMaxCmdTimeout(self,cmd,extra=0.0):
+        """
+        Returns the hard deadline, i.e., the read timeout, for the given
+        command from the latency model, or the fixed timeout, at least
+        SLOW_CMD_TIMEOUTS for slow commands, without one. extra is added for
+        commands queued on the link ahead of the command.
+        """
+        if self.latencyModel is None:
+            return max(self._timeout,SLOW_CMD_TIMEOUTS.get(getCmdName(cmd),0.0)) + extra
+        if getFraming(cmd) == FRAME_UNKNOWN:
+            return self.latencyModel.maxTimeout + extra
+        return self.latencyModel.getDeadline(getCmdName(cmd)) + extra
+
+    def _updateLatencyModel(self,cmd,latency,complete,timeout):
+        """
+        Adds the latency of a command, read with the given timeout, to the
+        latency model. If the response was incomplete twice the timeout is
+        added so that the timeout grows.
+        """
+        if self.latencyModel is None or getFraming(cmd) == FRAME_UNKNOWN:
+            return
+        if not complete:
+            latency = max(latency,2.0*timeout)
+        self.latencyModel.update(getCmdName(cmd),latency)
+
+    def _updateDirty(self,cmd):
+        """
+        Marks the settings as changed if the given command, which has just
+        been written, changes them. 
+        """
+        if getCmdName(cmd) in STATE_CMDS:
+            self.dirty = True
+
+    def _probe(self,timeout):
+        """
+        Sends a DEVICEINFO probe and returns True if the device answers within
+        timeout seconds.
+        """
+        self._rxBuffer = ''
+        self.flushInput()
+        self.write('DEVICEINFO\r\n')
+        return self._readLine(timeout) is not None
+
+    def _drain(self,quiet):
+        """
+        Reads and discards input until none has been received for quiet
+        seconds.
+        """
+        while self.read(max(self.inWaiting(),1),quiet):
             pass
+        self._rxBuffer = ''
+
+    def _resync(self,cmd,extra=0.0):
+        """
+        Discards any partially received or late response to the given command
+        so that the next response read matches the next command written. Input
+        is drained until none has been received for the command's timeout.
+        """
+        self._drain(self._getCmdTimeout(cmd,extra))
+
+    def _queueCmd(self,cmd,checkResponse=True):
+        """
+        Adds a command to the active batch. Returns the pending command whose
+        resp attribute is set when the batch is sent.
+        """
+        pending = PendingCommand(cmd,checkResponse)
+        self._batch.pending.append(pending)
+        return pending
+
+    @synchronized
+    def _sendBatch(self,pendingList,attempt=0):
+        """
+        Writes the given list of pending commands and reads the responses in
+        order. The commands are ordered and written in windows by the
+        scheduler, if any, otherwise in a single write. Raises a BatchError if
+        any of the commands failed.
+
+        If retries is > 0 and all commands from the first failed command on
+        are safe to repeat, they are resent, in order, as a new batch.
+        """
+        if not pendingList:
+            return
+        if self._deferredStore is not None and attempt == 0:
+            self._deferredStore.poll()
+
+        scheduler = self.scheduler
+        if scheduler is not None and attempt == 0:
+            sendList = [pendingList[i] for i in scheduler.order([p.cmd for p in pendingList])]
+        else:
+            sendList = list(pendingList)
+        for pending in sendList:
+            if DEBUG:
+                print('cmd: {0}'.format(pending.cmd))
+            if self.instrumentation is not None:
+                self.instrumentation.onCommandStart(pending.cmd)
+
+        owner = self._sender is None
+        if owner:
+            with self._urgentLock:
+                self._sender = threading.current_thread()
+        sendTimes = []
+        inFlightBytes = 0
+        i = 0
+        try:
+            while True:
+                # Safety commands from other threads are sent next, ahead of
+                # the commands of this batch which have not been written
+                with self._urgentLock:
+                    urgentList, self._urgent = self._urgent, []
+                    if not urgentList and i >= len(sendList):
+                        if owner:
+                            self._sender = None
+                        break
+                unsentList = sendList[len(sendTimes):]
+                for p in urgentList:
+                    if self.instrumentation is not None:
+                        self.instrumentation.onCommandStart(p.cmd)
+                    if p.onQueued is not None:
+                        p.onQueued()
+                    unsentList = dropSuperseded(unsentList,p.cmd)
+                sendList[len(sendTimes):] = urgentList + unsentList
+                pending = sendList[i]
+
+                # Write as many of the following commands as the window allows
+                n = len(sendTimes)
+                while n < len(sendList):
+                    cmd = sendList[n].cmd
+                    if scheduler is not None and not scheduler.canSend(cmd,n-i,inFlightBytes):
+                        break
+                    inFlightBytes += len(cmd) + 2
+                    n += 1
+                if n > len(sendTimes):
+                    writeList = sendList[len(sendTimes):n]
+                    t0 = time.time()
+                    self.write(''.join(['{0}\r\n'.format(p.cmd) for p in writeList]))
+                    for p in writeList:
+                        self._updateDirty(p.cmd)
+                    sendTimes.extend([t0]*len(writeList))
+
+                # Responses in a batch arrive faster than single round trips so
+                # they are not used to update the latency model
+                extra = 0.0
+                if scheduler is not None:
+                    extra = scheduler.getSendTime(inFlightBytes)
+                timeout = self._getMaxCmdTimeout(pending.cmd,extra)
+                rxCount = self._rxCount
+                resp, complete = self._readResponse(pending.cmd,timeout)
+                inFlightBytes -= len(pending.cmd) + 2
+                self._recordCmd(pending.cmd,sendTimes[i],resp,complete,self._rxCount - rxCount)
+                if DEBUG:
+                    print('rsp: {0}'.format(resp))
+                pending.resp = self._stripEcho(resp)
+                if not complete:
+                    pending.error = ResponseTimeout('incomplete response')
+                elif pending.checkResponse:
+                    pending.error = validateResponse(pending.cmd,pending.resp,complete)
+                if not complete or isinstance(pending.error,MalformedResponse):
+                    # Responses can no longer be matched to the commands, the
+                    # rest are discarded
+                    for p in sendList[i+1:len(sendTimes)]:
+                        p.error = ResponseTimeout('not read')
+                    for p in sendList[len(sendTimes):]:
+                        if p.done is None:
+                            p.error = ResponseTimeout('not sent')
+                    self._resync(pending.cmd,extra)
+                    break
+                if pending.done is not None:
+                    pending.done.set()
+                i += 1
+        finally:
+            urgentList = []
+            if owner:
+                with self._urgentLock:
+                    urgentList, self._urgent = self._urgent, []
+                    self._sender = None
+                # Wake any other threads whose commands were not completed,
+                # those not written are sent by the threads themselves
+                for p in sendList + urgentList:
+                    if p.done is not None and not p.done.is_set():
+                        p.done.set()
+        for p in sendList:
+            if p.done is not None and p.error is not None:
+                # Failed command sent for another thread, see _sendUrgent
+                self.invalidate(getChannel(p.cmd))
+        sendList = [p for p in sendList if p.done is None]
+
+        errors = [(p.cmd,p.error) for p in pendingList if p.error is not None]
+        superseded = any([isinstance(p.error,CommandSuperseded) for p in pendingList])
+        if errors and attempt < self.retries and not superseded:
+            n = [p.error is None for p in sendList].index(False)
+            retryList = sendList[n:]
+            if all([isRetryable(p.cmd) for p in retryList]):
+                for p in retryList:
+                    p.resp = None
+                    p.error = None
+                self._sendBatch(retryList,attempt+1)
+                return
+        if errors:
+            # The device's state is no longer known
+            self.invalidate()
+            raise BatchError(errors)
+
+    def _sendUrgent(self,cmd,onQueued=None):
+        """
+        If another thread is sending a batch, has it send the given command
+        ahead of the batch's commands not yet written and waits for the
+        response. Returns False, without sending the command, if no batch is
+        being sent or the command was not written before the batch completed.
+        Raises the command's error if it failed.
+
+        onQueued, e.g. to update the cache, is called by the sending thread,
+        under the controller's lock, before the command is written. The
+        sending thread also invalidates the channel if the command fails.
+        """
+        with self._urgentLock:
+            if self._sender is None or self._sender is threading.current_thread():
+                return False
+            pending = PendingCommand(cmd)
+            pending.done = threading.Event()
+            pending.onQueued = onQueued
+            self._urgent.append(pending)
+        pending.done.wait()
+        if pending.resp is None and pending.error is None:
+            return False
+        if pending.error is not None:
+            raise pending.error
+        return True
+
+    def _stripEcho(self,resp):
+        """
+        If we are in echo mode separate out the echo from the response
+        """
+        if self.echo:
+            resp = resp[1:]
         return resp
 
+    def _readResponse(self,cmd,timeout):
+        """
+        Reads the device's response to the given command. Returns as soon as
+        the complete response has been received rather than waiting for the
+        timeout to expire. Returns the list of lines received and a flag
+        indicating whether or not the response was complete.
+        """
+        framing = getFraming(cmd)
+        if framing == FRAME_UNKNOWN:
+            data = self._rxBuffer + ''.join(self.readlines(timeout))
+            self._rxBuffer = ''
+            self._rxCount += len(data)
+            resp = [line.strip() for line in data.split('\n') if line.strip()]
+            return resp, True
+
+        resp = []
+        if self.echo:
+            line = self._readLine(timeout)
+            if line is None:
+                return resp, False
+            resp.append(line)
+
+        while True:
+            line = self._readLine(timeout)
+            if line is None:
+                return resp, False
+            resp.append(line)
+            if framing == FRAME_LINE:
+                break
+            if framing == FRAME_ACK and line[0] == '#':
+                break
+            if framing == FRAME_PROFILE and isProfileEnd(line):
+                break
+        return resp, True
+
+    def _readLine(self,timeout):
+        """
+        Reads a single non-empty line from the device. Returns None if the 
+        timeout expires before a full line has been received.
+        """
+        while True:
+            while not '\n' in self._rxBuffer:
+                data = self.read(max(self.inWaiting(),1),timeout)
+                if not data:
+                    return None
+                self._rxBuffer += data
+            line, self._rxBuffer = self._rxBuffer.split('\n',1)
+            self._rxCount += len(line) + 1
+            line = line.strip()
+            if line:
+                return line
+
+    def _recordCmd(self,cmd,t0,resp,complete,bytesRead):
+        """
+        Records the round trip latency, in seconds, of a command written at
+        time t0 and passes the details to the instrumentation if enabled.
+        """
+        dt = time.time() - t0
+        name = getCmdName(cmd)
+        self.lastLatency = dt
+        self.latency[name] = dt
+        if self.instrumentation is not None:
+            record = CommandRecord(
+                    name=name,
+                    cmd=cmd,
+                    startTime=t0,
+                    latency=dt,
+                    bytesWritten=len(cmd) + 2,
+                    bytesRead=bytesRead,
+                    timedOut=not complete,
+                    resp=resp,
+                    )
+            self.instrumentation.onCommandDone(record)
+
+
+class PendingCommand(object):
+    """
+    A command queued in a batch. The response, and any error, are filled in 
+    when the batch is sent.
+    """
+
+    def __init__(self,cmd,checkResponse=True):
+        self.cmd = cmd
+        self.checkResponse = checkResponse
+        self.resp = None
+        self.error = None
+        # Set for commands sent for another thread, see _sendUrgent
+        self.done = None
+        self.onQueued = None
+
+
+class CommandBatch(object):
+    """
+    Queues commands issued to a LedController and sends them pipelined on
+    exit. Attribute access is forwarded to the controller so the
+    batch can be used in place of it. See LedController.batch.
+    """
+
+    def __init__(self,dev):
+        self.dev = dev
+        self.pending = []
+        self._depth = 0
+
+    def __getattr__(self,name):
+        return getattr(self.dev,name)
+
+    def __enter__(self):
+        self._depth += 1
+        self.dev._batch = self
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        self._depth -= 1
+        if self._depth > 0:
+            return False
+        self.dev._batch = None
+        if excType is None:
+            self.dev._sendBatch(self.pending)
+        else:
+            # The queued commands are dropped but the cache already holds
+            # their values
+            chanSet = set([getChannel(p.cmd) for p in self.pending])
+            if None in chanSet:
+                self.dev.invalidate()
+            else:
+                for chan in chanSet:
+                    self.dev.invalidate(chan)
+        return False
+
+
+class DeferredStore(object):
+    """
+    Coalesces calls to LedController.store into a single store when the
+    context exits, or once the debounce interval has elapsed since the last
+    request. See LedController.deferStore.
+    """
+
+    def __init__(self,dev,debounce=None):
+        self.dev = dev
+        self.debounce = debounce
+        self.pending = False
+        self.requestTime = None
+        self._depth = 0
+
+    def __enter__(self):
+        self._depth += 1
+        self.dev._deferredStore = self
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        self._depth -= 1
+        if self._depth > 0:
+            return False
+        self.dev._deferredStore = None
+        if excType is None:
+            self.flush()
+        return False
+
+    def request(self):
+        """
+        Requests a store. 
+        """
+        self.pending = True
+        self.requestTime = time.time()
+
+    def poll(self):
+        """
+        Stores the settings if a store has been requested and the debounce
+        interval has elapsed since the last request.
+        """
+        if self.pending and self.debounce is not None:
+            if time.time() - self.requestTime >= self.debounce:
+                self.flush()
+
+    def flush(self):
+        """
+        Stores the settings now if a store has been requested and they have
+        changed.
+        """
+        if self.pending:
+            self.pending = False
+            if self.dev.dirty:
+                self.dev._storeNow()
+
 
 def findKey(d,val):
     """
@@ -467,6 +1902,165 @@ def findKey(d,val):
     """
     return [k for k,v in d.iteritems() if v == val][0]
 
+def parseDeviceInfo(infoStr):
+    """
+    Parses the device information string returned by getDeviceInfo. Returns
+    a dictionary with the keys 'firmware', 'module' and 'serial'. Values which
+    cannot be found are set to None.
+    """
+    infoDict = {}
+    for key, pattern in DEVICE_INFO_PATTERNS.iteritems():
+        match = re.search(pattern,infoStr)
+        infoDict[key] = match.group(1) if match else None
+    return infoDict
+
+def printSnapshot(snapshot):
+    """
+    Prints the device information and channel settings of a DeviceSnapshot.
+    """
+    print
+    print(snapshot.deviceInfo)
+    print
+    for settings in snapshot.channels:
+        print('chan: {0}'.format(settings.chan))
+        print('  mode: {0}'.format(settings.mode))
+        print('  normal mode parameters')
+        print('    imax: {0}'.format(settings.normalImax))
+        print('    iset: {0}'.format(settings.normalIset))
+
+        print('  strobe mode parameters')
+        print('    imax: {0}'.format(settings.strobeImax))
+        print('    repeat: {0}'.format(settings.strobeRepeat))
+        print('  strobe mode profile')
+        for j,values in enumerate(settings.strobeProfile):
+            iset,tset = values
+            print('    step {0}'.format(j))
+            print('      iset: {0}'.format(iset)) 
+            print('      tset: {0}'.format(tset))
+
+        print('  trigger mode parameters')
+        print('    imax: {0}'.format(settings.triggerImax))
+        print('    polarity: {0}'.format(settings.triggerPolarity))
+        print('  trigger mode profile')
+        for j,values in enumerate(settings.triggerProfile):
+            iset,tset = values
+            print('    step {0}'.format(j))
+            print('      iset: {0}'.format(iset)) 
+            print('      tset: {0}'.format(tset))
+
+        print('')
+
+def mergeProfileSteps(profileValues):
+    """
+    Merges adjacent profile steps with the same current into a single step
+    whose time is the sum of the merged steps' times.
+    """
+    merged = []
+    for iset, tset in profileValues:
+        if merged and merged[-1][0] == iset:
+            merged[-1] = (iset, merged[-1][1] + tset)
+        else:
+            merged.append((iset,tset))
+    return merged
+
+def profileToArrays(profileValues):
+    """
+    Converts a list of (iset,tset) pairs to iset and tset arrays, or lists if
+    numpy is not available.
+    """
+    iset = [v[0] for v in profileValues]
+    tset = [v[1] for v in profileValues]
+    if numpy is not None:
+        iset = numpy.array(iset,dtype=int)
+        tset = numpy.array(tset,dtype=int)
+    return iset, tset
+
+def getCmdName(cmd):
+    """
+    Returns the name of the given command string, e.g. 'MODE' for 'MODE 1 2'.
+    """
+    return cmd.split()[0]
+
+def getFraming(cmd):
+    """
+    Returns the response framing for the given command string.
+    """
+    return CMD_FRAMING.get(getCmdName(cmd),FRAME_LINE)
+
+def isQuery(cmd):
+    """
+    Returns True if the given command string queries the device.
+    """
+    return cmd[0] == '?' or getCmdName(cmd) == 'DEVICEINFO'
+
+def isRetryable(cmd):
+    """
+    Returns True if the given command string can safely be sent again when
+    its response is lost or invalid.
+    """
+    name = getCmdName(cmd)
+    return name not in NON_IDEMPOTENT_CMDS and getFraming(cmd) != FRAME_UNKNOWN
+
+def dropSuperseded(pendingList,cmd):
+    """
+    Returns the list of pending commands, not yet written, which are still
+    to be sent once the given safety command, disabling a channel, has been
+    written ahead of them. The commands for the same channel, other than
+    disabling it, are dropped and their error set to CommandSuperseded.
+    """
+    chan = getChannel(cmd)
+    keepList = []
+    for p in pendingList:
+        if p.done is None and getChannel(p.cmd) == chan and getPriority(p.cmd) != PRIORITY_SAFETY:
+            p.error = CommandSuperseded('dropped, channel {0} disabled by {1}'.format(chan,cmd))
+        else:
+            keepList.append(p)
+    return keepList
+
+def validateResponse(cmd,resp,complete):
+    """
+    Checks the response, with any echo removed, to the given command string.
+    Returns the exception describing the problem or None if the response is
+    valid. Responses to commands whose framing is unknown are not checked.
+    """
+    if not complete:
+        return ResponseTimeout('incomplete response to {0}'.format(cmd))
+    if getFraming(cmd) == FRAME_UNKNOWN:
+        return None
+    if not resp:
+        return MalformedResponse('empty response to {0}'.format(cmd))
+    for line in resp:
+        if line in ERROR_REPLIES:
+            return ERROR_REPLIES[line](cmd,line)
+
+    name = getCmdName(cmd)
+    if not isQuery(cmd):
+        if resp[-1][0] != '#':
+            return MalformedResponse('unexpected response to {0}: {1}'.format(cmd,resp[-1]))
+        return None
+    numValues = QUERY_NUM_VALUES.get(name)
+    if numValues is None:
+        return None
+    if resp[0][0] != '#':
+        return MalformedResponse('unexpected response to {0}: {1}'.format(cmd,resp[0]))
+    for line in resp:
+        valueList = line.lstrip('#').split()
+        if len(valueList) < numValues or not all([v.isdigit() for v in valueList]):
+            return MalformedResponse('truncated response to {0}: {1}'.format(cmd,line))
+    return None
+
+def isProfileEnd(line):
+    """
+    Returns True if the given line of a profile dump is the terminating step,
+    i.e., the step with a zero time value. Lines which cannot be parsed, such
+    as error replies, also end the profile.
+    """
+    valueList = line.lstrip('#').split()
+    try:
+        return int(valueList[1]) == 0
+    except (IndexError, ValueError):
+        return True
+
 
 # -----------------------------------------------------------------------------
 if __name__ == '__main__':
@@ -0,0 +1,173 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import sys
+import threading
+from timing import getStats, getTime
+
+DEFAULT_LATENCY_ALPHA = 0.2
+
+
+class PlaybackStats(object):
+    """
+    Timing statistics for a playback. Lateness is the time, in seconds, from
+    a frame's requested time to the completion of its update command.
+    """
+
+    def __init__(self):
+        self.requestedFrames = 0
+        self.sentFrames = 0
+        self.droppedFrames = 0
+        self.lateness = []
+        self.latency = []
+
+    def toDict(self):
+        """
+        Returns the statistics as a dictionary.
+        """
+        statsDict = {
+                'requestedFrames' : self.requestedFrames,
+                'sentFrames'      : self.sentFrames,
+                'droppedFrames'   : self.droppedFrames,
+                }
+        if self.lateness:
+            statsDict['lateness'] = getStats(self.lateness)
+            statsDict['latency'] = getStats(self.latency)
+        return statsDict
+
+
+class SequencePlayer(object):
+    """
+    Plays a timed sequence of frames on a dedicated thread. Each frame is a
+    (t, value) pair where t is the time, in seconds, from the start of the
+    playback and value is passed to the update function, e.g.,
+
+    pwm = PwmController(port)
+    frames = fromArrays(times,valueLists)
+    player = SequencePlayer(pwm.setValueAll,frames)
+    player.start()
+    player.join()
+    print(player.stats.toDict())
+
+    frames can be any iterable, including a generator streaming from disk,
+    with increasing times. Updates are scheduled against a monotonic clock
+    and sent early by the measured command latency (an exponentially
+    weighted moving average with weight latencyAlpha) scaled by
+    compensation. When the link falls behind, frames whose successor is
+    already due are dropped so that only the most recent value is sent.
+    """
+
+    def __init__(self,update,frames,latencyAlpha=DEFAULT_LATENCY_ALPHA,compensation=1.0):
+        self.update = update
+        self.frames = frames
+        self.latencyAlpha = latencyAlpha
+        self.compensation = compensation
+        self.latency = 0.0
+        self.stats = PlaybackStats()
+        self.error = None
+        self._stopEvent = threading.Event()
+        self._thread = None
+
+    def start(self,delay=0.0):
+        """
+        Starts the playback after the given delay in seconds.
+        """
+        self._startTime = getTime() + delay
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the playback and waits for the playback thread to exit.
+        """
+        self._stopEvent.set()
+        self.join()
+
+    def join(self,timeout=None):
+        """
+        Waits for the playback to finish.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def isRunning(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _getSendTime(self,t):
+        """
+        Returns the clock time at which to send the frame with time t.
+        """
+        return self._startTime + t - self.compensation*self.latency
+
+    def _run(self):
+        frameIter = iter(self.frames)
+        nextFrame = getNext(frameIter)
+        while nextFrame is not None and not self._stopEvent.is_set():
+            frame, nextFrame = nextFrame, getNext(frameIter)
+            self.stats.requestedFrames += 1
+
+            # Drop frames which have been superseded by a frame already due
+            while nextFrame is not None and getTime() >= self._getSendTime(nextFrame[0]):
+                self.stats.droppedFrames += 1
+                self.stats.requestedFrames += 1
+                frame, nextFrame = nextFrame, getNext(frameIter)
+
+            dt = self._getSendTime(frame[0]) - getTime()
+            if dt > 0 and self._stopEvent.wait(dt):
+                break
+
+            t0 = getTime()
+            try:
+                self.update(frame[1])
+            except Exception:
+                self.error = sys.exc_info()[1]
+                break
+            t1 = getTime()
+            latency = t1 - t0
+            if self.stats.sentFrames == 0:
+                self.latency = latency
+            else:
+                self.latency += self.latencyAlpha*(latency - self.latency)
+            self.stats.sentFrames += 1
+            self.stats.latency.append(latency)
+            self.stats.lateness.append(t1 - (self._startTime + frame[0]))
+
+
+def currentUpdate(dev,chan):
+    """
+    Returns an update function which sets the normal mode current of the
+    given channel of a LedController, for playing sequences of currents in
+    mA, e.g., SequencePlayer(currentUpdate(dev,1),frames).
+    """
+    def update(iset):
+        dev.setNormalModeCurrent(chan,int(iset))
+    return update
+
+def fromArrays(times,values):
+    """
+    Returns an iterator of (t,value) frames from sequences of times, in
+    seconds, and values.
+    """
+    return iter(zip(times,values))
+
+def getNext(frameIter):
+    """
+    Returns the next frame from the iterator or None when exhausted.
+    """
+    try:
+        return next(frameIter)
+    except StopIteration:
+        return None
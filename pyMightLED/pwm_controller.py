@@ -14,32 +14,92 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import led_controller
+from duty_cycle import DutyCycleTable
+
+# Device state read in the same write as ECHOOFF at startup so that only the
+# commands which change the device's state are sent by the initialization
+STARTUP_QUERIES = ['?MODE', '?STROBE', '?STRP']
 
 class PwmController(object):
     """
     Controls led intesity using pwm based on the strobe mode of  the
     mighex LED controllers.
+
+    Values are converted to profile times using a precomputed DutyCycleTable
+    for the pwm frequency. An optional intensity curve, e.g. GammaCurve or
+    CalibrationCurve from duty_cycle, is applied when building the table.
+
+    At startup the device's mode, strobe parameters and strobe profiles are
+    read in a single pipelined write and only the commands needed to disable
+    the channels and set the maximum currents are sent. If lazy is True the
+    port is not opened until the first command. If stateFile is given the
+    device's last known state is loaded from, and saved to on close, the file
+    and trusted instead of being read from the device.
     """
 
-    def __init__(self,port,freq=1000,iset=[1000,1000,1000,1000]):
+    def __init__(self,port,freq=1000,iset=[1000,1000,1000,1000],curve=None,lazy=False,stateFile=None):
         self._createEnabledList()
+        self.invalidate()
         self.freq = float(freq)
         self.iset = iset
-        self.ledController = led_controller.LedController(port)
-        self.disableAll()
-        self.setImaxAll(led_controller.MAX_CURRENT)
-        self.setValueAll([0,0,0,0])
+        self.curve = curve
+        self.table = None
+        self.ledController = led_controller.LedController(
+                port,
+                cache=True,
+                lazy=True,
+                stateFile=stateFile,
+                startupQueries=STARTUP_QUERIES,
+                )
+        self._initialized = False
+        if not lazy:
+            self._initDevice()
+
+    def close(self):
+        self.ledController.close()
+
+    def _initDevice(self):
+        """
+        Connects to the device, disables all channels and sets the maximum
+        currents. Profiles already programmed on the device are not sent
+        again.
+        """
+        self._initialized = True
+        self.ledController.connect()
+        cache = self.ledController.cache
+        for i in range(led_controller.NUM_CHANNELS):
+            high = cache.getProfileStep(i+1,'strobe',0)
+            low = cache.getProfileStep(i+1,'strobe',1)
+            if high is not None and low is not None and high[1] > 0 and low[0] == 0 and low[1] > 0:
+                self._programmedList[i] = (high[1],low[1],high[0])
+        with self.ledController.batch():
+            self.disableAll()
+            self.setImaxAll(led_controller.MAX_CURRENT)
+
+    def _checkInit(self):
+        if not self._initialized:
+            self._initDevice()
 
     def _createEnabledList(self):
         self.enabledList = []
         for i in range(led_controller.NUM_CHANNELS):
             self.enabledList.append(False)
 
+    def invalidate(self):
+        """
+        Forgets the profile values last programmed for each channel so that
+        they are sent again by the next call to setValue. Use if the device's
+        settings have been changed by other means.
+        """
+        self._programmedList = [None]*led_controller.NUM_CHANNELS
+
     def enable(self,chan):
+        self._checkInit()
         self.ledController.setMode(chan,'strobe')
         self.enabledList[chan-1] = True
 
     def disable(self,chan):
+        self._checkInit()
         self.ledController.setMode(chan,'disable')
         self.enabledList[chan-1] = False
 
@@ -59,32 +119,91 @@ class PwmController(object):
         period = period*1.0e6
         return int(period)
 
+    def getTable(self):
+        """
+        Returns the duty cycle table for the current frequency and curve,
+        rebuilding it if either has changed.
+        """
+        table = self.table
+        if table is None or table.freq != self.freq or table.curve is not self.curve:
+            table = DutyCycleTable(self.freq,curve=self.curve)
+            self.table = table
+        return table
+
+    def quantize(self,values):
+        """
+        Converts a sequence of values (floats between 0 and 1) to arrays of
+        timeHigh and timeLow values in a single pass. The results can be
+        passed to setTimes or setTimesAll.
+        """
+        return self.getTable().quantize(values)
+
     def setValue(self,chan,value):
         """
         Set the output value for the given channel. 
         chan = channel number 1,2,3 or 4
         value = channel value (float between 0 and 1)
         """
-        period = self.getPeriod()
-        timeHigh = int(value*period)
-        timeLow = period - timeHigh
+        timeHigh, timeLow = self.getTable().lookup(value)
+        self.setTimes(chan,timeHigh,timeLow)
+
+    def setTimes(self,chan,timeHigh,timeLow):
+        """
+        Set the high and low times, in us, of the pwm cycle for the given
+        channel. The channel is disabled if timeHigh is 0.
+
+        Only the profile steps which differ from those last programmed are
+        sent and the channel is only re-enabled if the profile changed. The
+        disable is always sent.
+        """
+        self._checkInit()
+        timeHigh = int(timeHigh)
+        timeLow = int(timeLow)
         if timeHigh == 0:
+            # Never skipped as the device may have been enabled by other means
             self.disable(chan)
         else:
             iset = self.iset[chan-1]
-            self.ledController.setStrobeModeProfile(chan,0,iset,timeHigh)
-            self.ledController.setStrobeModeProfile(chan,1,0,timeLow)
-            if self.enabledList[chan-1]:
-                self.enable(chan)
+            last = self._programmedList[chan-1]
+            if last == (timeHigh,timeLow,iset):
+                return
+            try:
+                with self.ledController.batch():
+                    if last is None or last[0] != timeHigh or last[2] != iset:
+                        self.ledController.setStrobeModeProfile(chan,0,iset,timeHigh)
+                    if last is None or last[1] != timeLow:
+                        self.ledController.setStrobeModeProfile(chan,1,0,timeLow)
+                    if self.enabledList[chan-1]:
+                        self.enable(chan)
+            except led_controller.BatchError:
+                self.invalidate()
+                raise
+            self._programmedList[chan-1] = (timeHigh,timeLow,iset)
+
+    def setTimesAll(self,timeHighList,timeLowList):
+        """
+        Set the high and low times, in us, for all channels in a single
+        pipelined batch.
+        """
+        self._checkInit()
+        try:
+            with self.ledController.batch():
+                for i in range(len(timeHighList)):
+                    self.setTimes(i+1,timeHighList[i],timeLowList[i])
+        except led_controller.BatchError:
+            self.invalidate()
+            raise
 
     def setValueAll(self,valueList):
         """
-        Set the output values for all channels
+        Set the output values for all channels. The commands for all channels
+        are sent to the device in a single pipelined batch.
         """
-        for i,value in enumerate(valueList):
-            self.setValue(i+1,value)
+        timeHighList, timeLowList = self.quantize(valueList)
+        self.setTimesAll(timeHighList,timeLowList)
 
     def setImax(self,chan,imax):
+        self._checkInit()
         self.ledController.setStrobeModeParams(chan,imax,'forever')
 
     def setImaxAll(self,imax):
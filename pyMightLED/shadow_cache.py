@@ -0,0 +1,148 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+class ChannelState(object):
+    """
+    Last known state of a single channel. Values which are not known are set
+    to None. The profiles are dictionaries mapping step number to (iset,tset)
+    pairs for the steps which are known.
+    """
+
+    def __init__(self):
+        self.mode = None
+        self.normalParams = None
+        self.strobeParams = None
+        self.triggerParams = None
+        self.profiles = {'strobe': {}, 'trigger': {}}
+        # False if parameters have changed since the mode was last set. The
+        # device requires the mode to be set again for them to take effect.
+        self.latched = False
+
+
+class ShadowCache(object):
+    """
+    Write-through cache of the device's settings used by the LedController
+    to skip commands which would not change the device's state and to answer
+    queries without a round trip to the device.
+    """
+
+    def __init__(self,numChannels,numSteps):
+        self.numChannels = numChannels
+        self.numSteps = numSteps
+        self.invalidate()
+
+    def __getitem__(self,chan):
+        return self._stateList[chan-1]
+
+    def invalidate(self,chan=None):
+        """
+        Forget the cached state of the given channel, or of all channels if
+        chan is None.
+        """
+        if chan is None:
+            self._stateList = [ChannelState() for i in range(self.numChannels)]
+        else:
+            self._stateList[chan-1] = ChannelState()
+
+    def getProfile(self,chan,name):
+        """
+        Returns the cached profile, 'strobe' or 'trigger', for the given
+        channel as a list of (iset,tset) pairs. Returns None if any of the
+        steps up to the end of the profile are unknown.
+        """
+        steps = self[chan].profiles[name]
+        profileValues = []
+        for step in range(self.numSteps):
+            values = steps.get(step)
+            if values is None:
+                return None
+            if values[1] == 0:
+                break
+            profileValues.append(values)
+        return profileValues
+
+    def setProfile(self,chan,name,profileValues):
+        """
+        Sets the cached profile, 'strobe' or 'trigger', for the given channel
+        from a list of (iset,tset) pairs read from the device.
+        """
+        steps = dict(enumerate(profileValues))
+        if len(profileValues) < self.numSteps:
+            steps[len(profileValues)] = (0,0)
+        self[chan].profiles[name] = steps
+
+    def getProfileStep(self,chan,name,step):
+        """
+        Returns the cached (iset,tset) values for the given profile step or
+        None if unknown.
+        """
+        return self[chan].profiles[name].get(step)
+
+    def setProfileStep(self,chan,name,step,iset,tset):
+        """
+        Sets the cached (iset,tset) values for the given profile step.
+        """
+        self[chan].profiles[name][step] = (iset,tset)
+
+    def toDict(self):
+        """
+        Returns the cached state as a dictionary which can be saved as JSON.
+        Profiles are lists of [step,iset,tset] values.
+        """
+        channels = []
+        for state in self._stateList:
+            profiles = {}
+            for name, steps in state.profiles.iteritems():
+                profiles[name] = [[step,iset,tset] for step, (iset,tset) in sorted(steps.iteritems())]
+            channels.append({
+                'mode'          : state.mode,
+                'normalParams'  : state.normalParams,
+                'strobeParams'  : state.strobeParams,
+                'triggerParams' : state.triggerParams,
+                'profiles'      : profiles,
+                'latched'       : state.latched,
+                })
+        return {'channels': channels}
+
+    def fromDict(self,cacheDict):
+        """
+        Sets the cached state from a dictionary as returned by toDict.
+        """
+        self.invalidate()
+        for state, stateDict in zip(self._stateList,cacheDict['channels']):
+            state.mode = toStr(stateDict['mode'])
+            state.normalParams = toTuple(stateDict['normalParams'])
+            state.strobeParams = toTuple(stateDict['strobeParams'])
+            state.triggerParams = toTuple(stateDict['triggerParams'])
+            for name, stepList in stateDict['profiles'].iteritems():
+                steps = dict([(step,(iset,tset)) for step, iset, tset in stepList])
+                state.profiles[str(name)] = steps
+            state.latched = stateDict['latched']
+
+
+def toTuple(values):
+    """
+    Converts a list of values loaded from JSON to a tuple, strings are
+    converted from unicode.
+    """
+    if values is None:
+        return None
+    return tuple([toStr(v) for v in values])
+
+def toStr(value):
+    if isinstance(value,unicode):
+        return str(value)
+    return value
@@ -0,0 +1,191 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+from collections import namedtuple
+
+CHANNEL_FIELDS = [
+        'chan',
+        'mode',
+        'normalImax',
+        'normalIset',
+        'strobeImax',
+        'strobeRepeat',
+        'strobeProfile',
+        'triggerImax',
+        'triggerPolarity',
+        'triggerProfile',
+        ]
+
+PROFILE_FIELDS = ['strobeProfile', 'triggerProfile']
+
+
+class ChannelSettings(namedtuple('ChannelSettings',CHANNEL_FIELDS)):
+    """
+    Immutable settings of a single channel. The profiles are tuples of
+    (iset,tset) pairs. When used as a desired state, see diffSettings, fields
+    may be omitted or set to None to leave them unchanged.
+    """
+
+    __slots__ = ()
+
+    def toDict(self):
+        """
+        Returns the settings as a dictionary.
+        """
+        settingsDict = dict(self._asdict())
+        for name in PROFILE_FIELDS:
+            settingsDict[name] = [list(values) for values in settingsDict[name]]
+        return settingsDict
+
+    @classmethod
+    def fromDict(cls,settingsDict):
+        """
+        Creates channel settings from a dictionary as returned by toDict.
+        """
+        settingsDict = dict(settingsDict)
+        for name in PROFILE_FIELDS:
+            profile = settingsDict[name]
+            settingsDict[name] = tuple([tuple(values) for values in profile])
+        return cls(**settingsDict)
+
+
+ChannelSettings.__new__.__defaults__ = (None,)*len(CHANNEL_FIELDS)
+
+
+class DeviceSnapshot(namedtuple('DeviceSnapshot',['deviceInfo','timestamp','channels'])):
+    """
+    Immutable snapshot of the settings of all channels of a device. channels
+    is a tuple of ChannelSettings ordered by channel number.
+    """
+
+    __slots__ = ()
+
+    def getChannel(self,chan):
+        """
+        Returns the settings for the given channel.
+        """
+        return self.channels[chan-1]
+
+    def toDict(self):
+        """
+        Returns the snapshot as a dictionary.
+        """
+        return {
+                'deviceInfo' : self.deviceInfo,
+                'timestamp'  : self.timestamp,
+                'channels'   : [c.toDict() for c in self.channels],
+                }
+
+    def toJson(self,**kwargs):
+        """
+        Returns the snapshot as a JSON string. Keyword arguments are passed
+        to json.dumps.
+        """
+        return json.dumps(self.toDict(),**kwargs)
+
+    @classmethod
+    def fromDict(cls,snapshotDict):
+        """
+        Creates a snapshot from a dictionary as returned by toDict.
+        """
+        channels = [ChannelSettings.fromDict(c) for c in snapshotDict['channels']]
+        return cls(
+                deviceInfo=snapshotDict['deviceInfo'],
+                timestamp=snapshotDict['timestamp'],
+                channels=tuple(channels),
+                )
+
+    @classmethod
+    def fromJson(cls,jsonStr):
+        """
+        Creates a snapshot from a JSON string as returned by toJson.
+        """
+        return cls.fromDict(json.loads(jsonStr))
+
+
+def diffSettings(current,desired):
+    """
+    Computes the minimal list of commands required to change a channel from
+    the current to the desired settings. Fields of the desired settings which
+    are None are left unchanged. Returns a list of (methodName, args) pairs
+    for the LedController setters in the order they should be called.
+    """
+    chan = current.chan
+    cmdList = []
+    changed = set()
+
+    def pick(name):
+        value = getattr(desired,name)
+        if value is None:
+            value = getattr(current,name)
+        return value
+
+    imax, iset = pick('normalImax'), pick('normalIset')
+    if imax != current.normalImax:
+        cmdList.append(('setNormalModeParams',(chan,imax,iset)))
+        changed.add('normal')
+    elif iset != current.normalIset:
+        # Takes effect immediately - no need to set the mode again
+        cmdList.append(('setNormalModeCurrent',(chan,iset)))
+
+    imax, repeat = pick('strobeImax'), pick('strobeRepeat')
+    if str(repeat).lower() == 'forever':
+        # The device reports the special value 9999 for forever
+        repeat = 9999
+    if (imax,repeat) != (current.strobeImax,current.strobeRepeat):
+        cmdList.append(('setStrobeModeParams',(chan,imax,repeat)))
+        changed.add('strobe')
+    profileCmdList = diffProfile(chan,'setStrobeModeProfile',current.strobeProfile,desired.strobeProfile)
+    if profileCmdList:
+        cmdList.extend(profileCmdList)
+        changed.add('strobe')
+
+    imax, polarity = pick('triggerImax'), pick('triggerPolarity').lower()
+    if (imax,polarity) != (current.triggerImax,current.triggerPolarity):
+        cmdList.append(('setTriggerModeParams',(chan,imax,polarity)))
+        changed.add('trigger')
+    profileCmdList = diffProfile(chan,'setTriggerModeProfile',current.triggerProfile,desired.triggerProfile)
+    if profileCmdList:
+        cmdList.extend(profileCmdList)
+        changed.add('trigger')
+
+    # The device requires the mode to be set for changes to the parameters of
+    # the current mode to take effect. Disabling is never skipped as the
+    # current settings may be stale.
+    mode = pick('mode')
+    if mode != current.mode or mode in changed or desired.mode == 'disable':
+        cmdList.append(('setMode',(chan,mode)))
+    return cmdList
+
+def diffProfile(chan,methodName,current,desired):
+    """
+    Computes the list of profile step commands required to change the current
+    profile to the desired profile. Unless the profile uses all the steps a
+    zero step is written after it to terminate it, if not already there, so
+    that the device's old steps past the end do not become part of it.
+    """
+    # Imported here as led_controller imports this module
+    from led_controller import NUM_PROFILE_STEPS
+    if desired is None:
+        return []
+    cmdList = []
+    for step, values in enumerate(desired):
+        iset, tset = values
+        if step >= len(current) or tuple(current[step]) != (iset,tset):
+            cmdList.append((methodName,(chan,step,iset,tset)))
+    if len(desired) < NUM_PROFILE_STEPS and len(desired) != len(current):
+        cmdList.append((methodName,(chan,len(desired),0,0)))
+    return cmdList
@@ -0,0 +1,95 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+
+PERCENTILES = [50, 90, 99]
+
+# Value of CLOCK_MONOTONIC for clock_gettime on each platform
+CLOCK_MONOTONIC = {
+        'linux'  : 1,
+        'linux2' : 1,
+        'darwin' : 6,
+        }
+
+
+class Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def getStats(durations):
+    """
+    Returns timing statistics, in seconds, for the given list of durations.
+    """
+    values = sorted(durations)
+    stats = {
+            'count' : len(values),
+            'mean'  : sum(values)/len(values),
+            'min'   : values[0],
+            'max'   : values[-1],
+            }
+    for p in PERCENTILES:
+        stats['p{0}'.format(p)] = percentile(values,p)
+    return stats
+
+def percentile(values,p):
+    """
+    Returns the p-th percentile of the sorted list of values using linear
+    interpolation between the closest ranks.
+    """
+    pos = (len(values) - 1)*p/100.0
+    i = int(pos)
+    j = min(i+1,len(values)-1)
+    return values[i] + (values[j] - values[i])*(pos - i)
+
+def getMonotonicClock():
+    """
+    Returns a function giving the time, in seconds, of a monotonic clock,
+    i.e., one which is not affected by changes to the system time. Uses
+    time.monotonic if available (python >= 3.3), otherwise clock_gettime
+    through ctypes. Falls back to time.time if neither is available.
+    """
+    if hasattr(time,'monotonic'):
+        return time.monotonic
+    clockId = CLOCK_MONOTONIC.get(sys.platform)
+    if clockId is None:
+        return time.time
+    for name in ('rt', 'c'):
+        path = ctypes.util.find_library(name)
+        if path is None:
+            continue
+        try:
+            clock_gettime = ctypes.CDLL(path,use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+        clock_gettime.restype = ctypes.c_int
+        break
+    else:
+        return time.time
+
+    def monotonic():
+        t = Timespec()
+        if clock_gettime(clockId,ctypes.byref(t)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno,os.strerror(errno))
+        return t.tv_sec + 1.0e-9*t.tv_nsec
+    return monotonic
+
+getTime = getMonotonicClock()
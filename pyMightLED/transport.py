@@ -0,0 +1,483 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import time
+import atexit
+import weakref
+import fcntl
+import select
+import socket
+import threading
+import serial
+
+BAUDRATE = 9600
+CONNECT_TIMEOUT = 2.0
+RECV_SIZE = 4096
+READER_POLL_DT = 0.05
+
+# Running reader threads, stopped at exit
+_readers = weakref.WeakSet()
+
+
+class TransportError(IOError):
+    """
+    The connection to the device failed and could not be re-established.
+    """
+    pass
+
+
+class SerialTransport(serial.Serial):
+    """
+    Local serial port configured as required by the LED controllers,
+    9600-8N1 with no flow control.
+    """
+
+    def __init__(self,port,timeout=None):
+        super(SerialTransport,self).__init__(
+                port=port,
+                baudrate=BAUDRATE,
+                bytesize=serial.EIGHTBITS,
+                parity=serial.PARITY_NONE,
+                stopbits=serial.STOPBITS_ONE,
+                xonxoff=False,
+                rtscts=False,
+                dsrdtr=False,
+                timeout=timeout,
+                )
+
+
+class TcpTransport(object):
+    """
+    Connection to a serial-over-TCP server, e.g. ser2net, given as
+    'socket://host:port'. The connection is kept open between commands with
+    keep-alive enabled and Nagle's algorithm disabled so that each command
+    is sent immediately. If reconnect is True and the connection fails it is
+    re-established once before the error is raised. Only one thread
+    reconnects when the reader and writer both see the failure.
+
+    Provides the subset of the serial.Serial interface used by the
+    LedController. timeout is the read timeout in seconds.
+    """
+
+    def __init__(self,url,timeout=None,connectTimeout=CONNECT_TIMEOUT,reconnect=True):
+        self.port = url
+        self.host, self.tcpPort = parseSocketUrl(url)
+        self.timeout = timeout
+        self.connectTimeout = connectTimeout
+        self.reconnect = reconnect
+        self._sock = None
+        self._rxBuffer = ''
+        self._reconnectLock = threading.Lock()
+        self.open()
+
+    def open(self):
+        """
+        Connects to the server.
+        """
+        try:
+            sock = socket.create_connection((self.host,self.tcpPort),self.connectTimeout)
+        except socket.error, e:
+            raise TransportError, 'unable to connect to {0}: {1}'.format(self.port,e)
+        sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        sock.setsockopt(socket.SOL_SOCKET,socket.SO_KEEPALIVE,1)
+        sock.settimeout(None)
+        self._sock = sock
+        self._rxBuffer = ''
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def isOpen(self):
+        return self._sock is not None
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def write(self,data):
+        """
+        Sends the data, reconnecting and sending again if the connection has
+        failed.
+        """
+        sock = self._sock
+        try:
+            if sock is None:
+                raise socket.error, 'not connected'
+            sock.sendall(data)
+        except socket.error:
+            self._reconnect(sock)
+            self._checkOpen()
+            self._sock.sendall(data)
+        return len(data)
+
+    def read(self,size=1):
+        """
+        Reads up to size bytes, returning early if the timeout expires.
+        """
+        self._checkOpen()
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while len(self._rxBuffer) < size:
+            if self.timeout is None:
+                remaining = None
+            else:
+                remaining = max(deadline - time.time(),0.0)
+            if not self._recv(remaining) and remaining is not None and remaining <= 0:
+                break
+        data, self._rxBuffer = self._rxBuffer[:size], self._rxBuffer[size:]
+        return data
+
+    def inWaiting(self):
+        """
+        Returns the number of bytes which can be read without waiting.
+        """
+        self._checkOpen()
+        while self._recv(0.0):
+            pass
+        return len(self._rxBuffer)
+
+    def readlines(self):
+        """
+        Reads until no data has been received for the timeout and returns the
+        list of lines.
+        """
+        data = ''
+        while True:
+            chunk = self.read(max(self.inWaiting(),1))
+            if not chunk:
+                break
+            data += chunk
+        return data.splitlines(True)
+
+    def flushInput(self):
+        self.inWaiting()
+        self._rxBuffer = ''
+
+    def _recv(self,timeout):
+        """
+        Waits up to timeout seconds for data and adds it to the receive
+        buffer. Returns True if data was received.
+        """
+        sock = self._sock
+        if sock is None:
+            # Closed by another thread
+            return False
+        try:
+            ready, _, _ = select.select([sock],[],[],timeout)
+            if not ready:
+                return False
+            data = sock.recv(RECV_SIZE)
+        except (select.error, socket.error, ValueError):
+            data = ''
+        if not data:
+            # Connection closed by the server, or replaced by the writer, any
+            # response in progress on it is lost
+            self._reconnect(sock)
+            return False
+        self._rxBuffer += data
+        return True
+
+    def _reconnect(self,sock):
+        """
+        Replaces the failed connection sock with a new connection. Does
+        nothing if sock has already been replaced, or closed, by another
+        thread.
+        """
+        with self._reconnectLock:
+            if sock is not self._sock:
+                return
+            self.close()
+            if not self.reconnect:
+                raise TransportError, 'connection to {0} lost'.format(self.port)
+            self.open()
+
+    def _checkOpen(self):
+        if self._sock is None:
+            raise TransportError, 'connection to {0} is not open'.format(self.port)
+
+
+class LoopbackTransport(object):
+    """
+    In-memory transport connected directly to a SiriusEmulator. Commands are
+    processed as soon as they are written so reads never wait.
+    """
+
+    def __init__(self,emulator=None,timeout=None):
+        if emulator is None:
+            from emulator import SiriusEmulator
+            emulator = SiriusEmulator()
+        self.port = 'loop://'
+        self.emulator = emulator
+        self.timeout = timeout
+        self._open = True
+        self._txBuffer = ''
+        self._rxBuffer = ''
+        self._lock = threading.Lock()
+        self._wakeup = WakeupPipe()
+
+    def open(self):
+        self._open = True
+
+    def close(self):
+        self._open = False
+
+    def isOpen(self):
+        return self._open
+
+    def write(self,data):
+        with self._lock:
+            self._txBuffer += data
+            while '\n' in self._txBuffer:
+                line, self._txBuffer = self._txBuffer.split('\n',1)
+                self._rxBuffer += self.emulator.process(line)
+            if self._rxBuffer:
+                self._wakeup.set()
+        return len(data)
+
+    def read(self,size=1):
+        """
+        Reads up to size bytes, waiting at most the timeout for the first
+        byte when none are available, e.g., when read from another thread.
+        """
+        if self.timeout is None:
+            deadline = None
+        else:
+            deadline = time.time() + self.timeout
+        while True:
+            with self._lock:
+                if self._rxBuffer:
+                    data, self._rxBuffer = self._rxBuffer[:size], self._rxBuffer[size:]
+                    return data
+                self._wakeup.clear()
+            if deadline is None:
+                remaining = None
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return ''
+            self._wakeup.wait(remaining)
+
+    def inWaiting(self):
+        return len(self._rxBuffer)
+
+    def readlines(self):
+        with self._lock:
+            data, self._rxBuffer = self._rxBuffer, ''
+        return data.splitlines(True)
+
+    def flushInput(self):
+        with self._lock:
+            self._rxBuffer = ''
+
+
+class WakeupPipe(object):
+    """
+    Wakes a thread waiting, with a timeout, for another thread. Uses a pipe
+    rather than threading.Condition as timed waits on a Condition poll with
+    sleeps of up to 50ms in Python 2.
+    """
+
+    def __init__(self):
+        self._readFd, self._writeFd = os.pipe()
+        for fd in (self._readFd, self._writeFd):
+            flags = fcntl.fcntl(fd,fcntl.F_GETFL)
+            fcntl.fcntl(fd,fcntl.F_SETFL,flags | os.O_NONBLOCK)
+
+    def __del__(self):
+        self.close()
+
+    def set(self):
+        try:
+            os.write(self._writeFd,'x')
+        except OSError:
+            # Pipe full - the waiting thread will be woken anyway
+            pass
+
+    def clear(self):
+        try:
+            while os.read(self._readFd,RECV_SIZE):
+                pass
+        except OSError:
+            pass
+
+    def wait(self,timeout=None):
+        """
+        Waits until set is called, or timeout seconds have passed. Returns
+        True if set was called.
+        """
+        try:
+            ready, _, _ = select.select([self._readFd],[],[],timeout)
+        except select.error:
+            return False
+        return bool(ready)
+
+    def close(self):
+        for fd in (self._readFd, self._writeFd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._readFd = self._writeFd = -1
+
+
+class ReaderThread(object):
+    """
+    Reads from a transport on a dedicated thread and buffers the data for
+    the threads waiting for responses. The transport's timeout is set to
+    pollDt, the interval at which the thread checks whether it has been
+    stopped. Errors raised by the transport are raised by the next read.
+
+    Use pause and resume around closing and reopening the transport.
+    """
+
+    def __init__(self,transport,pollDt=READER_POLL_DT,name=None):
+        self.transport = transport
+        self.pollDt = pollDt
+        self._lock = threading.Lock()
+        self._ioLock = threading.Lock()
+        self._wakeup = WakeupPipe()
+        self._buffer = ''
+        self._error = None
+        self._paused = False
+        self._running = True
+        transport.timeout = pollDt
+        self._thread = threading.Thread(target=self._run,name=name)
+        self._thread.daemon = True
+        self._thread.start()
+        _readers.add(self)
+
+    def read(self,size=1,timeout=None):
+        """
+        Returns up to size bytes, waiting at most timeout seconds for the
+        first byte if none have been received.
+        """
+        if timeout is None:
+            deadline = None
+        else:
+            deadline = time.time() + timeout
+        while True:
+            with self._lock:
+                if self._error is not None:
+                    error, self._error = self._error, None
+                    raise error
+                if self._buffer:
+                    data, self._buffer = self._buffer[:size], self._buffer[size:]
+                    return data
+                self._wakeup.clear()
+            if deadline is None:
+                remaining = None
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return ''
+            self._wakeup.wait(remaining)
+
+    def inWaiting(self):
+        return len(self._buffer)
+
+    def flush(self):
+        """
+        Discards the data received so far.
+        """
+        with self._lock:
+            self._buffer = ''
+
+    def pause(self):
+        """
+        Stops reading from the transport. Returns once any read in progress
+        has completed.
+        """
+        self._paused = True
+        with self._ioLock:
+            pass
+
+    def resume(self):
+        """
+        Starts reading from the transport again, discarding any error.
+        """
+        with self._lock:
+            self._error = None
+        self._paused = False
+
+    def stop(self):
+        """
+        Stops the thread. The transport is left open.
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._thread.join()
+        self._wakeup.close()
+        _readers.discard(self)
+
+    def _run(self):
+        transport = self.transport
+        while self._running:
+            with self._ioLock:
+                idle = self._paused or self._error is not None or not transport.isOpen()
+                if not idle:
+                    try:
+                        data = transport.read(max(transport.inWaiting(),1))
+                    except (serial.SerialException, EnvironmentError), e:
+                        with self._lock:
+                            self._error = e
+                        self._wakeup.set()
+                        continue
+            if idle:
+                time.sleep(self.pollDt)
+            elif data:
+                with self._lock:
+                    self._buffer += data
+                self._wakeup.set()
+
+
+def openTransport(port,timeout=None):
+    """
+    Returns the transport for the given port: 'socket://host:port' for a
+    serial-over-TCP server, 'loop://' for an in-memory emulated device, or
+    the name of a local serial port. A transport object, e.g. a
+    LoopbackTransport for a given emulator, is returned as is with its
+    timeout set.
+    """
+    if not isinstance(port,basestring):
+        port.timeout = timeout
+        return port
+    if port.startswith('socket://'):
+        return TcpTransport(port,timeout=timeout)
+    if port.startswith('loop://'):
+        return LoopbackTransport(timeout=timeout)
+    return SerialTransport(port,timeout=timeout)
+
+def stopReaders():
+    """
+    Stops all running reader threads, called at exit so that they are not
+    running while the interpreter shuts down.
+    """
+    for reader in list(_readers):
+        reader.stop()
+
+atexit.register(stopReaders)
+
+def parseSocketUrl(url):
+    """
+    Returns the (host,port) of a 'socket://host:port' url.
+    """
+    try:
+        host, port = url[len('socket://'):].rsplit(':',1)
+        return host, int(port)
+    except ValueError:
+        raise ValueError, 'expected socket://host:port, got {0}'.format(url)
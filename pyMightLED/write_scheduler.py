@@ -0,0 +1,125 @@
+"""
+Copyright 2010  IO Rodeo Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from transport import BAUDRATE
+
+BITS_PER_BYTE = 10         # 8N1 - start bit, 8 data bits and a stop bit
+INPUT_BUFFER_SIZE = 128    # conservative size of the device's input buffer
+MAX_QUEUE_DELAY = 0.1      # upper bound on the time a command waits on the link
+MAX_IN_FLIGHT = 16         # maximum number of commands awaiting a response
+
+# Priority classes - lower values are sent first
+PRIORITY_SAFETY = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+# Commands whose first argument is the channel number
+CHANNEL_CMDS = ['MODE', 'NORMAL', 'CURRENT', 'STROBE', 'STRP', 'TRIGGER', 'TRIGP']
+
+# Bulk profile uploads
+BULK_CMDS = ['STRP', 'TRIGP']
+
+
+class WriteScheduler(object):
+    """
+    Schedules the commands of a pipelined batch on the serial link.
+
+    Commands are sent in priority order, safety commands, i.e., disabling a
+    channel, first and bulk profile uploads last. Commands are only moved
+    ahead of lower priority commands for other channels, so the commands for
+    each channel are sent in the order issued, and never past commands which
+    do not apply to a single channel, such as STORE or ECHOOFF.
+
+    At most maxInFlight commands, and windowBytes bytes, are written ahead of
+    the responses received so that the device's input buffer cannot overrun.
+    The byte window is derived from the line rate so that no command waits
+    on the link for more than maxDelay seconds behind those already written.
+    """
+
+    def __init__(self,baudrate=BAUDRATE,bufferSize=INPUT_BUFFER_SIZE,maxDelay=MAX_QUEUE_DELAY,
+            maxInFlight=MAX_IN_FLIGHT):
+        self.byteRate = float(baudrate)/BITS_PER_BYTE
+        self.windowBytes = min(bufferSize,int(self.byteRate*maxDelay))
+        self.maxInFlight = maxInFlight
+
+    def order(self,cmdList):
+        """
+        Returns the indices of the given command strings in the order they
+        should be sent.
+        """
+        keyList = [(getPriority(cmd),getChannel(cmd)) for cmd in cmdList]
+        orderList = []
+        for i, (priority, chan) in enumerate(keyList):
+            # Insert before the earliest lower priority command which can be
+            # passed, passing equal priority commands for other channels only
+            # to get there.
+            n = len(orderList)
+            if chan is not None:
+                j = len(orderList)
+                while j > 0:
+                    otherPriority, otherChan = keyList[orderList[j-1]]
+                    if otherChan is None or otherChan == chan or otherPriority < priority:
+                        break
+                    j -= 1
+                    if otherPriority > priority:
+                        n = j
+            orderList.insert(n,i)
+        return orderList
+
+    def canSend(self,cmd,inFlight,inFlightBytes):
+        """
+        Returns True if the given command can be written while inFlight
+        commands, of inFlightBytes bytes in total, await their responses. A
+        command is always sent when nothing is in flight.
+        """
+        if inFlight == 0:
+            return True
+        if inFlight >= self.maxInFlight:
+            return False
+        return inFlightBytes + len(cmd) + 2 <= self.windowBytes
+
+    def getSendTime(self,numBytes):
+        """
+        Returns the time, in seconds, taken to send the given number of bytes
+        at the line rate.
+        """
+        return numBytes/self.byteRate
+
+
+def getPriority(cmd):
+    """
+    Returns the priority class of the given command string.
+    """
+    valueList = cmd.split()
+    name = valueList[0]
+    if name == 'MODE' and valueList[-1] == '0':
+        return PRIORITY_SAFETY
+    if name in BULK_CMDS:
+        return PRIORITY_BULK
+    return PRIORITY_NORMAL
+
+def getChannel(cmd):
+    """
+    Returns the channel the given command string applies to, or None if it
+    does not apply to a single channel.
+    """
+    valueList = cmd.split()
+    name = valueList[0].lstrip('?')
+    if name not in CHANNEL_CMDS or len(valueList) < 2:
+        return None
+    try:
+        return int(valueList[1])
+    except ValueError:
+        return None
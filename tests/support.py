@@ -0,0 +1,95 @@
+"""
+Helpers shared by the tests. Puts the pyMightLED modules on the path and
+provides emulated devices for the LedController to talk to.
+
+Run the tests with: python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','pyMightLED'))
+
+from led_controller import LedController
+from emulator import SiriusEmulator
+from transport import LoopbackTransport
+
+
+class RecordingEmulator(SiriusEmulator):
+    """
+    Emulator which records the command lines it processes, in order, in the
+    lines attribute.
+    """
+
+    def __init__(self,*args,**kwargs):
+        super(RecordingEmulator,self).__init__(*args,**kwargs)
+        self.lines = []
+
+    def process(self,line):
+        if line.strip():
+            self.lines.append(line.strip())
+        return super(RecordingEmulator,self).process(line)
+
+
+class FaultyEmulator(SiriusEmulator):
+    """
+    Emulator which loses the reply to the next drops commands with the given
+    name.
+    """
+
+    def __init__(self,name=None,drops=0):
+        super(FaultyEmulator,self).__init__()
+        self.dropName = name
+        self.drops = drops
+
+    def process(self,line):
+        resp = super(FaultyEmulator,self).process(line)
+        if self.drops > 0 and line.split()[0] == self.dropName:
+            self.drops -= 1
+            return ''
+        return resp
+
+
+class SlowEmulator(SiriusEmulator):
+    """
+    Emulator which takes delay seconds longer to respond to the next count
+    commands with the given name.
+    """
+
+    def __init__(self,name=None,delay=0.0,count=1):
+        super(SlowEmulator,self).__init__()
+        self.slowName = name
+        self.delay = delay
+        self.count = count
+
+    def getBusyTime(self,line):
+        busyTime = super(SlowEmulator,self).getBusyTime(line)
+        if self.count > 0 and line.split()[0] == self.slowName:
+            self.count -= 1
+            busyTime += self.delay
+        return busyTime
+
+
+def openController(emulator=None,**kwargs):
+    """
+    Returns a LedController connected to the given emulator, a new
+    SiriusEmulator if None, through a LoopbackTransport and the emulator.
+    """
+    if emulator is None:
+        emulator = SiriusEmulator()
+    kwargs.setdefault('timeout',0.05)
+    return LedController(LoopbackTransport(emulator),**kwargs), emulator
+
+def getTempFile(testCase,suffix='.json'):
+    """
+    Returns the name of a temporary file, which does not exist yet, removed
+    when the test case is cleaned up.
+    """
+    fd, filename = tempfile.mkstemp(suffix=suffix,prefix='pyMightLED-test-')
+    os.close(fd)
+    os.remove(filename)
+    def remove():
+        if os.path.exists(filename):
+            os.remove(filename)
+    testCase.addCleanup(remove)
+    return filename
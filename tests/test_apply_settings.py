@@ -0,0 +1,70 @@
+"""
+Tests of applySettings and of the minimal command diff it sends.
+"""
+import unittest
+
+from support import openController
+from led_controller import NUM_PROFILE_STEPS
+from snapshot import ChannelSettings, diffSettings, diffProfile
+
+
+class ApplySettingsTest(unittest.TestCase):
+
+    def test_minimal_commands(self):
+        dev, emulator = openController(cache=True)
+        dev.getSnapshot()
+        emulator.cmdCount = {}
+        desired = [
+                ChannelSettings(chan=1,mode='normal',normalImax=1000,normalIset=100),
+                ChannelSettings(chan=2,strobeImax=500,strobeProfile=((100,10),)),
+                ChannelSettings(chan=3,mode='disable'),
+                ]
+        cmdList = dev.applySettings(desired)
+        self.assertEqual(cmdList,[
+                ('setNormalModeCurrent',(1,100)),
+                ('setMode',(1,'normal')),
+                ('setStrobeModeParams',(2,500,1)),
+                ('setStrobeModeProfile',(2,0,100,10)),
+                ('setStrobeModeProfile',(2,1,0,0)),
+                ('setMode',(3,'disable')),
+                ])
+        self.assertEqual(emulator.channels[0].mode,1)
+        self.assertEqual(emulator.channels[1].strobe,[500,1])
+        self.assertEqual(emulator.cmdCount.get('?MODE'),None)
+        self.assertEqual(dev.applySettings(desired[:2]),[])
+        dev.close()
+
+    def test_diff_settings_leaves_none_unchanged(self):
+        current = ChannelSettings(chan=1,mode='strobe',normalImax=1000,normalIset=0,
+                strobeImax=1000,strobeRepeat=9999,strobeProfile=((100,10),(0,0)),
+                triggerImax=1000,triggerPolarity='rising',triggerProfile=())
+        self.assertEqual(diffSettings(current,ChannelSettings(chan=1)),[])
+        self.assertEqual(diffSettings(current,ChannelSettings(chan=1,strobeRepeat='forever')),[])
+        self.assertEqual(
+                diffSettings(current,ChannelSettings(chan=1,triggerPolarity='FALLING')),
+                [('setTriggerModeParams',(1,1000,'falling'))],
+                )
+
+    def test_apply_settings_grows_profile(self):
+        dev, emulator = openController(cache=True)
+        dev.setStrobeModeProfileArray(1,[1,2,3,4],[10]*4,merge=False)
+        dev.setStrobeModeProfileArray(1,[5],[10],merge=False)
+        dev.applySettings([ChannelSettings(chan=1,strobeProfile=((5,10),(6,10)))])
+        dev.invalidate()
+        self.assertEqual(dev.getStrobeModeProfile(1),[(5,10),(6,10)])
+        dev.close()
+
+    def test_diff_profile(self):
+        name = 'setStrobeModeProfile'
+        self.assertEqual(diffProfile(1,name,[(1,10),(2,10)],[(1,10),(2,10)]),[])
+        self.assertEqual(diffProfile(1,name,[(1,10),(2,10)],[(1,10)]),[(name,(1,1,0,0))])
+        self.assertEqual(
+                diffProfile(1,name,[(1,10)],[(1,10),(2,10)]),
+                [(name,(1,1,2,10)), (name,(1,2,0,0))],
+                )
+        full = [(1,10)]*NUM_PROFILE_STEPS
+        self.assertEqual(diffProfile(1,name,[(1,10)],full)[-1],(name,(1,127,1,10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Tests of the asynchronous controllers and their command futures.
+"""
+import logging
+import threading
+import unittest
+
+import support
+from emulator import SiriusEmulator
+from transport import LoopbackTransport
+from led_controller import ArgumentError
+from async_controller import AsyncLedController, AsyncPwmController, CommandFuture
+
+
+class AsyncLedControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = SiriusEmulator()
+        self.dev = AsyncLedController(LoopbackTransport(self.emulator))
+
+    def tearDown(self):
+        self.dev.close()
+
+    def holdWorker(self):
+        """
+        Keeps the worker busy until the returned event is set so that the
+        commands submitted meanwhile are run together.
+        """
+        event = threading.Event()
+        self.dev.submit(lambda ledController: event.wait())
+        return event
+
+    def test_results(self):
+        self.dev.setNormalModeParams(1,500,100)
+        self.dev.setMode(1,'normal')
+        self.assertEqual(self.dev.getMode(1).result(timeout=2.0),'normal')
+        self.assertEqual(self.dev.getNormalModeParams(1).result(timeout=2.0),(500,100))
+
+    def test_setters_are_batched(self):
+        event = self.holdWorker()
+        futureList = [self.dev.setNormalModeParams(chan,500,chan) for chan in range(1,5)]
+        self.assertFalse(any([f.done() for f in futureList]))
+        event.set()
+        self.assertEqual([f.result(timeout=2.0) for f in futureList],[None]*4)
+        self.assertEqual([c.normal for c in self.emulator.channels],[[500,i] for i in range(1,5)])
+
+    def test_batch_futures_complete_in_order(self):
+        event = self.holdWorker()
+        doneList = []
+        futureList = [
+                self.dev.setMode(1,'normal'),
+                self.dev.setMode(2,'bogus'),
+                self.dev.setNormalModeCurrent(3,5000),
+                self.dev.setNormalModeParams(4,100,50),
+                self.dev.setNormalModeCurrent(4,500),
+                self.dev.setMode(3,'normal'),
+                ]
+        for i, future in enumerate(futureList):
+            future.addDoneCallback(lambda future, i=i: doneList.append(i))
+        event.set()
+        errorList = [type(f.exception(timeout=2.0)) for f in futureList]
+        self.assertEqual(errorList,[type(None),KeyError,ValueError,type(None),ArgumentError,type(None)])
+        self.assertEqual(doneList,range(6))
+        self.assertEqual([c.mode for c in self.emulator.channels],[1,0,1,0])
+
+    def test_failing_callback_keeps_worker(self):
+        def callback(future):
+            raise RuntimeError('callback failed')
+        logger = logging.getLogger('async_controller')
+        logger.disabled = True
+        try:
+            self.dev.getMode(1).addDoneCallback(callback)
+            self.assertEqual(self.dev.getMode(2).result(timeout=2.0),'disable')
+        finally:
+            logger.disabled = False
+
+
+class AsyncPwmControllerTest(unittest.TestCase):
+
+    def test_set_value(self):
+        emulator = SiriusEmulator()
+        dev = AsyncPwmController(LoopbackTransport(emulator))
+        dev.setValue(2,0.25)
+        dev.enable(2).result(timeout=2.0)
+        self.assertEqual(emulator.channels[1].mode,2)
+        self.assertEqual(emulator.channels[1].strobeProfile[:2],[(1000,250),(0,750)])
+        dev.close()
+
+
+class CommandFutureTest(unittest.TestCase):
+
+    def test_callback_after_done(self):
+        future = CommandFuture()
+        future._setResult(3)
+        resultList = []
+        future.addDoneCallback(lambda f: resultList.append(f.result()))
+        self.assertEqual(resultList,[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
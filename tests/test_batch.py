@@ -0,0 +1,48 @@
+"""
+Tests of sending commands in batches.
+"""
+import unittest
+
+from support import openController
+from led_controller import LedControllerError, BatchError, ArgumentError
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dev, self.emulator = openController()
+
+    def tearDown(self):
+        self.dev.close()
+
+    def test_batch_is_sent_on_exit(self):
+        with self.dev.batch():
+            for chan in range(1,5):
+                self.dev.setNormalModeParams(chan,500,chan*10)
+                self.dev.setMode(chan,'normal')
+            self.assertEqual(self.emulator.cmdCount.get('NORMAL'),None)
+        self.assertEqual(self.emulator.cmdCount['NORMAL'],4)
+        for chan in range(1,5):
+            self.assertEqual(self.dev.getNormalModeParams(chan),(500,chan*10))
+            self.assertEqual(self.dev.getMode(chan),'normal')
+
+    def test_batch_error_lists_failed_commands(self):
+        self.dev.setNormalModeParams(1,100,50)
+        with self.assertRaises(BatchError) as context:
+            with self.dev.batch():
+                self.dev.setNormalModeCurrent(1,500)
+                self.dev.setNormalModeParams(2,200,100)
+        errors = context.exception.errors
+        self.assertEqual(len(errors),1)
+        self.assertEqual(errors[0][0],'CURRENT 1 500')
+        self.assertTrue(isinstance(errors[0][1],ArgumentError))
+        self.assertEqual(self.dev.getNormalModeParams(2),(200,100))
+
+    def test_queries_not_allowed_in_batch(self):
+        with self.assertRaises(LedControllerError):
+            with self.dev.batch():
+                self.dev.getDeviceInfo()
+
+
+if __name__ == '__main__':
+    unittest.main()
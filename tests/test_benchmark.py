@@ -0,0 +1,41 @@
+"""
+Smoke test of the benchmarks run against the emulator.
+"""
+import sys
+import unittest
+from StringIO import StringIO
+
+import support
+from emulator import PtyEmulator
+from benchmark import runBenchmarks, printResults
+from timing import PERCENTILES
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_run_benchmarks(self):
+        with PtyEmulator(latency=0.001,pacing=False) as emulator:
+            results = runBenchmarks(emulator.port,repeat=2,slowRepeat=1)
+        self.assertTrue('cmd:?MODE' in results)
+        self.assertTrue('op:setValueAll' in results)
+        for name, stats in results.iteritems():
+            # Only the slow end-to-end operations use slowRepeat
+            slow = name.startswith('op:') and name != 'op:setValueAll'
+            self.assertEqual(stats['count'],1 if slow else 2)
+            for key in ['mean','min','max'] + ['p{0}'.format(p) for p in PERCENTILES]:
+                self.assertTrue(0.0 < stats[key] <= stats['max'],(name,key))
+        for name in ('throughput:sequential','throughput:pipelined'):
+            self.assertTrue(results[name]['commandsPerSecond'] > 0.0)
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            printResults(results)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(len(output.splitlines()),len(results) + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Tests of recording, profiling and replaying command traces.
+"""
+import json
+import unittest
+
+from support import openController, getTempFile
+from emulator import SiriusEmulator
+from transport import LoopbackTransport
+from led_controller import LedController
+from command_trace import readTrace, profileTrace, replayTrace, openTrace
+from daemon import REMOTE_METHODS
+
+
+def recordSession(testCase,suffix='.trace.gz'):
+    """
+    Records a short session with a controller connected to a new emulator
+    and returns the name of the trace file.
+    """
+    filename = getTempFile(testCase,suffix)
+    dev, emulator = openController()
+    recorder = dev.recordTrace(filename)
+    dev.setNormalModeParams(1,500,100)
+    dev.setMode(1,'normal')
+    dev.getMode(1)
+    dev.getStrobeModeProfile(2)
+    with dev.batch():
+        dev.setStrobeModeProfile(2,0,100,10)
+        dev.setStrobeModeProfile(2,1,0,10)
+    recorder.close()
+    dev.getMode(2)
+    dev.close()
+    testCase.assertEqual(recorder.count,6)
+    return filename
+
+
+class TraceTest(unittest.TestCase):
+
+    def test_record_and_read(self):
+        for suffix in ('.trace.gz', '.trace'):
+            header, records = readTrace(recordSession(self,suffix))
+            self.assertEqual(header['echo'],False)
+            self.assertEqual([r.cmd for r in records],[
+                    'NORMAL 1 500 100',
+                    'MODE 1 1',
+                    '?MODE 1',
+                    '?STRP 2',
+                    'STRP 2 0 100 10',
+                    'STRP 2 1 0 10',
+                    ])
+            self.assertEqual(records[2].resp,['#1'])
+            self.assertEqual(records[2].name,'?MODE')
+            self.assertEqual(records[0].bytesWritten,len('NORMAL 1 500 100\r\n'))
+            self.assertFalse(any([r.timedOut for r in records]))
+            startTimes = [r.startTime for r in records]
+            self.assertEqual(startTimes,sorted(startTimes))
+
+    def test_profile(self):
+        metrics = profileTrace(recordSession(self))
+        self.assertEqual(metrics['STRP']['count'],2)
+        self.assertEqual(metrics['MODE']['count'],1)
+        self.assertEqual(metrics['total']['count'],6)
+        self.assertEqual(metrics['total']['timeouts'],0)
+
+    def test_replay_through_emulator(self):
+        filename = recordSession(self)
+        result = replayTrace(filename)
+        self.assertEqual(result.count,6)
+        self.assertEqual(result.mismatches,[])
+        self.assertEqual(result.getMetrics()['total']['count'],6)
+
+        # Replay against a device in a different state
+        emulator = SiriusEmulator()
+        emulator.channels[1].strobeProfile[0] = (5,5)
+        result = replayTrace(filename,target=emulator)
+        self.assertEqual([m[0] for m in result.mismatches],['?STRP 2'])
+
+    def test_replay_through_controller(self):
+        filename = recordSession(self)
+        dev = LedController(LoopbackTransport(SiriusEmulator()))
+        result = replayTrace(filename,target=dev,speed=10.0)
+        self.assertEqual(result.mismatches,[])
+        self.assertEqual(dev.getNormalModeParams(1),(500,100))
+        dev.close()
+
+    def test_unsupported_version(self):
+        filename = getTempFile(self,'.trace')
+        with openTrace(filename,'w') as f:
+            f.write(json.dumps({'version': 0}) + '\n')
+        with self.assertRaises(ValueError):
+            readTrace(filename)
+
+    def test_record_trace_is_local(self):
+        self.assertFalse('recordTrace' in REMOTE_METHODS)
+
+
+if __name__ == '__main__':
+    unittest.main()
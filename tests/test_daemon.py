@@ -0,0 +1,149 @@
+"""
+Tests of the device daemon and its clients.
+"""
+import os
+import json
+import socket
+import threading
+import unittest
+
+from support import getTempFile
+from emulator import SiriusEmulator
+from transport import LoopbackTransport
+from led_controller import LedControllerError, BatchError, ArgumentError
+from daemon import DeviceServer, LedClient
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = SiriusEmulator()
+        self.socketPath = getTempFile(self,suffix='.sock')
+        self.server = DeviceServer(LoopbackTransport(self.emulator),socketPath=self.socketPath).start()
+        self.client = LedClient(socketPath=self.socketPath,timeout=5.0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_batch_error_from_call(self):
+        with self.assertRaises(BatchError) as context:
+            with self.client.batch():
+                self.client.setMode(1,'normal')
+                self.client.setMode(2,'bogus')
+                self.client.setMode(3,'normal')
+        errors = context.exception.errors
+        self.assertEqual(len(errors),1)
+        self.assertEqual(errors[0][0],'setMode')
+        self.assertTrue(isinstance(errors[0][1],KeyError))
+        self.assertEqual(self.client.getMode(3),'normal')
+
+    def test_error_reply_from_call(self):
+        self.client.setNormalModeParams(1,100,50)
+        with self.assertRaises(ArgumentError) as context:
+            self.client.setNormalModeCurrent(1,500)
+        self.assertEqual(context.exception.cmd,'CURRENT 1 500')
+        self.assertEqual(context.exception.reply,'#?')
+        self.assertEqual(str(context.exception),'CURRENT 1 500 replied #?')
+
+    def test_malformed_requests(self):
+        sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        sock.connect(self.socketPath)
+        sock.settimeout(5.0)
+        f = sock.makefile('rb')
+        lineList = [
+                'not json',
+                '[1, 2]',
+                json.dumps({'id': 1}),
+                json.dumps({'id': 2, 'method': 'bogus'}),
+                json.dumps({'id': 3, 'method': 'getMode', 'args': 5}),
+                json.dumps({'id': 4, 'method': 'getMode', 'args': [1], 'kwargs': [1]}),
+                json.dumps({'id': 5, 'method': 'getMode', 'args': [{'__type__': 'ChannelSettings'}]}),
+                json.dumps({'id': 6, 'method': 'getMode', 'args': [1, 2, 3]}),
+                json.dumps({'id': 7, 'method': 'getMode', 'args': [1]}),
+                ]
+        sock.sendall(''.join([line + '\n' for line in lineList]))
+        respList = [json.loads(f.readline()) for line in lineList]
+        f.close()
+        sock.close()
+        self.assertEqual([r['id'] for r in respList],[None,None,1,2,3,4,5,6,7])
+        for resp in respList[:-1]:
+            self.assertTrue(resp['error']['message'])
+        self.assertEqual(respList[5]['error']['type'],'LedControllerError')
+        self.assertEqual(respList[7]['error']['type'],'TypeError')
+        self.assertEqual(respList[8]['result'],'disable')
+        self.assertEqual(self.client.getMode(1),'disable')
+
+    def test_bad_args_from_client(self):
+        with self.assertRaises(TypeError):
+            self.client.getMode(1,2)
+        self.assertEqual(self.client.getMode(1),'disable')
+
+    def test_concurrent_clients(self):
+        errors = []
+        def run(chan):
+            try:
+                client = LedClient(socketPath=self.socketPath,timeout=5.0)
+                for i in range(20):
+                    client.setNormalModeParams(chan,1000,10*chan + i)
+                    self.assertEqual(client.getNormalModeParams(chan),(1000,10*chan + i))
+                    with client.batch():
+                        client.setStrobeModeProfile(chan,0,i,10)
+                        client.setMode(chan,'strobe')
+                    self.assertEqual(client.getStrobeModeProfile(chan),[(i,10)])
+                client.close()
+            except Exception, e:
+                errors.append(e)
+        threadList = [threading.Thread(target=run,args=(chan,)) for chan in range(1,5)]
+        for thread in threadList:
+            thread.start()
+        for thread in threadList:
+            thread.join()
+        self.assertEqual(errors,[])
+        for chan in range(1,5):
+            channel = self.emulator.channels[chan-1]
+            self.assertEqual(channel.normal,[1000,10*chan + 19])
+            self.assertEqual(channel.strobeProfile[0],(19,10))
+            self.assertEqual(channel.mode,2)
+
+
+class SocketPathTest(unittest.TestCase):
+
+    def setUp(self):
+        self.socketPath = getTempFile(self,suffix='.sock')
+
+    def startServer(self):
+        return DeviceServer(LoopbackTransport(SiriusEmulator()),socketPath=self.socketPath).start()
+
+    def test_file_is_not_removed(self):
+        with open(self.socketPath,'w') as f:
+            f.write('data')
+        with self.assertRaises(LedControllerError):
+            self.startServer()
+        with open(self.socketPath) as f:
+            self.assertEqual(f.read(),'data')
+
+    def test_running_server_is_not_replaced(self):
+        server = self.startServer()
+        with self.assertRaises(LedControllerError):
+            self.startServer()
+        client = LedClient(socketPath=self.socketPath,timeout=5.0)
+        self.assertEqual(client.getMode(1),'disable')
+        client.close()
+        server.close()
+        self.assertFalse(os.path.exists(self.socketPath))
+
+    def test_stale_socket_is_replaced(self):
+        sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        sock.bind(self.socketPath)
+        sock.close()
+        self.assertTrue(os.path.exists(self.socketPath))
+        server = self.startServer()
+        client = LedClient(socketPath=self.socketPath,timeout=5.0)
+        self.assertEqual(client.getMode(1),'disable')
+        client.close()
+        server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
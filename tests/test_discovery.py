@@ -0,0 +1,63 @@
+"""
+Tests of controller discovery and its port cache.
+"""
+import unittest
+
+from support import getTempFile
+from emulator import PtyEmulator, SiriusEmulator
+import discovery
+
+DEVICE_INFO = 'Mightex LED Driver:3.30 Device Module No.:SLC-SA04-U Device Serial No.:04-000000-00{0}'
+
+
+class DiscoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulatorList = []
+        for i in range(3):
+            emulator = PtyEmulator(SiriusEmulator(deviceInfo=DEVICE_INFO.format(i)),latency=0.002)
+            self.addCleanup(emulator.close)
+            self.emulatorList.append(emulator)
+        self.ports = [e.port for e in self.emulatorList]
+        self.usbIds = dict([(p,'USB VID:PID=0403:6001 SER=A{0}'.format(i)) for i,p in enumerate(self.ports)])
+        self.probed = []
+        self.cacheFile = getTempFile(self)
+        getUsbIds, probePort = discovery.getUsbIds, discovery.probePort
+        def restore():
+            discovery.getUsbIds, discovery.probePort = getUsbIds, probePort
+        self.addCleanup(restore)
+        def countingProbe(port,**kwargs):
+            self.probed.append(port)
+            return probePort(port,**kwargs)
+        discovery.getUsbIds = lambda: self.usbIds
+        discovery.probePort = countingProbe
+
+    def test_discover(self):
+        devices = discovery.discover(self.ports + ['/dev/pyMightLED-missing'],cacheFile=None)
+        self.assertEqual(sorted(devices.keys()),sorted(self.ports))
+        for i, port in enumerate(self.ports):
+            self.assertEqual(devices[port].serial,'04-000000-00{0}'.format(i))
+            self.assertEqual(devices[port].firmware,'3.30')
+        self.assertEqual(discovery.findPort('04-000000-001',cacheFile=None),self.ports[1])
+
+    def test_found_ports_are_cached(self):
+        discovery.discover(cacheFile=self.cacheFile)
+        self.probed = []
+        devices = discovery.discover(cacheFile=self.cacheFile)
+        self.assertEqual(self.probed,[])
+        self.assertEqual(sorted(devices.keys()),sorted(self.ports))
+        self.usbIds[self.ports[0]] = 'USB VID:PID=0403:6001 SER=B0'
+        discovery.discover(cacheFile=self.cacheFile)
+        self.assertEqual(self.probed,[self.ports[0]])
+
+    def test_absent_ports_are_probed_again(self):
+        self.emulatorList[0].close()
+        devices = discovery.discover(cacheFile=self.cacheFile)
+        self.assertFalse(self.ports[0] in devices)
+        self.probed = []
+        discovery.discover(cacheFile=self.cacheFile)
+        self.assertEqual(self.probed,[self.ports[0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
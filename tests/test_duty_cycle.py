@@ -0,0 +1,83 @@
+"""
+Tests of the duty cycle tables and intensity curves used by the
+PwmController.
+"""
+import unittest
+
+import support
+import duty_cycle
+from duty_cycle import DutyCycleTable, GammaCurve, CalibrationCurve
+from emulator import SiriusEmulator
+from transport import LoopbackTransport
+from pwm_controller import PwmController
+
+
+class DutyCycleTableTest(unittest.TestCase):
+
+    def test_lookup(self):
+        table = DutyCycleTable(1000)
+        self.assertEqual(table.lookup(0.0),(0,1000))
+        self.assertEqual(table.lookup(0.25),(250,750))
+        self.assertEqual(table.lookup(1.0),(1000,0))
+        self.assertEqual(table.lookup(-1.0),(0,1000))
+        self.assertEqual(table.lookup(2.0),(1000,0))
+
+    def test_curves(self):
+        table = DutyCycleTable(1000,curve=GammaCurve(2.0))
+        self.assertEqual(table.lookup(0.5),(250,750))
+        table = DutyCycleTable(1000,curve=CalibrationCurve([0.0,0.5,1.0],[0.0,0.1,1.0]))
+        self.assertEqual(table.lookup(0.5),(100,900))
+        self.assertEqual(table.lookup(0.75),(550,450))
+
+    def checkQuantize(self,table):
+        values = [i/4000.0 for i in range(4001)]
+        timeHigh, timeLow = table.quantize(values)
+        for value, high, low in zip(values,timeHigh,timeLow):
+            self.assertEqual(table.lookup(value),(high,low))
+
+    def test_quantize_matches_lookup(self):
+        table = DutyCycleTable(1000)
+        self.assertEqual(table.lookup(0.0025),(3,997))
+        self.checkQuantize(table)
+        self.checkQuantize(DutyCycleTable(100,curve=GammaCurve(2.2)))
+
+    def test_low_frequency_is_exact(self):
+        for freq in (10,50):
+            table = DutyCycleTable(freq)
+            self.assertEqual(table.levels,None)
+            period = table.period
+            for value in (0.0001, 0.123457, 0.5, 0.99999):
+                timeHigh = duty_cycle.roundHalfUp(value*period)
+                self.assertEqual(table.lookup(value),(timeHigh,period - timeHigh))
+            self.checkQuantize(table)
+        table = DutyCycleTable(10,curve=GammaCurve(2.0))
+        self.assertEqual(table.lookup(0.01),(10,99990))
+        self.checkQuantize(table)
+        self.checkQuantize(DutyCycleTable(10,curve=CalibrationCurve([0.0,0.5,1.0],[0.0,0.1,1.0])))
+
+    def test_quantize_without_numpy(self):
+        numpy = duty_cycle.numpy
+        duty_cycle.numpy = None
+        try:
+            table = DutyCycleTable(1000)
+            self.assertEqual(table.quantize([0.0025,0.5]),([3,500],[997,500]))
+            self.checkQuantize(table)
+            self.checkQuantize(DutyCycleTable(50,curve=GammaCurve(2.0)))
+        finally:
+            duty_cycle.numpy = numpy
+
+
+class PwmControllerTest(unittest.TestCase):
+
+    def test_set_value_and_set_value_all_agree(self):
+        emulator = SiriusEmulator()
+        dev = PwmController(LoopbackTransport(emulator),freq=1000)
+        dev.setValue(1,0.0025)
+        dev.setValueAll([0.0025]*4)
+        profiles = [channel.strobeProfile[:2] for channel in emulator.channels]
+        self.assertEqual(profiles,[[(1000,3),(0,997)]]*4)
+        dev.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Tests of the emulated Sirius controller.
+"""
+import unittest
+
+import support
+from emulator import SiriusEmulator, PtyEmulator
+from led_controller import LedController
+
+
+class SiriusEmulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = SiriusEmulator()
+        self.emulator.process('ECHOOFF')
+
+    def test_echo(self):
+        emulator = SiriusEmulator()
+        self.assertEqual(emulator.process('MODE 1 1'),'MODE 1 1\n\r##\n\r')
+        self.assertEqual(emulator.process('ECHOOFF'),'ECHOOFF\n\r##\n\r')
+        self.assertEqual(emulator.process('MODE 1 0'),'##\n\r')
+
+    def test_setters_and_queries(self):
+        self.assertEqual(self.emulator.process('NORMAL 2 500 100'),'##\n\r')
+        self.assertEqual(self.emulator.process('?CURRENT 2'),'#1000 500 100\n\r')
+        self.assertEqual(self.emulator.process('STRP 2 0 100 50'),'##\n\r')
+        self.assertEqual(self.emulator.process('?STRP 2'),'#100 50\n\r0 0\n\r')
+        self.assertEqual(self.emulator.cmdCount['NORMAL'],1)
+
+    def test_error_replies(self):
+        self.assertEqual(self.emulator.process('BOGUS 1'),'#!\n\r')
+        self.assertEqual(self.emulator.process('MODE 5 1'),'#?\n\r')
+        self.assertEqual(self.emulator.process('CURRENT 1 5000'),'#?\n\r')
+        self.assertEqual(self.emulator.process('MODE 1'),'#?\n\r')
+
+    def test_reset_restores_stored_settings(self):
+        self.emulator.process('MODE 1 1')
+        self.emulator.process('STORE')
+        self.emulator.process('MODE 1 2')
+        self.emulator.process('Reset')
+        self.assertEqual(self.emulator.channels[0].mode,1)
+        self.assertTrue(self.emulator.echo)
+
+
+class PtyEmulatorTest(unittest.TestCase):
+
+    def test_controller_on_pty(self):
+        with PtyEmulator(latency=0.002) as emulator:
+            dev = LedController(emulator.port)
+            dev.setNormalModeParams(1,500,100)
+            dev.setMode(1,'normal')
+            self.assertEqual(dev.getNormalModeParams(1),(500,100))
+            self.assertEqual(dev.getMode(1),'normal')
+            self.assertTrue('Mightex' in dev.getDeviceInfo())
+            dev.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Tests of the ControllerFleet run against SiriusEmulators through
+LoopbackTransports.
+"""
+import time
+import unittest
+
+import support
+from emulator import SiriusEmulator, DEVICE_INFO
+from transport import LoopbackTransport
+from fleet import ControllerFleet, FleetError
+
+
+class DeviceInfoEmulator(SiriusEmulator):
+    """
+    Emulator with the given serial number which takes delay seconds to
+    answer DEVICEINFO.
+    """
+
+    def __init__(self,serial,delay=0.0):
+        deviceInfo = DEVICE_INFO.replace('04-000000-001',serial)
+        super(DeviceInfoEmulator,self).__init__(deviceInfo=deviceInfo)
+        self.delay = delay
+
+    def process(self,line):
+        if line.strip() == 'DEVICEINFO':
+            time.sleep(self.delay)
+        return super(DeviceInfoEmulator,self).process(line)
+
+
+def openTransports(serialList,delay=0.0):
+    return [LoopbackTransport(DeviceInfoEmulator(s,delay)) for s in serialList]
+
+
+class ControllerFleetTest(unittest.TestCase):
+
+    def test_key_by_port(self):
+        transports = openTransports(['A','B'])
+        with ControllerFleet(transports) as fleet:
+            self.assertEqual(sorted(fleet.devices.keys()),sorted(transports))
+            self.assertEqual(fleet.ports[transports[0]],transports[0])
+
+    def test_key_by_serial(self):
+        transports = openTransports(['04-000000-002','04-000000-001'])
+        with ControllerFleet(transports,keyBy='serial') as fleet:
+            self.assertEqual(fleet.keys(),['04-000000-001','04-000000-002'])
+            self.assertTrue(fleet.ports['04-000000-002'] is transports[0])
+
+    def test_serial_numbers_read_in_parallel(self):
+        transports = openTransports(['1','2','3','4'],delay=0.2)
+        t0 = time.time()
+        fleet = ControllerFleet(transports,keyBy='serial')
+        dt = time.time() - t0
+        self.assertEqual(fleet.keys(),['1','2','3','4'])
+        self.assertTrue(dt < 0.6)
+        fleet.close()
+
+    def test_duplicate_serial(self):
+        transports = openTransports(['A','B','A'])
+        with self.assertRaises(FleetError) as context:
+            ControllerFleet(transports,keyBy='serial')
+        self.assertEqual(len(context.exception.errors),1)
+        self.assertTrue('serial number A' in str(context.exception))
+        for transport in transports:
+            self.assertFalse(transport.isOpen())
+
+    def test_fan_out(self):
+        emulators = [DeviceInfoEmulator(s) for s in ('A','B')]
+        transports = [LoopbackTransport(e) for e in emulators]
+        with ControllerFleet(transports,keyBy='serial') as fleet:
+            fleet.setModeAll('normal').raiseErrors()
+            self.assertEqual([e.cmdCount['MODE'] for e in emulators],[4,4])
+            result = fleet.callEach('setNormalModeParams',{'A': (1,500,100), 'B': (1,500,200)})
+            self.assertTrue(result.ok())
+            snapshots = fleet.getSnapshot().results
+            self.assertEqual(snapshots['A'].channels[0].normalIset,100)
+            self.assertEqual(snapshots['B'].channels[0].normalIset,200)
+            self.assertEqual(snapshots['B'].channels[3].mode,'normal')
+
+    def test_errors(self):
+        with ControllerFleet(openTransports(['A','B']),keyBy='serial') as fleet:
+            result = fleet.callEach('setNormalModeParams',{'A': (1,500,100), 'B': (1,500,5000)})
+            self.assertFalse(result.ok())
+            self.assertTrue(isinstance(result.errors['B'],ValueError))
+            self.assertEqual(result['A'],None)
+            with self.assertRaises(ValueError):
+                result['B']
+            with self.assertRaises(FleetError) as context:
+                result.raiseErrors()
+            self.assertEqual(context.exception.errors.keys(),['B'])
+
+
+if __name__ == '__main__':
+    unittest.main()
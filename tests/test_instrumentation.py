@@ -0,0 +1,91 @@
+"""
+Tests of the command instrumentation hooks, counters and latency
+histograms.
+"""
+import unittest
+
+from support import openController, FaultyEmulator
+from instrumentation import Instrumentation, CommandRecord, LATENCY_BIN_EDGES
+from led_controller import ResponseTimeout
+
+
+def makeRecord(name,latency,timedOut=False):
+    return CommandRecord(
+            name=name,
+            cmd='{0} 1'.format(name),
+            startTime=0.0,
+            latency=latency,
+            bytesWritten=10,
+            bytesRead=5,
+            timedOut=timedOut,
+            resp=[],
+            )
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def test_metrics(self):
+        instrumentation = Instrumentation()
+        instrumentation.onCommandDone(makeRecord('MODE',0.0015))
+        instrumentation.onCommandDone(makeRecord('MODE',0.03))
+        instrumentation.onCommandDone(makeRecord('?MODE',10.0,timedOut=True))
+        metrics = instrumentation.getMetrics()
+        mode = metrics['MODE']
+        self.assertEqual(mode['count'],2)
+        self.assertEqual(mode['bytesWritten'],20)
+        self.assertAlmostEqual(mode['meanLatency'],0.01575)
+        self.assertEqual(mode['minLatency'],0.0015)
+        self.assertEqual(mode['maxLatency'],0.03)
+        counts = mode['histogram']['counts']
+        self.assertEqual(len(counts),len(LATENCY_BIN_EDGES) + 1)
+        self.assertEqual(counts[1],1)
+        self.assertEqual(counts[5],1)
+        total = metrics['total']
+        self.assertEqual(total['count'],3)
+        self.assertEqual(total['timeouts'],1)
+        self.assertEqual(total['maxLatency'],10.0)
+        self.assertEqual(total['histogram']['counts'][-1],1)
+        instrumentation.reset()
+        self.assertEqual(instrumentation.getMetrics()['total']['count'],0)
+
+    def test_hooks(self):
+        dev, emulator = openController()
+        instrumentation = dev.instrument()
+        self.assertTrue(dev.instrument() is instrumentation)
+        started = []
+        done = []
+        instrumentation.addPreHook(started.append)
+        instrumentation.addPostHook(done.append)
+        dev.setMode(1,'normal')
+        with dev.batch():
+            dev.setNormalModeCurrent(1,10)
+            dev.setNormalModeCurrent(2,20)
+        self.assertEqual(started,['MODE 1 1','CURRENT 1 10','CURRENT 2 20'])
+        self.assertEqual([r.cmd for r in done],started)
+        self.assertEqual(done[0].name,'MODE')
+        self.assertEqual(done[0].resp,['##'])
+        self.assertEqual(done[0].bytesWritten,len('MODE 1 1\r\n'))
+        self.assertTrue(done[0].bytesRead > 0)
+        self.assertEqual(instrumentation.getMetrics()['CURRENT']['count'],2)
+
+        instrumentation.removePreHook(started.append)
+        instrumentation.removePostHook(done.append)
+        dev.setMode(1,'disable')
+        self.assertEqual(len(started),3)
+        dev.instrumentation = None
+        dev.setMode(1,'normal')
+        self.assertEqual(instrumentation.getMetrics()['MODE']['count'],2)
+        dev.close()
+
+    def test_timeouts_counted(self):
+        dev, emulator = openController(FaultyEmulator('?MODE',drops=1))
+        instrumentation = dev.instrument(Instrumentation())
+        with self.assertRaises(ResponseTimeout):
+            dev.getMode(1)
+        metrics = instrumentation.getMetrics()
+        self.assertEqual(metrics['?MODE']['timeouts'],1)
+        dev.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+Tests of the latency model and the per command soft and hard deadlines
+derived from it.
+"""
+import time
+import unittest
+
+from support import SlowEmulator, FaultyEmulator, getTempFile
+from emulator import PtyEmulator
+from latency_model import LatencyModel, MIN_TIMEOUT
+from led_controller import LedController, ResponseTimeout
+
+
+class LatencyModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model = LatencyModel(0.5,minTimeouts={'STORE': 2.0},minSamples=5)
+
+    def test_max_timeout_until_learned(self):
+        for i in range(4):
+            self.model.update('MODE',0.01)
+        self.assertEqual(self.model.getTimeout('MODE'),0.5)
+        self.model.update('MODE',0.01)
+        self.assertAlmostEqual(self.model.getTimeout('MODE'),MIN_TIMEOUT)
+        self.assertEqual(self.model.getTimeout('?MODE'),0.5)
+
+    def test_timeout_follows_latency(self):
+        for i in range(20):
+            self.model.update('?STRP',0.1)
+        self.assertAlmostEqual(self.model.getTimeout('?STRP'),0.2)
+        for i in range(20):
+            self.model.update('?STRP',1.0)
+        self.assertEqual(self.model.getTimeout('?STRP'),0.5)
+
+    def test_min_timeouts(self):
+        for i in range(20):
+            self.model.update('STORE',0.01)
+        self.assertEqual(self.model.getTimeout('STORE'),2.0)
+
+    def test_set_max_timeout(self):
+        for i in range(20):
+            self.model.update('?STRP',0.4)
+        self.assertEqual(self.model.getTimeout('?STRP'),0.5)
+        self.model.maxTimeout = 2.0
+        self.assertAlmostEqual(self.model.getTimeout('?STRP'),0.8)
+
+    def test_deadline(self):
+        self.assertEqual(self.model.getDeadline('MODE'),0.5)
+        for i in range(20):
+            self.model.update('MODE',0.01)
+            self.model.update('?STRP',0.4)
+            self.model.update('STORE',0.01)
+        self.assertAlmostEqual(self.model.getDeadline('MODE'),MIN_TIMEOUT + 0.05)
+        self.assertEqual(self.model.getDeadline('?STRP'),0.5)
+        self.assertEqual(self.model.getDeadline('STORE'),2.0)
+
+    def test_save_and_load(self):
+        for i in range(20):
+            self.model.update('MODE',0.03)
+        filename = getTempFile(self)
+        self.model.save(filename)
+        model = LatencyModel.load(filename)
+        self.assertEqual(model.getTimeouts(),self.model.getTimeouts())
+        self.assertEqual(model.minTimeouts,self.model.minTimeouts)
+
+
+class ControllerTimeoutTest(unittest.TestCase):
+
+    def test_learned_timeouts(self):
+        with PtyEmulator(latency=0.002) as emulator:
+            dev = LedController(emulator.port,timeout=0.5)
+            for i in range(10):
+                dev.getMode(1)
+            self.assertTrue(dev.latencyModel.getTimeout('?MODE') < 0.5)
+            dev.close()
+
+    def test_late_response_within_deadline(self):
+        with PtyEmulator(SlowEmulator('?MODE',count=0),latency=0.002) as emulator:
+            dev = LedController(emulator.port,timeout=0.5)
+            for i in range(10):
+                dev.getMode(1)
+            learned = dev.latencyModel.getTimeout('?MODE')
+            self.assertTrue(learned < dev.latencyModel.getDeadline('?MODE') < 0.5)
+            # The response arrives after the soft deadline but before the
+            # hard deadline
+            emulator.emulator.delay = learned + dev.latencyModel.deadlineMargin/2
+            emulator.emulator.count = 1
+            self.assertEqual(dev.getMode(1),'disable')
+            self.assertTrue(dev.lastLatency > learned)
+            self.assertEqual(dev.getMode(1),'disable')
+            dev.close()
+
+    def test_lost_response_fails_before_timeout(self):
+        with PtyEmulator(FaultyEmulator('?MODE'),latency=0.002) as emulator:
+            dev = LedController(emulator.port,timeout=1.0)
+            for i in range(10):
+                dev.getMode(1)
+            emulator.emulator.drops = 1
+            t0 = time.time()
+            with self.assertRaises(ResponseTimeout):
+                dev.getMode(1)
+            self.assertTrue(time.time() - t0 < 0.3)
+            self.assertEqual(dev.getMode(1),'disable')
+            dev.close()
+
+    def test_set_timeout(self):
+        with PtyEmulator(SlowEmulator('?MODE',0.3,count=0)) as emulator:
+            dev = LedController(emulator.port,timeout=0.1)
+            dev.timeout = 1.0
+            emulator.emulator.count = 1
+            self.assertEqual(dev.getMode(1),'disable')
+            self.assertEqual(dev.latencyModel.maxTimeout,1.0)
+            dev.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""
+Tests of the SequencePlayer and the monotonic clock it is scheduled
+against.
+"""
+import time
+import unittest
+
+from support import openController
+from playback import SequencePlayer, currentUpdate, fromArrays
+from timing import getTime, getStats
+
+
+class RecordingUpdate(object):
+    """
+    Update function which records the clock time and value of each update
+    and takes delay seconds to complete.
+    """
+
+    def __init__(self,delay=0.0):
+        self.delay = delay
+        self.updates = []
+
+    def __call__(self,value):
+        self.updates.append((getTime(),value))
+        if self.delay:
+            time.sleep(self.delay)
+
+
+class SequencePlayerTest(unittest.TestCase):
+
+    def test_frames_played_on_time(self):
+        update = RecordingUpdate()
+        times = [0.02*i for i in range(10)]
+        player = SequencePlayer(update,fromArrays(times,range(10)))
+        t0 = getTime()
+        player.start()
+        player.join(2.0)
+        self.assertFalse(player.isRunning())
+        self.assertEqual([v for t, v in update.updates],range(10))
+        for (t, value), frameTime in zip(update.updates,times):
+            self.assertTrue(t - t0 > frameTime - 0.005)
+            self.assertTrue(t - t0 < frameTime + 0.05)
+        statsDict = player.stats.toDict()
+        self.assertEqual(statsDict['requestedFrames'],10)
+        self.assertEqual(statsDict['sentFrames'],10)
+        self.assertEqual(statsDict['droppedFrames'],0)
+        self.assertEqual(statsDict['lateness']['count'],10)
+
+    def test_superseded_frames_dropped(self):
+        update = RecordingUpdate(delay=0.05)
+        frames = ((0.01*i,i) for i in range(30))
+        player = SequencePlayer(update,frames)
+        player.start()
+        player.join(5.0)
+        stats = player.stats
+        self.assertTrue(stats.droppedFrames > 0)
+        self.assertEqual(stats.requestedFrames,30)
+        self.assertEqual(stats.sentFrames + stats.droppedFrames,30)
+        values = [v for t, v in update.updates]
+        self.assertEqual(values,sorted(values))
+        self.assertEqual(values[-1],29)
+
+    def test_latency_compensation(self):
+        update = RecordingUpdate(delay=0.02)
+        times = [0.05*i for i in range(6)]
+        player = SequencePlayer(update,fromArrays(times,range(6)))
+        t0 = getTime()
+        player.start()
+        player.join(2.0)
+        self.assertTrue(abs(player.latency - 0.02) < 0.01)
+        # Later updates are sent early by the measured latency
+        t, value = update.updates[-1]
+        self.assertTrue(t - t0 < times[-1] - 0.01)
+
+    def test_stop(self):
+        update = RecordingUpdate()
+        player = SequencePlayer(update,((0.1*i,i) for i in range(100)))
+        player.start()
+        time.sleep(0.15)
+        player.stop()
+        self.assertFalse(player.isRunning())
+        self.assertTrue(len(update.updates) < 5)
+
+    def test_error_stops_playback(self):
+        def update(value):
+            if value == 2:
+                raise ValueError, 'bad value'
+        player = SequencePlayer(update,fromArrays([0.0,0.01,0.02,0.03],range(4)))
+        player.start()
+        player.join(2.0)
+        self.assertTrue(isinstance(player.error,ValueError))
+        self.assertEqual(player.stats.sentFrames,2)
+
+    def test_current_update(self):
+        dev, emulator = openController()
+        player = SequencePlayer(currentUpdate(dev,1),fromArrays([0.0,0.01,0.02],[10.0,20.0,30.0]))
+        player.start()
+        player.join(2.0)
+        self.assertEqual(player.error,None)
+        self.assertEqual(emulator.channels[0].normal[1],30)
+        self.assertEqual(emulator.cmdCount['CURRENT'],3)
+        dev.close()
+
+
+class TimingTest(unittest.TestCase):
+
+    def test_monotonic_clock(self):
+        t0 = getTime()
+        time.sleep(0.01)
+        dt = getTime() - t0
+        self.assertTrue(0.005 < dt < 0.5)
+
+    def test_stats(self):
+        stats = getStats([0.4,0.1,0.3,0.2])
+        self.assertEqual(stats['count'],4)
+        self.assertEqual(stats['min'],0.1)
+        self.assertEqual(stats['max'],0.4)
+        self.assertAlmostEqual(stats['mean'],0.25)
+        self.assertAlmostEqual(stats['p50'],0.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
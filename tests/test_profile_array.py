@@ -0,0 +1,43 @@
+"""
+Tests of setting whole strobe and trigger mode profiles from arrays.
+"""
+import unittest
+
+from support import openController
+
+
+class ProfileTest(unittest.TestCase):
+
+    def checkProfileSequence(self,cache):
+        dev, emulator = openController(cache=cache)
+        for iset in ([1,2,3,4], [5], [5,6,7], [8,9], [8]):
+            dev.setStrobeModeProfileArray(1,iset,[10]*len(iset),merge=False)
+            dev.invalidate()
+            self.assertEqual(dev.getStrobeModeProfile(1),[(i,10) for i in iset])
+        dev.close()
+
+    def test_profile_array_without_cache(self):
+        self.checkProfileSequence(False)
+
+    def test_profile_array_with_cache(self):
+        self.checkProfileSequence(True)
+
+    def test_only_changed_steps_sent(self):
+        dev, emulator = openController(cache=True)
+        self.assertEqual(dev.setStrobeModeProfileArray(1,[1,2,3],[10,10,10]),4)
+        self.assertEqual(dev.setStrobeModeProfileArray(1,[1,5,3],[10,10,10]),1)
+        self.assertEqual(dev.setStrobeModeProfileArray(1,[1,5,3],[10,10,10]),0)
+        self.assertEqual(emulator.channels[0].strobeProfile[:4],[(1,10),(5,10),(3,10),(0,0)])
+        dev.close()
+
+    def test_merge(self):
+        dev, emulator = openController()
+        dev.setTriggerModeProfileArray(2,[4,4,0,7,7,7],[10,20,5,1,1,1])
+        self.assertEqual(dev.getTriggerModeProfile(2),[(4,30),(0,5),(7,3)])
+        dev.setTriggerModeProfileArray(2,[4,4],[10,20],merge=False)
+        self.assertEqual(dev.getTriggerModeProfile(2),[(4,10),(4,20)])
+        dev.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
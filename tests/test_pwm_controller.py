@@ -0,0 +1,88 @@
+"""
+Tests of the commands sent by the PwmController.
+"""
+import unittest
+
+from support import RecordingEmulator
+from transport import LoopbackTransport
+from pwm_controller import PwmController
+
+
+class PwmDisableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = RecordingEmulator()
+        self.dev = PwmController(LoopbackTransport(self.emulator))
+        del self.emulator.lines[:]
+
+    def tearDown(self):
+        self.dev.close()
+
+    def test_disable_is_never_skipped(self):
+        self.dev.setValue(1,0)
+        self.dev.setValue(1,0)
+        self.assertEqual(self.emulator.lines,['MODE 1 0','MODE 1 0'])
+
+    def test_disable_channel_enabled_by_other_means(self):
+        self.dev.setValue(2,0.5)
+        self.emulator.channels[1].mode = 2
+        self.dev.setValue(2,0)
+        self.assertEqual(self.emulator.channels[1].mode,0)
+
+
+class PwmIncrementalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = RecordingEmulator()
+        self.dev = PwmController(LoopbackTransport(self.emulator),freq=1000)
+        self.dev.enableAll()
+        self.dev.setValueAll([0.5]*4)
+        del self.emulator.lines[:]
+
+    def tearDown(self):
+        self.dev.close()
+
+    def test_repeated_value_sends_nothing(self):
+        self.dev.setValue(1,0.5)
+        self.dev.setValueAll([0.5]*4)
+        self.assertEqual(self.emulator.lines,[])
+
+    def test_single_channel_change(self):
+        self.dev.setValue(3,0.25)
+        self.assertEqual(self.emulator.lines,['STRP 3 0 1000 250','STRP 3 1 0 750','MODE 3 2'])
+        del self.emulator.lines[:]
+        self.dev.setValueAll([0.5,0.5,0.25,0.75])
+        self.assertEqual(self.emulator.lines,['STRP 4 0 1000 750','STRP 4 1 0 250','MODE 4 2'])
+
+    def test_only_changed_step_sent(self):
+        self.dev.iset = [500,1000,1000,1000]
+        self.dev.setValue(1,0.5)
+        self.assertEqual(self.emulator.lines,['STRP 1 0 500 500','MODE 1 2'])
+
+    def setValueAllRecorded(self,valueList):
+        done = []
+        self.dev.ledController.instrument().addPostHook(done.append)
+        self.dev.setValueAll(valueList)
+        return done
+
+    def test_set_value_all_is_one_write(self):
+        # Without a scheduler to split it into windows
+        self.dev.ledController.scheduler = None
+        done = self.setValueAllRecorded([0.1,0.2,0.3,0.4])
+        self.assertEqual(self.emulator.lines,[
+                'STRP 1 0 1000 100', 'STRP 1 1 0 900', 'MODE 1 2',
+                'STRP 2 0 1000 200', 'STRP 2 1 0 800', 'MODE 2 2',
+                'STRP 3 0 1000 300', 'STRP 3 1 0 700', 'MODE 3 2',
+                'STRP 4 0 1000 400', 'STRP 4 1 0 600', 'MODE 4 2',
+                ])
+        self.assertEqual([r.cmd for r in done],self.emulator.lines)
+        self.assertEqual(len(set([r.startTime for r in done])),1)
+
+    def test_set_value_all_is_pipelined(self):
+        done = self.setValueAllRecorded([0.1,0.2,0.3,0.4])
+        self.assertEqual(len(done),12)
+        self.assertTrue(len(set([r.startTime for r in done])) < len(done))
+
+
+if __name__ == '__main__':
+    unittest.main()
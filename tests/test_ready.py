@@ -0,0 +1,80 @@
+"""
+Tests of readiness polling after reset and store.
+"""
+import time
+import unittest
+
+from support import openController, FaultyEmulator
+from emulator import SiriusEmulator, PtyEmulator
+from led_controller import LedController, ResponseTimeout, RESET_SLEEP_DT, STORE_TIMEOUT
+
+
+class ReadyTest(unittest.TestCase):
+
+    def test_reset_with_sleep(self):
+        with PtyEmulator(SiriusEmulator(resetTime=0.3)) as emulator:
+            dev = LedController(emulator.port,cache=True)
+            dev.setNormalModeParams(1,500,100)
+            dev.store()
+            dev.setNormalModeParams(1,500,200)
+            self.assertEqual(dev.getNormalModeParams(1),(500,200))
+            t0 = time.time()
+            dev.reset(sleep=True)
+            dt = time.time() - t0
+            self.assertTrue(0.3 <= dt < RESET_SLEEP_DT/2)
+            self.assertFalse(dev.dirty)
+            self.assertFalse(emulator.emulator.echo)
+            self.assertEqual(dev.getNormalModeParams(1),(500,100))
+            dev.close()
+
+    def test_reset_without_sleep(self):
+        dev, emulator = openController()
+        dev.reset()
+        self.assertEqual(emulator.cmdCount['Reset'],1)
+        self.assertEqual(emulator.cmdCount.get('DEVICEINFO'),None)
+        self.assertTrue(emulator.echo)
+        dev.close()
+
+    def test_wait_ready_reopen(self):
+        with PtyEmulator() as emulator:
+            dev = LedController(emulator.port)
+            dt = dev.waitReady(1.0,reopen=True)
+            self.assertTrue(dt < 0.5)
+            self.assertTrue(dev.isOpen())
+            self.assertEqual(dev.getMode(1),'disable')
+            dev.close()
+
+    def test_wait_ready_timeout(self):
+        dev, emulator = openController(FaultyEmulator('DEVICEINFO',drops=100))
+        t0 = time.time()
+        with self.assertRaises(ResponseTimeout):
+            dev.waitReady(0.3)
+        self.assertTrue(time.time() - t0 < 1.0)
+        dev.close()
+
+    def test_store_returns_when_ready(self):
+        with PtyEmulator(SiriusEmulator(storeTime=0.3)) as emulator:
+            dev = LedController(emulator.port)
+            dev.setMode(1,'normal')
+            t0 = time.time()
+            dev.store()
+            dt = time.time() - t0
+            self.assertTrue(0.3 <= dt < STORE_TIMEOUT/2)
+            self.assertFalse(dev.dirty)
+            self.assertEqual(dev.getMode(1),'normal')
+            self.assertEqual(emulator.emulator.stored[0].mode,1)
+            dev.close()
+
+    def test_store_without_latency_model(self):
+        with PtyEmulator(SiriusEmulator(storeTime=0.3)) as emulator:
+            dev = LedController(emulator.port)
+            dev.latencyModel = None
+            dev.setMode(1,'normal')
+            dev.store()
+            self.assertFalse(dev.dirty)
+            self.assertEqual(dev.getMode(1),'normal')
+            dev.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
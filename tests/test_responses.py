@@ -0,0 +1,127 @@
+"""
+Tests of response framing, validation, retries and resynchronization after
+lost or late responses.
+"""
+import time
+import unittest
+
+from support import FaultyEmulator, SlowEmulator, openController
+from emulator import PtyEmulator
+from led_controller import LedController, ArgumentError, BatchError, ResponseTimeout
+
+
+class FramingTest(unittest.TestCase):
+
+    def test_returns_when_response_complete(self):
+        # Without a latency model the fixed timeout is the read deadline
+        with PtyEmulator(latency=0.002) as emulator:
+            dev = LedController(emulator.port,timeout=2.0)
+            dev.latencyModel = None
+            dev.setStrobeModeProfile(1,0,100,10)
+            calls = [
+                    ('getMode',(1,)),
+                    ('setMode',(1,'strobe')),
+                    ('getStrobeModeProfile',(1,)),
+                    ('getDeviceInfo',()),
+                    ]
+            for methodName, args in calls:
+                dev.lastLatency = None
+                t0 = time.time()
+                getattr(dev,methodName)(*args)
+                dt = time.time() - t0
+                self.assertTrue(dt < 0.2,methodName)
+                self.assertTrue(0.0 < dev.lastLatency <= dt,methodName)
+            for name in ('?MODE','?STRP','DEVICEINFO','MODE','STRP'):
+                self.assertTrue(dev.latency[name] > 0.0)
+            dev.close()
+
+
+class RetryTest(unittest.TestCase):
+
+    def test_lost_reply_is_retried(self):
+        dev, emulator = openController(FaultyEmulator('NORMAL',1),retries=1)
+        dev.setNormalModeParams(1,500,100)
+        self.assertEqual(emulator.cmdCount['NORMAL'],2)
+        self.assertEqual(dev.getNormalModeParams(1),(500,100))
+        dev.close()
+
+    def test_lost_reply_without_retries(self):
+        dev, emulator = openController(FaultyEmulator('NORMAL',1),retries=0)
+        with self.assertRaises(ResponseTimeout):
+            dev.setNormalModeParams(1,500,100)
+        dev.close()
+
+    def test_store_is_not_retried(self):
+        dev, emulator = openController(FaultyEmulator('STORE',1),retries=3)
+        dev.latencyModel.minTimeouts['STORE'] = 0.1
+        with self.assertRaises(ResponseTimeout):
+            dev.store(force=True)
+        self.assertEqual(emulator.cmdCount['STORE'],1)
+        self.assertTrue(dev.dirty)
+        dev.store(force=True)
+        self.assertFalse(dev.dirty)
+        dev.close()
+
+    def test_batch_tail_is_retried(self):
+        dev, emulator = openController(FaultyEmulator('STRP',1),retries=1)
+        dev.setStrobeModeProfileArray(1,[1,2,3],[10]*3,merge=False)
+        self.assertEqual(dev.getStrobeModeProfile(1),[(1,10),(2,10),(3,10)])
+        dev.close()
+
+    def test_rejected_setter_invalidates_cache(self):
+        dev, emulator = openController(cache=True)
+        dev.setNormalModeParams(1,100,50)
+        with self.assertRaises(ArgumentError):
+            dev.setNormalModeCurrent(1,500)
+        self.assertEqual(dev.getNormalModeParams(1),(100,50))
+        with self.assertRaises(ArgumentError):
+            dev.setNormalModeCurrent(1,500)
+        dev.close()
+
+
+class LateResponseTest(unittest.TestCase):
+    """
+    A response which arrives after the read timed out must not be read as the
+    response to the next command.
+    """
+
+    def setUp(self):
+        self.emulator = PtyEmulator(SlowEmulator('?STROBE',0.15,count=0))
+        self.dev = LedController(self.emulator.port,timeout=0.1)
+        self.dev.setStrobeModeParams(1,700,5)
+        self.dev.setTriggerModeParams(1,300,'falling')
+        self.emulator.emulator.count = 1
+
+    def tearDown(self):
+        self.dev.close()
+        self.emulator.close()
+
+    def checkNextResponses(self):
+        self.assertEqual(self.emulator.emulator.count,0)
+        self.assertEqual(self.dev.getTriggerModeParams(1),(300,'falling'))
+        self.assertEqual(self.dev.getMode(1),'disable')
+        self.dev.setMode(1,'normal')
+        self.assertEqual(self.emulator.emulator.channels[0].mode,1)
+        self.assertEqual(self.dev.getStrobeModeParams(1),(700,5))
+
+    def test_late_response_without_retries(self):
+        with self.assertRaises(ResponseTimeout):
+            self.dev.getStrobeModeParams(1)
+        self.checkNextResponses()
+
+    def test_late_response_with_retries(self):
+        self.dev.retries = 2
+        self.assertEqual(self.dev.getStrobeModeParams(1),(700,5))
+        self.assertEqual(self.emulator.emulator.cmdCount['?STROBE'],2)
+        self.checkNextResponses()
+
+    def test_late_response_in_batch(self):
+        # Read timeouts in a batch allow for the commands written ahead
+        self.emulator.emulator.delay = 0.35
+        with self.assertRaises(BatchError):
+            self.dev.getSnapshot()
+        self.checkNextResponses()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+"""
+Tests of the shadow cache, in particular that it stays consistent with the
+device when commands are skipped or dropped.
+"""
+import unittest
+
+from support import openController
+from snapshot import ChannelSettings
+
+
+class CacheConsistencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dev, self.emulator = openController(cache=True)
+
+    def tearDown(self):
+        self.dev.close()
+
+    def test_aborted_batch(self):
+        self.dev.setMode(1,'disable')
+        with self.assertRaises(ValueError):
+            with self.dev.batch():
+                self.dev.setNormalModeParams(1,500,100)
+                self.dev.setMode(1,'normal')
+                self.dev.setNormalModeCurrent(2,5000)
+        self.assertEqual(self.dev.getMode(1),'disable')
+        self.dev.setMode(1,'normal')
+        self.assertEqual(self.emulator.channels[0].mode,1)
+
+    def test_aborted_apply_settings(self):
+        self.dev.getSnapshot()
+        desired = [
+                ChannelSettings(chan=1,mode='normal',normalImax=500,normalIset=100),
+                ChannelSettings(chan=2,normalImax=500,normalIset=5000),
+                ]
+        with self.assertRaises(ValueError):
+            self.dev.applySettings(desired)
+        self.assertEqual(self.dev.getMode(1),'disable')
+        self.dev.applySettings(desired[:1])
+        self.assertEqual(self.emulator.channels[0].mode,1)
+
+    def test_duplicate_setters_skipped(self):
+        self.dev.setNormalModeParams(1,500,100)
+        self.dev.setNormalModeParams(1,500,100)
+        self.assertEqual(self.emulator.cmdCount['NORMAL'],1)
+
+
+if __name__ == '__main__':
+    unittest.main()
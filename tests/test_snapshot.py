@@ -0,0 +1,82 @@
+"""
+Tests of device snapshots, their serialization and printSettings.
+"""
+import sys
+import unittest
+from StringIO import StringIO
+
+from support import openController
+from emulator import DEVICE_INFO
+from led_controller import LedControllerError, SNAPSHOT_QUERIES
+from snapshot import ChannelSettings, DeviceSnapshot
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dev, self.emulator = openController(cache=True)
+        self.dev.setNormalModeParams(1,500,100)
+        self.dev.setMode(1,'normal')
+        self.dev.setStrobeModeParams(2,800,'forever')
+        self.dev.setStrobeModeProfile(2,0,300,1000)
+        self.dev.setStrobeModeProfile(2,1,0,2000)
+        self.dev.setTriggerModeParams(3,200,'falling')
+        self.dev.invalidate()
+        self.emulator.cmdCount = {}
+
+    def tearDown(self):
+        self.dev.close()
+
+    def test_snapshot(self):
+        snapshot = self.dev.getSnapshot()
+        self.assertEqual(snapshot.deviceInfo,DEVICE_INFO)
+        self.assertEqual(len(snapshot.channels),4)
+        for name in SNAPSHOT_QUERIES:
+            self.assertEqual(self.emulator.cmdCount[name],4)
+        self.assertEqual(self.emulator.cmdCount['DEVICEINFO'],1)
+        chan1 = snapshot.getChannel(1)
+        self.assertEqual((chan1.mode,chan1.normalImax,chan1.normalIset),('normal',500,100))
+        chan2 = snapshot.getChannel(2)
+        self.assertEqual((chan2.strobeImax,chan2.strobeRepeat),(800,9999))
+        self.assertEqual(chan2.strobeProfile,((300,1000),(0,2000)))
+        chan3 = snapshot.getChannel(3)
+        self.assertEqual((chan3.triggerImax,chan3.triggerPolarity),(200,'falling'))
+        self.assertEqual(chan3.triggerProfile,())
+
+    def test_snapshot_updates_cache(self):
+        self.dev.getSnapshot()
+        self.emulator.cmdCount = {}
+        self.assertEqual(self.dev.getMode(1),'normal')
+        self.assertEqual(self.dev.getStrobeModeProfile(2),[(300,1000),(0,2000)])
+        self.assertEqual(self.emulator.cmdCount,{})
+
+    def test_json_round_trip(self):
+        snapshot = self.dev.getSnapshot()
+        jsonStr = snapshot.toJson(indent=2)
+        copy = DeviceSnapshot.fromJson(jsonStr)
+        self.assertEqual(copy,snapshot)
+        self.assertTrue(isinstance(copy.channels[1],ChannelSettings))
+        self.assertEqual(copy.getChannel(2).strobeProfile,((300,1000),(0,2000)))
+        self.assertEqual(DeviceSnapshot.fromDict(snapshot.toDict()),snapshot)
+
+    def test_not_allowed_in_batch(self):
+        with self.assertRaises(LedControllerError):
+            with self.dev.batch():
+                self.dev.getSnapshot()
+
+    def test_print_settings(self):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.dev.printSettings()
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertTrue(DEVICE_INFO in output)
+        self.assertTrue('chan: 4' in output)
+        self.assertTrue('polarity: falling' in output)
+        self.assertEqual(self.emulator.cmdCount['?MODE'],4)
+
+
+if __name__ == '__main__':
+    unittest.main()
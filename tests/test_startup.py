@@ -0,0 +1,102 @@
+"""
+Tests of lazy startup, startup queries and state files.
+"""
+import unittest
+
+from support import RecordingEmulator, getTempFile
+from emulator import SiriusEmulator
+from transport import LoopbackTransport
+from led_controller import LedController, LedControllerError
+from snapshot import ChannelSettings
+from pwm_controller import PwmController
+
+
+class LazyStartupTest(unittest.TestCase):
+
+    def test_attributes_do_not_open_port(self):
+        dev = LedController('loop://',lazy=True)
+        self.assertFalse(dev.echo)
+        self.assertFalse(hasattr(dev,'misspelled'))
+        self.assertTrue(dev.transport is None)
+        dev.getMode(1)
+        self.assertTrue(dev.isOpen())
+        dev.close()
+
+    def test_startup_queries(self):
+        emulator = RecordingEmulator()
+        dev = LedController(LoopbackTransport(emulator),cache=True,startupQueries=['?MODE','?STROBE'])
+        self.assertEqual(len(emulator.lines),9)
+        self.assertEqual(emulator.lines[0],'ECHOOFF')
+        self.assertEqual(dev.getMode(2),'disable')
+        self.assertEqual(dev.getStrobeModeParams(2),(1000,1))
+        self.assertEqual(len(emulator.lines),9)
+        dev.close()
+
+    def test_lazy_connect_not_allowed_in_batch(self):
+        dev = LedController('loop://',lazy=True)
+        with self.assertRaises(LedControllerError):
+            with dev.batch():
+                dev.connect()
+        self.assertTrue(dev.transport is None)
+        dev.close()
+
+    def test_lazy_pwm_controller_set_value_all(self):
+        emulator = SiriusEmulator()
+        dev = PwmController(LoopbackTransport(emulator),lazy=True)
+        dev.setValueAll([0.5]*4)
+        self.assertEqual([c.mode for c in emulator.channels],[0]*4)
+        self.assertEqual(emulator.channels[0].strobeProfile[:2],[(1000,500),(0,500)])
+        dev.close()
+
+
+class StateFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stateFile = getTempFile(self)
+
+    def test_state_is_trusted(self):
+        emulator = SiriusEmulator()
+        dev = LedController(LoopbackTransport(emulator),stateFile=self.stateFile)
+        dev.setMode(1,'normal')
+        dev.close()
+        dev = LedController(LoopbackTransport(emulator),stateFile=self.stateFile)
+        count = emulator.cmdCount.get('?MODE',0)
+        self.assertEqual(dev.getMode(1),'normal')
+        self.assertEqual(emulator.cmdCount.get('?MODE',0),count)
+        dev.close()
+
+    def test_disable_is_never_skipped(self):
+        emulator = SiriusEmulator()
+        dev = LedController(LoopbackTransport(emulator),stateFile=self.stateFile)
+        dev.setMode(1,'disable')
+        dev.close()
+        # The device is changed after the state was saved
+        emulator.channels[0].mode = 1
+        dev = LedController(LoopbackTransport(emulator),stateFile=self.stateFile)
+        dev.setMode(1,'disable')
+        self.assertEqual(emulator.channels[0].mode,0)
+        dev.close()
+
+    def test_apply_settings_disable_is_never_skipped(self):
+        emulator = SiriusEmulator()
+        dev = LedController(LoopbackTransport(emulator),stateFile=self.stateFile)
+        dev.getSnapshot()
+        emulator.channels[2].mode = 1
+        cmdList = dev.applySettings([ChannelSettings(chan=3,mode='disable')])
+        self.assertEqual(cmdList,[('setMode',(3,'disable'))])
+        self.assertEqual(emulator.channels[2].mode,0)
+        dev.close()
+
+    def test_pwm_controller_disables_channels_with_stale_state(self):
+        emulator = SiriusEmulator()
+        dev = PwmController(LoopbackTransport(emulator),stateFile=self.stateFile)
+        dev.close()
+        for channel in emulator.channels:
+            channel.mode = 2
+        dev = PwmController(LoopbackTransport(emulator),stateFile=self.stateFile)
+        self.assertEqual([c.mode for c in emulator.channels],[0]*4)
+        dev.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
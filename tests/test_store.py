@@ -0,0 +1,133 @@
+"""
+Tests of dirty tracking and of deferred, coalesced stores.
+"""
+import time
+import threading
+import unittest
+
+from support import openController
+from led_controller import LedControllerError
+
+
+class DirtyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dev, self.emulator = openController()
+
+    def tearDown(self):
+        self.dev.close()
+
+    def test_store_only_when_dirty(self):
+        self.assertTrue(self.dev.dirty)
+        self.dev.store()
+        self.assertFalse(self.dev.dirty)
+        self.dev.store()
+        self.assertEqual(self.emulator.cmdCount['STORE'],1)
+        self.dev.store(force=True)
+        self.assertEqual(self.emulator.cmdCount['STORE'],2)
+
+    def test_setters_make_dirty(self):
+        self.dev.store()
+        self.dev.getMode(1)
+        self.dev.getSnapshot()
+        self.assertFalse(self.dev.dirty)
+        self.dev.setNormalModeParams(1,500,100)
+        self.assertTrue(self.dev.dirty)
+        self.dev.store()
+        with self.dev.batch():
+            self.dev.setStrobeModeProfile(1,0,100,10)
+        self.assertTrue(self.dev.dirty)
+        self.dev.store()
+        self.assertEqual(self.emulator.cmdCount['STORE'],3)
+        self.assertEqual(self.emulator.stored[0].strobeProfile[0],(100,10))
+
+    def test_store_not_allowed_in_batch(self):
+        with self.assertRaises(LedControllerError):
+            with self.dev.batch():
+                self.dev.store()
+
+
+class DeferStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dev, self.emulator = openController()
+
+    def tearDown(self):
+        self.dev.close()
+
+    def test_stores_coalesced(self):
+        with self.dev.deferStore():
+            for chan in range(1,5):
+                self.dev.setMode(chan,'normal')
+                self.dev.store()
+            with self.dev.deferStore():
+                self.dev.store()
+            self.assertEqual(self.emulator.cmdCount.get('STORE'),None)
+        self.assertEqual(self.emulator.cmdCount['STORE'],1)
+        self.assertFalse(self.dev.dirty)
+        self.assertEqual([c.mode for c in self.emulator.stored],[1]*4)
+
+    def test_no_store_if_not_requested_or_clean(self):
+        with self.dev.deferStore():
+            self.dev.setMode(1,'normal')
+        self.assertEqual(self.emulator.cmdCount.get('STORE'),None)
+        self.dev.store()
+        with self.dev.deferStore():
+            self.dev.store()
+        self.assertEqual(self.emulator.cmdCount['STORE'],1)
+
+    def test_no_store_after_error(self):
+        with self.assertRaises(ValueError):
+            with self.dev.deferStore():
+                self.dev.setMode(1,'normal')
+                self.dev.store()
+                raise ValueError
+        self.assertEqual(self.emulator.cmdCount.get('STORE'),None)
+
+    def test_force_is_not_deferred(self):
+        with self.dev.deferStore():
+            self.dev.store(force=True)
+            self.assertEqual(self.emulator.cmdCount['STORE'],1)
+
+    def test_debounce(self):
+        with self.dev.deferStore(debounce=0.05):
+            self.dev.setMode(1,'normal')
+            self.dev.store()
+            self.dev.setMode(2,'normal')
+            self.assertEqual(self.emulator.cmdCount.get('STORE'),None)
+            time.sleep(0.06)
+            # Written by the next command sent
+            self.dev.setMode(3,'normal')
+            self.assertEqual(self.emulator.cmdCount['STORE'],1)
+            self.assertEqual(self.emulator.stored[1].mode,1)
+            self.assertEqual(self.emulator.stored[2].mode,0)
+        self.assertEqual(self.emulator.cmdCount['STORE'],1)
+
+    def test_defer_store_is_per_thread(self):
+        entered = threading.Event()
+        release = threading.Event()
+        def deferred():
+            with self.dev.deferStore():
+                self.dev.setMode(1,'normal')
+                self.dev.store()
+                entered.set()
+                release.wait(2.0)
+        thread = threading.Thread(target=deferred)
+        thread.start()
+        entered.wait(2.0)
+        self.assertEqual(self.emulator.cmdCount.get('STORE'),None)
+
+        # Stores from other threads are not deferred
+        self.dev.setMode(2,'normal')
+        self.dev.store()
+        self.assertEqual(self.emulator.cmdCount['STORE'],1)
+        self.assertTrue(self.dev._deferredStore is None)
+
+        # The deferred store is dropped as nothing has changed since
+        release.set()
+        thread.join()
+        self.assertEqual(self.emulator.cmdCount['STORE'],1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+"""
+Tests of a controller shared between threads.
+"""
+import threading
+import unittest
+
+from support import openController
+
+
+class ThreadingTest(unittest.TestCase):
+
+    def test_shared_controller(self):
+        dev, emulator = openController(cache=False)
+        errors = []
+        def monitor():
+            try:
+                for i in range(50):
+                    self.assertTrue(dev.getMode(2) in ('normal','strobe','disable'))
+                    self.assertTrue('Mightex' in dev.getDeviceInfo())
+            except Exception, e:
+                errors.append(e)
+        def control():
+            try:
+                for i in range(50):
+                    dev.setNormalModeParams(1,1000,i)
+                    self.assertEqual(dev.getNormalModeParams(1),(1000,i))
+                    with dev.batch():
+                        dev.setStrobeModeProfile(3,0,i,10)
+                        dev.setStrobeModeProfile(3,1,0,10)
+            except Exception, e:
+                errors.append(e)
+        threadList = [threading.Thread(target=f) for f in (monitor,control,monitor)]
+        for thread in threadList:
+            thread.start()
+        for thread in threadList:
+            thread.join()
+        self.assertEqual(errors,[])
+        self.assertEqual(dev.getStrobeModeProfile(3),[(49,10),(0,10)])
+        dev.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Tests of the transports, in particular the TCP transport against a local
+stand-in for a serial-over-TCP server.
+"""
+import socket
+import unittest
+
+import support
+from emulator import SiriusEmulator, TcpEmulator
+from transport import LoopbackTransport, TcpTransport, TransportError, openTransport, parseSocketUrl
+from led_controller import LedController
+
+
+class TcpTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = TcpEmulator(latency=0.001)
+        self.addCleanup(self.emulator.close)
+
+    def test_controller_over_tcp(self):
+        dev = LedController(self.emulator.url)
+        self.assertTrue(isinstance(dev.transport,TcpTransport))
+        dev.setNormalModeParams(1,500,100)
+        dev.setMode(1,'normal')
+        self.assertEqual(dev.getNormalModeParams(1),(500,100))
+        self.assertEqual(dev.getMode(1),'normal')
+        with dev.batch():
+            for chan in range(1,5):
+                dev.setStrobeModeProfile(chan,0,100,chan)
+        snapshot = dev.getSnapshot()
+        self.assertEqual([c.strobeProfile[0] for c in snapshot.channels],[(100,i) for i in range(1,5)])
+        dev.close()
+
+    def test_reconnect_after_server_closes(self):
+        dev = LedController(self.emulator.url,retries=1)
+        dev.setMode(1,'normal')
+        dev.transport._sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(dev.getMode(1),'normal')
+        dev.close()
+
+    def test_reconnect_from_reader_and_writer(self):
+        dev = LedController(self.emulator.url)
+        for i in range(20):
+            # Both the writer, whose write fails, and the reader, which sees
+            # the server close the connection, try to reconnect
+            dev.transport._sock.shutdown(socket.SHUT_WR)
+            dev.setNormalModeCurrent(1,i)
+            self.assertEqual(dev.getNormalModeParams(1),(1000,i))
+        dev.close()
+
+    def test_no_reconnect(self):
+        transport = TcpTransport(self.emulator.url,timeout=0.1,reconnect=False)
+        transport.write('?MODE 1\r\n')
+        transport._sock.shutdown(socket.SHUT_RDWR)
+        with self.assertRaises(TransportError):
+            transport.write('?MODE 1\r\n')
+        transport.close()
+
+    def test_connect_error(self):
+        port = self.emulator.port
+        self.emulator.close()
+        with self.assertRaises(TransportError):
+            LedController('socket://127.0.0.1:{0}'.format(port))
+
+
+class OpenTransportTest(unittest.TestCase):
+
+    def test_open_transport(self):
+        transport = LoopbackTransport(SiriusEmulator())
+        self.assertTrue(openTransport(transport,timeout=0.2) is transport)
+        self.assertEqual(transport.timeout,0.2)
+        self.assertTrue(isinstance(openTransport('loop://'),LoopbackTransport))
+
+    def test_parse_socket_url(self):
+        self.assertEqual(parseSocketUrl('socket://localhost:4001'),('localhost',4001))
+        with self.assertRaises(ValueError):
+            parseSocketUrl('socket://localhost')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+Tests of the write scheduler and of urgent commands jumping ahead of a
+batch being sent.
+"""
+import time
+import threading
+import unittest
+
+from support import RecordingEmulator
+from emulator import PtyEmulator
+from led_controller import LedController, BatchError, CommandSuperseded
+from write_scheduler import WriteScheduler
+
+
+class CacheProbeEmulator(RecordingEmulator):
+    """
+    Emulator which records the cached mode of channel 1 of the controller,
+    set as the dev attribute, each time it processes the given line.
+    """
+
+    def __init__(self,line):
+        super(CacheProbeEmulator,self).__init__()
+        self.probeLine = line
+        self.dev = None
+        self.probed = []
+
+    def process(self,line):
+        if line.strip() == self.probeLine:
+            self.probed.append(self.dev.cache[1].mode)
+        return super(CacheProbeEmulator,self).process(line)
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_order(self):
+        cmdList = [
+                'STRP 1 0 500 100',
+                'STRP 2 0 5 5',
+                'MODE 1 2',
+                'MODE 2 0',
+                'MODE 3 0',
+                'STORE',
+                'MODE 4 0',
+                ]
+        order = [cmdList[i] for i in WriteScheduler().order(cmdList)]
+        self.assertEqual(order,[
+                'MODE 3 0',
+                'STRP 1 0 500 100',
+                'MODE 1 2',
+                'STRP 2 0 5 5',
+                'MODE 2 0',
+                'STORE',
+                'MODE 4 0',
+                ])
+
+    def test_window(self):
+        scheduler = WriteScheduler(baudrate=9600,maxDelay=0.1)
+        self.assertEqual(scheduler.windowBytes,96)
+        self.assertTrue(scheduler.canSend('x'*200,0,0))
+        self.assertFalse(scheduler.canSend('STRP 1 0 500 100',1,90))
+
+
+class UrgentCommandTest(unittest.TestCase):
+
+    def test_disable_jumps_ahead_of_upload(self):
+        with PtyEmulator() as emulator:
+            dev = LedController(emulator.port)
+            dev.setMode(2,'strobe')
+            upload = threading.Thread(
+                    target=dev.setStrobeModeProfileArray,
+                    args=(1,range(1,65),[10]*64),
+                    kwargs={'merge': False},
+                    )
+            upload.start()
+            time.sleep(0.2)
+            t0 = time.time()
+            dev.setMode(2,'disable')
+            dt = time.time() - t0
+            self.assertTrue(upload.is_alive())
+            upload.join()
+            self.assertTrue(dt < 0.5)
+            self.assertEqual(dev.getMode(2),'disable')
+            self.assertEqual(len(dev.getStrobeModeProfile(1)),64)
+            dev.close()
+
+    def test_cache_updated_before_disable_is_written(self):
+        recorder = CacheProbeEmulator('MODE 1 0')
+        with PtyEmulator(recorder) as emulator:
+            dev = LedController(emulator.port,cache=True)
+            recorder.dev = dev
+            dev.setMode(1,'strobe')
+            upload = threading.Thread(
+                    target=dev.setStrobeModeProfileArray,
+                    args=(2,range(1,65),[10]*64),
+                    kwargs={'merge': False},
+                    )
+            upload.start()
+            time.sleep(0.2)
+            dev.setMode(1,'disable')
+            self.assertTrue(upload.is_alive())
+            upload.join()
+            # The sending thread updated the cache under the controller's
+            # lock before writing the disable
+            self.assertEqual(recorder.probed,['disable'])
+            count = recorder.cmdCount.get('?MODE',0)
+            self.assertEqual(dev.getMode(1),'disable')
+            self.assertEqual(recorder.cmdCount.get('?MODE',0),count)
+            dev.close()
+
+    def test_disable_drops_unsent_commands_for_channel(self):
+        recorder = RecordingEmulator()
+        with PtyEmulator(recorder) as emulator:
+            dev = LedController(emulator.port,cache=True)
+            errors = []
+            def upload():
+                try:
+                    with dev.batch():
+                        for step in range(60):
+                            dev.setStrobeModeProfile(1,step,100,10)
+                        dev.setMode(1,'strobe')
+                except BatchError, e:
+                    errors.extend(e.errors)
+            thread = threading.Thread(target=upload)
+            thread.start()
+            time.sleep(0.2)
+            t0 = time.time()
+            dev.setMode(1,'disable')
+            dt = time.time() - t0
+            thread.join()
+            self.assertTrue(dt < 0.5)
+            # The disable was sent during the upload and nothing queued for
+            # the channel before it is written after it
+            lines = recorder.lines
+            n = lines.index('MODE 1 0')
+            self.assertTrue('STRP 1 0 100 10' in lines[:n])
+            self.assertFalse('MODE 1 2' in lines)
+            self.assertEqual([l for l in lines[n+1:] if l.startswith('STRP 1')],[])
+            self.assertTrue('MODE 1 2' in [cmd for cmd, e in errors])
+            self.assertTrue(all([isinstance(e,CommandSuperseded) for cmd, e in errors]))
+            self.assertEqual(recorder.channels[0].mode,0)
+            self.assertEqual(dev.getMode(1),'disable')
+            dev.invalidate()
+            self.assertEqual(dev.getMode(1),'disable')
+            dev.close()
+
+
+if __name__ == '__main__':
+    unittest.main()